@@ -0,0 +1,153 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from typing import Iterable, Optional
+import httpx
+
+logger = logging.getLogger(__name__)
+
+def http2_available() -> bool:
+    """Whether the optional h2 package needed for HTTP/2 is installed"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def retry_after_seconds(headers: httpx.Headers) -> Optional[float]:
+    """Parse a Retry-After header (seconds or HTTP date), None if missing or invalid"""
+    value = (headers.get('Retry-After') or '').strip()
+    if not value:
+        return None
+    if value.replace('.', '', 1).isdigit():
+        return float(value)
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+class RetryTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    Transport that retries failed connections and rejected requests
+
+    Wraps either a sync or an async transport (for httpx.AsyncClient).
+
+    Connection errors are retried for every method because the request never
+    reached the server; listed statuses are retried for the listed methods.
+    Waits honour Retry-After and otherwise use exponential backoff with full
+    jitter, so workers retrying after an outage do not hit the upstream in step.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, max_retries: int = 3,
+                 retry_statuses: Iterable[int] = (429, 502, 503, 504),
+                 retry_methods: Iterable[str] = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'),
+                 backoff_base: float = 0.5, max_backoff: float = 30.0):
+        """
+        Initialize retry transport
+
+        Args:
+            transport (httpx.BaseTransport): Transport doing the actual requests
+            max_retries (int): Retries after the first attempt
+            retry_statuses (Iterable[int]): Response statuses that are retried
+            retry_methods (Iterable[str]): Methods retried on those statuses
+            backoff_base (float): First backoff in seconds, doubled per retry
+            max_backoff (float): Upper bound of a single wait, Retry-After included
+        """
+        self.transport = transport
+        self.max_retries = max_retries
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_methods = frozenset(retry_methods)
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        """Seconds to wait before the next attempt"""
+        if response is not None:
+            retry_after = retry_after_seconds(response.headers)
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff_base * 2 ** attempt))
+
+    def _should_retry(self, attempt: int, request: httpx.Request,
+                      response: Optional[httpx.Response] = None,
+                      error: Optional[Exception] = None) -> Optional[float]:
+        """Seconds to wait before retrying, None if the outcome is final"""
+        if attempt >= self.max_retries:
+            return None
+        if error is not None:
+            delay = self._backoff(attempt)
+            logger.warning(f"Connection to {request.url.host} failed ({error.__class__.__name__}), "
+                           f"retrying in {delay:.2f}s")
+            return delay
+        if response.status_code not in self.retry_statuses or request.method not in self.retry_methods:
+            return None
+        delay = self._backoff(attempt, response)
+        logger.warning(f"{request.method} {request.url.host} returned {response.status_code}, "
+                       f"retrying in {delay:.2f}s")
+        return delay
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                response = self.transport.handle_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                delay = self._should_retry(attempt, request, error=e)
+                if delay is None:
+                    raise
+            else:
+                delay = self._should_retry(attempt, request, response)
+                if delay is None:
+                    return response
+                response.close()
+            attempt += 1
+            time.sleep(delay)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                response = await self.transport.handle_async_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                delay = self._should_retry(attempt, request, error=e)
+                if delay is None:
+                    raise
+            else:
+                delay = self._should_retry(attempt, request, response)
+                if delay is None:
+                    return response
+                await response.aclose()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def close(self) -> None:
+        self.transport.close()
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+def create_transport(limits: Optional[httpx.Limits] = None, http2: bool = True,
+                     max_retries: int = 3, asynchronous: bool = False,
+                     **retry_options) -> RetryTransport:
+    """
+    Create a pooled keep-alive transport with retries
+
+    Args:
+        limits (Optional[httpx.Limits]): Connection pool limits (per client, i.e. per upstream host)
+        http2 (bool): Negotiate HTTP/2 when the h2 package is installed
+        max_retries (int): See RetryTransport
+        asynchronous (bool): Build a transport for httpx.AsyncClient
+        **retry_options: Other RetryTransport options
+
+    Returns:
+        RetryTransport: Transport to pass to httpx.Client or httpx.AsyncClient
+    """
+    transport_class = httpx.AsyncHTTPTransport if asynchronous else httpx.HTTPTransport
+    transport = transport_class(
+        limits=limits or httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        http2=http2 and http2_available()
+    )
+    return RetryTransport(transport, max_retries=max_retries, **retry_options)
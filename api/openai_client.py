@@ -1,19 +1,149 @@
-from openai import OpenAI
+import asyncio
+import httpx
+import json
 import logging
-from typing import Optional
+import re
+from contextlib import nullcontext
+from typing import Dict, Iterator, Optional, Tuple
+from api.http_pool import create_transport
+from utils.admission import AdmissionController
+from utils.translation_cache import TranslationCache, looks_like_english, prompt_key
 
 logger = logging.getLogger(__name__)
 
 class OpenAIClient:
     """Client for interacting with OpenAI API"""
 
-    def __init__(self, api_key: str):
-        """Initialize OpenAI client with API key"""
-        self.client = OpenAI(api_key=api_key)
+    # Admission key of all chat completions
+    ADMISSION_KEY = 'openai'
+
+    def __init__(self, api_key: str, cache: Optional[TranslationCache] = None,
+                 skip_english: bool = True, base_url: Optional[str] = None,
+                 timeout: Optional[httpx.Timeout] = None, limits: Optional[httpx.Limits] = None,
+                 http2: bool = True, max_retries: int = 3, improve_model: str = 'gpt-4',
+                 admission: Optional[AdmissionController] = None):
+        """
+        Initialize OpenAI client with API key
+
+        Args:
+            api_key (str): OpenAI API key
+            cache (Optional[TranslationCache]): Persistent cache of translations
+            skip_english (bool): Return prompts that already look English untranslated
+            base_url (Optional[str]): API URL override (e.g. a local fake server)
+            timeout (Optional[httpx.Timeout]): Connect/read/write/pool timeouts
+            limits (Optional[httpx.Limits]): Connection pool limits
+            http2 (bool): Use HTTP/2 when available
+            max_retries (int): Retries of failed requests
+            improve_model (str): Chat model for prompt improvement (a smaller model
+                answers noticeably faster)
+            admission (Optional[AdmissionController]): Limits API calls (key 'openai');
+                answers from the cache do not count
+        """
+        # Imported on first construction, it is slow to import
+        from openai import AsyncOpenAI, OpenAI
+
+        timeout = timeout or httpx.Timeout(60.0, connect=5.0)
+        # The SDK retries with jittered backoff and honours Retry-After itself,
+        # so the pooled transport does no retries of its own
+        self.client = OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=max_retries,
+            http_client=httpx.Client(
+                timeout=timeout,
+                transport=create_transport(limits, http2, max_retries=0)
+            )
+        )
+        self.async_client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=max_retries,
+            http_client=httpx.AsyncClient(
+                timeout=timeout,
+                transport=create_transport(limits, http2, max_retries=0, asynchronous=True)
+            )
+        )
+        self.cache = cache
+        self.skip_english = skip_english
+        self.improve_model = improve_model
+        self.admission = admission
+
+    def _admitted(self):
+        """Context of one API call, held back by the admission controller"""
+        if self.admission is None:
+            return nullcontext()
+        return self.admission.admit(self.ADMISSION_KEY)
+
+    def _admitted_async(self):
+        """Async variant of _admitted"""
+        if self.admission is None:
+            return nullcontext()
+        return self.admission.admit_async(self.ADMISSION_KEY)
+
+    def _lookup_translation(self, prompt: str) -> Tuple[Optional[str], str]:
+        """
+        Answer a translation locally when possible
+
+        Returns:
+            Tuple[Optional[str], str]: Translation (None if the API is needed) and cache key
+        """
+        if self.skip_english and looks_like_english(prompt):
+            if self.cache is not None:
+                self.cache.incr('english_skips')
+            logger.info("Prompt already in English, skipping translation")
+            return prompt.strip(), None
+
+        key = prompt_key(prompt)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.incr('hits')
+                logger.info(f"Translation cache hit: {cached}")
+                return cached, key
+            self.cache.incr('misses')
+        return None, key
+
+    def cached_translation(self, prompt: str) -> Optional[str]:
+        """Translation available without calling the API, None otherwise (not counted in cache stats)"""
+        if self.skip_english and looks_like_english(prompt):
+            return prompt.strip()
+        if self.cache is None:
+            return None
+        return self.cache.get(prompt_key(prompt))
+
+    def _translation_request(self, prompt: str) -> Dict[str, any]:
+        """Chat completion arguments for a translation"""
+        system_message = """You are a professional translator.
+            Your task is to translate the given text to English.
+            Focus on:
+            - Accurate translation while maintaining the original meaning
+            - Natural English phrasing
+            - Preserving any technical or specific terms
+            Respond only with the English translation, no explanations."""
+
+        return {
+            'model': "gpt-4",
+            'messages': [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": f"Translate this text to English: {prompt}"}
+            ],
+            'temperature': 0.3,
+            'max_tokens': 200
+        }
+
+    def _store_translation(self, key: str, translated_prompt: str) -> None:
+        """Cache a translation returned by the API"""
+        if self.cache is not None:
+            self.cache.set(key, translated_prompt)
+        logger.info(f"Translated prompt: {translated_prompt}")
 
     def translate_to_english(self, prompt: str) -> str:
         """
         Translate the prompt to English using GPT-4
+
+        English prompts and prompts translated before are answered locally.
         
         Args:
             prompt (str): Original prompt to translate
@@ -22,36 +152,67 @@ class OpenAIClient:
             str: English translation of the prompt
         """
         try:
-            system_message = """You are a professional translator.
-            Your task is to translate the given text to English.
-            Focus on:
-            - Accurate translation while maintaining the original meaning
-            - Natural English phrasing
-            - Preserving any technical or specific terms
-            Respond only with the English translation, no explanations."""
+            translated_prompt, key = self._lookup_translation(prompt)
+            if translated_prompt is not None:
+                return translated_prompt
 
-            completion = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": f"Translate this text to English: {prompt}"}
-                ],
-                temperature=0.3,
-                max_tokens=200
-            )
+            with self._admitted():
+                completion = self.client.chat.completions.create(**self._translation_request(prompt))
+            translated_prompt = completion.choices[0].message.content.strip()
+            self._store_translation(key, translated_prompt)
+            return translated_prompt
 
+        except Exception as e:
+            logger.error(f"Error translating prompt: {str(e)}", exc_info=True)
+            raise
+
+    async def translate_to_english_async(self, prompt: str) -> str:
+        """Async variant of translate_to_english; cache lookups run in worker threads"""
+        try:
+            translated_prompt, key = await asyncio.to_thread(self._lookup_translation, prompt)
+            if translated_prompt is not None:
+                return translated_prompt
+
+            async with self._admitted_async():
+                completion = await self.async_client.chat.completions.create(
+                    **self._translation_request(prompt)
+                )
             translated_prompt = completion.choices[0].message.content.strip()
-            
-            logger.info(f"Translated prompt: {translated_prompt}")
+            await asyncio.to_thread(self._store_translation, key, translated_prompt)
             return translated_prompt
 
         except Exception as e:
             logger.error(f"Error translating prompt: {str(e)}", exc_info=True)
             raise
 
+    def translation_stats(self) -> Optional[Dict[str, any]]:
+        """Hit/miss counters of the translation cache, None without a cache"""
+        return self.cache.stats() if self.cache is not None else None
+
+    def _improvement_request(self, prompt: str) -> Dict[str, any]:
+        """Chat completion arguments for a prompt improvement"""
+        system_message = """You are an expert at writing prompts for AI image generation.
+            Your task is to enhance the given prompt to create more detailed and visually appealing images.
+            Focus on:
+            - Adding more descriptive details
+            - Specifying art style and medium
+            - Including lighting and atmosphere details
+            - Maintaining the original intent
+            Respond only with the enhanced prompt, no explanations."""
+
+        return {
+            'model': self.improve_model,
+            'messages': [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": f"Enhance this image prompt: {prompt}"}
+            ],
+            'temperature': 0.7,
+            'max_tokens': 200
+        }
+
     def improve_prompt(self, prompt: str) -> str:
         """
-        Improve the image generation prompt using GPT-4
+        Improve the image generation prompt using the improvement model
         
         Args:
             prompt (str): Original prompt to improve
@@ -60,24 +221,8 @@ class OpenAIClient:
             str: Improved prompt
         """
         try:
-            system_message = """You are an expert at writing prompts for AI image generation.
-            Your task is to enhance the given prompt to create more detailed and visually appealing images.
-            Focus on:
-            - Adding more descriptive details
-            - Specifying art style and medium
-            - Including lighting and atmosphere details
-            - Maintaining the original intent
-            Respond only with the enhanced prompt, no explanations."""
-
-            completion = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": f"Enhance this image prompt: {prompt}"}
-                ],
-                temperature=0.7,
-                max_tokens=200
-            )
+            with self._admitted():
+                completion = self.client.chat.completions.create(**self._improvement_request(prompt))
 
             improved_prompt = completion.choices[0].message.content.strip()
             
@@ -86,4 +231,117 @@ class OpenAIClient:
 
         except Exception as e:
             logger.error(f"Error improving prompt: {str(e)}", exc_info=True)
-            raise
\ No newline at end of file
+            raise
+
+    def improve_prompt_stream(self, prompt: str) -> Iterator[str]:
+        """
+        Improve the prompt, yielding the completion text as it is generated
+
+        Args:
+            prompt (str): Original prompt to improve
+
+        Yields:
+            str: Text fragments; joined and stripped they are the improved prompt
+        """
+        try:
+            # The slot is held until the whole completion has been read
+            with self._admitted():
+                stream = self.client.chat.completions.create(
+                    **self._improvement_request(prompt), stream=True
+                )
+                parts = []
+                try:
+                    for chunk in stream:
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if delta:
+                            parts.append(delta)
+                            yield delta
+                finally:
+                    # Also releases the connection when the consumer stops early
+                    stream.close()
+
+            logger.info(f"Improved prompt: {''.join(parts).strip()}")
+
+        except Exception as e:
+            logger.error(f"Error improving prompt: {str(e)}", exc_info=True)
+            raise
+
+    def _combined_request(self, prompt: str) -> Dict[str, any]:
+        """Chat completion arguments for translation and improvement in one call"""
+        system_message = """You are an expert at writing prompts for AI image generation.
+            Your task is to translate the given text to English and enhance it to create
+            more detailed and visually appealing images.
+            Focus on:
+            - Accurate translation while maintaining the original meaning
+            - Adding descriptive details, art style and medium
+            - Including lighting and atmosphere details
+            - Maintaining the original intent
+            Respond only with a JSON object, no explanations:
+            {"translation": "<faithful English translation>", "prompt": "<enhanced English prompt>"}"""
+
+        return {
+            'model': self.improve_model,
+            'messages': [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": f"Translate and enhance this image prompt: {prompt}"}
+            ],
+            'temperature': 0.7,
+            'max_tokens': 400
+        }
+
+    def _parse_combined(self, prompt: str, content: str) -> Dict[str, str]:
+        """Read the JSON answer of a combined call and cache its translation"""
+        # Models sometimes wrap JSON in a Markdown code fence
+        text = re.sub(r'^```(?:json)?\s*|\s*```$', '', content.strip())
+        try:
+            answer = json.loads(text)
+            improved_prompt = answer['prompt'].strip()
+            translated_prompt = (answer.get('translation') or improved_prompt).strip()
+        except (ValueError, KeyError, TypeError, AttributeError):
+            # Plain text answer: it is the English prompt, but not a faithful translation
+            logger.warning(f"Combined prompt answer is not JSON: {content}")
+            return {'translated_prompt': None, 'improved_prompt': content.strip()}
+
+        if not (self.skip_english and looks_like_english(prompt)):
+            self._store_translation(prompt_key(prompt), translated_prompt)
+        logger.info(f"Improved prompt: {improved_prompt}")
+        return {'translated_prompt': translated_prompt, 'improved_prompt': improved_prompt}
+
+    def translate_and_improve(self, prompt: str) -> Dict[str, str]:
+        """
+        Translate the prompt to English and improve it in a single completion
+
+        Replaces translate_to_english followed by improve_prompt, saving one
+        round trip. The translation is cached like translate_to_english's.
+
+        Args:
+            prompt (str): Original prompt
+
+        Returns:
+            Dict containing:
+                translated_prompt: Faithful English translation (None if the model
+                    did not answer in the requested format)
+                improved_prompt: Enhanced English prompt for the image model
+        """
+        try:
+            with self._admitted():
+                completion = self.client.chat.completions.create(**self._combined_request(prompt))
+            return self._parse_combined(prompt, completion.choices[0].message.content)
+
+        except Exception as e:
+            logger.error(f"Error translating and improving prompt: {str(e)}", exc_info=True)
+            raise
+
+    async def translate_and_improve_async(self, prompt: str) -> Dict[str, str]:
+        """Async variant of translate_and_improve"""
+        try:
+            async with self._admitted_async():
+                completion = await self.async_client.chat.completions.create(
+                    **self._combined_request(prompt)
+                )
+            return await asyncio.to_thread(self._parse_combined, prompt,
+                                           completion.choices[0].message.content)
+
+        except Exception as e:
+            logger.error(f"Error translating and improving prompt: {str(e)}", exc_info=True)
+            raise
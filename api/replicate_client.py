@@ -1,11 +1,9 @@
-import replicate
 import logging
-import requests
+import httpx
 from typing import Dict, Optional
-from replicate.exceptions import ModelError
 import base64
-import tempfile
 import os
+from api.http_pool import create_transport
 
 logger = logging.getLogger(__name__)
 
@@ -19,11 +17,128 @@ class ReplicateClient:
         'flux-schnell-lora': 'black-forest-labs/flux-schnell-lora'
     }
 
-    def __init__(self, api_token: str):
-        """Initialize Replicate client with API token"""
-        # API token is automatically loaded from REPLICATE_API_TOKEN env var
+    # Default number of concurrent generations per model (see JOB_MODEL_CONCURRENCY)
+    MODEL_CONCURRENCY = {
+        'flux-pro': 2,
+        'flux-1.1-pro-ultra': 1,
+        'flux-1.1-pro': 2,
+        'flux-schnell-lora': 4
+    }
+
+    # Relative cost of one generation (roughly its price), weights the shared
+    # upstream budget of the admission controller (see ADMISSION_MODEL_COSTS)
+    MODEL_COST = {
+        'flux-pro': 5,
+        'flux-1.1-pro-ultra': 6,
+        'flux-1.1-pro': 4,
+        'flux-schnell-lora': 1
+    }
+
+    # Base dimension to maintain consistent image sizes
+    BASE_DIMENSION = 1024
+
+    # Supported aspect ratios and their pixel dimensions
+    ASPECT_RATIOS = {
+        '1:1': (BASE_DIMENSION, BASE_DIMENSION),
+        '16:9': (BASE_DIMENSION, int(BASE_DIMENSION * 9/16)),
+        '3:2': (BASE_DIMENSION, int(BASE_DIMENSION * 2/3)),
+        '2:3': (int(BASE_DIMENSION * 2/3), BASE_DIMENSION),
+        '4:5': (int(BASE_DIMENSION * 4/5), BASE_DIMENSION),
+        '5:4': (BASE_DIMENSION, int(BASE_DIMENSION * 4/5)),
+        '9:16': (int(BASE_DIMENSION * 9/16), BASE_DIMENSION),
+        '3:4': (int(BASE_DIMENSION * 3/4), BASE_DIMENSION),
+        '4:3': (BASE_DIMENSION, int(BASE_DIMENSION * 3/4))
+    }
+
+    def __init__(self, api_token: str, base_url: Optional[str] = None,
+                 timeout: Optional[httpx.Timeout] = None, limits: Optional[httpx.Limits] = None,
+                 http2: bool = True, max_retries: int = 3):
+        """
+        Initialize Replicate client on a pooled keep-alive connection
+
+        Args:
+            api_token (str): Replicate API token
+            base_url (Optional[str]): API URL override (e.g. a local fake server)
+            timeout (Optional[httpx.Timeout]): Connect/read/write/pool timeouts
+            limits (Optional[httpx.Limits]): Connection pool limits
+            http2 (bool): Use HTTP/2 when available
+            max_retries (int): Retries of rejected prediction requests
+        """
+        # Imported on first construction, it is slow to import
+        import replicate
+
+        # The replicate library retries GET requests itself; the pool adds
+        # retries for refused connections and rate-limited prediction POSTs
+        retry_options = {'retry_statuses': (429,), 'retry_methods': ('POST',)}
+        self.client = replicate.Client(
+            api_token=api_token,
+            base_url=base_url,
+            timeout=timeout,
+            transport=create_transport(limits, http2, max_retries, **retry_options)
+        )
+        # Separate client for generate_image_async: the library builds its
+        # async connection pool from the same transport option
+        self.async_client = replicate.Client(
+            api_token=api_token,
+            base_url=base_url,
+            timeout=timeout,
+            transport=create_transport(limits, http2, max_retries, asynchronous=True,
+                                       **retry_options)
+        )
+
+    def _prepare(self, prompt: str, model_key: str, aspect_ratio: str,
+                 seed: Optional[int]) -> Dict:
+        """Validate a request and build the model input and result metadata"""
+        if model_key not in self.SUPPORTED_MODELS:
+            raise ValueError(f"Unsupported model: {model_key}")
+
+        # Convert aspect ratio to dimensions
+        width, height = self._get_dimensions(aspect_ratio)
+
+        # Generate seed
+        if seed is None:
+            seed = self._generate_seed()
+
+        model_input = {
+            "prompt": prompt,
+            "width": width,
+            "height": height,
+            "aspect_ratio": aspect_ratio,
+            "seed": seed
+        }
+
+        # Log API parameters
+        logger.info("Calling Replicate API with parameters", extra={
+            "model": self.SUPPORTED_MODELS[model_key],
+            **model_input
+        })
+
+        return {
+            'model': self.SUPPORTED_MODELS[model_key],
+            'input': model_input,
+            'metadata': {
+                'model': model_key,
+                'prompt': prompt,
+                'aspect_ratio': aspect_ratio,
+                'width': width,
+                'height': height,
+                'seed': seed
+            }
+        }
 
-    def generate_image(self, prompt: str, model_key: str, aspect_ratio: str) -> Dict:
+    def _log_error(self, e: Exception) -> None:
+        """Log a failed generation, with the details of a failed prediction"""
+        from replicate.exceptions import ModelError
+        if not isinstance(e, ModelError):
+            logger.error(f"Error generating image: {str(e)}", exc_info=True)
+            return
+        logger.error(f"Model error: {str(e)}", exc_info=True)
+        if hasattr(e, 'prediction'):
+            logger.error(f"Prediction ID: {e.prediction.id}")
+            logger.error(f"Prediction logs: {e.prediction.logs}")
+
+    def generate_image(self, prompt: str, model_key: str, aspect_ratio: str,
+                       seed: Optional[int] = None) -> Dict:
         """
         Generate image using specified model
         
@@ -31,76 +146,54 @@ class ReplicateClient:
             prompt (str): Image generation prompt
             model_key (str): Key of the model to use
             aspect_ratio (str): Desired aspect ratio (e.g., '1:1', '16:9')
+            seed (Optional[int]): Seed for a reproducible generation, random if None
         
         Returns:
-            Dict: Response containing image URL and metadata
+            Dict: Response containing the image data as an iterable of byte chunks ('output') and metadata
         """
-        if model_key not in self.SUPPORTED_MODELS:
-            raise ValueError(f"Unsupported model: {model_key}")
+        request = self._prepare(prompt, model_key, aspect_ratio, seed)
 
         try:
-            # Convert aspect ratio to dimensions
-            width, height = self._get_dimensions(aspect_ratio)
-            
-            # Generate seed
-            seed = self._generate_seed()
-            
-            # Log API parameters
-            logger.info("Calling Replicate API with parameters", extra={
-                "model": self.SUPPORTED_MODELS[model_key],
-                "prompt": prompt,
-                "width": width,
-                "height": height,
-                "aspect_ratio": aspect_ratio,
-                "seed": seed
-            })
-            
             # Run the model
-            output = replicate.run(
-                self.SUPPORTED_MODELS[model_key],
-                input={
-                    "prompt": prompt,
-                    "width": width,
-                    "height": height,
-                    "aspect_ratio": aspect_ratio,
-                    "seed": seed
-                }
-            )
+            output = self.client.run(request['model'], input=request['input'])
 
             # Log the output for debugging
-            logger.info(f"Model output: {output}")
+            logger.debug(f"Model output: {output}")
             
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.webp', mode='wb') as temp_file:
-                logger.info("Writing image data to file")
-                # Process all chunks of output
-                for chunk in output:
-                    if not chunk:
-                        continue
-                    temp_file.write(chunk)
-                temp_file.flush()
-                
-                # Return the path to the temporary file
-                return {
-                    'status': 'success',
-                    'image_url': temp_file.name,
-                    'metadata': {
-                        'model': model_key,
-                        'prompt': prompt,
-                        'aspect_ratio': aspect_ratio,
-                        'width': width,
-                        'height': height
-                    }
-                }
-
-        except ModelError as e:
-            logger.error(f"Model error: {str(e)}", exc_info=True)
-            if hasattr(e, 'prediction'):
-                logger.error(f"Prediction ID: {e.prediction.id}")
-                logger.error(f"Prediction logs: {e.prediction.logs}")
+            # The output is streamed lazily: chunks are downloaded while the
+            # caller writes them to storage
+            return {
+                'status': 'success',
+                'output': (chunk for chunk in output if chunk),
+                'metadata': request['metadata']
+            }
+
+        except Exception as e:
+            self._log_error(e)
             raise
+
+    async def generate_image_async(self, prompt: str, model_key: str, aspect_ratio: str,
+                                   seed: Optional[int] = None) -> Dict:
+        """
+        Async variant of generate_image for the asyncio job executor
+
+        Returns:
+            Dict: Same as generate_image, with 'output' an async iterable of byte chunks
+        """
+        request = self._prepare(prompt, model_key, aspect_ratio, seed)
+
+        try:
+            output = await self.async_client.async_run(request['model'], input=request['input'])
+            logger.debug(f"Model output: {output}")
+
+            return {
+                'status': 'success',
+                'output': (chunk async for chunk in output if chunk),
+                'metadata': request['metadata']
+            }
+
         except Exception as e:
-            logger.error(f"Error generating image: {str(e)}", exc_info=True)
+            self._log_error(e)
             raise
 
     def _generate_seed(self) -> int:
@@ -109,22 +202,7 @@ class ReplicateClient:
 
     def _get_dimensions(self, aspect_ratio: str) -> tuple[int, int]:
         """Convert aspect ratio to pixel dimensions"""
-        # Base dimension to maintain consistent image sizes
-        base_dim = 1024
-        
-        ratios = {
-            '1:1': (base_dim, base_dim),
-            '16:9': (base_dim, int(base_dim * 9/16)),
-            '3:2': (base_dim, int(base_dim * 2/3)),
-            '2:3': (int(base_dim * 2/3), base_dim),
-            '4:5': (int(base_dim * 4/5), base_dim),
-            '5:4': (base_dim, int(base_dim * 4/5)),
-            '9:16': (int(base_dim * 9/16), base_dim),
-            '3:4': (int(base_dim * 3/4), base_dim),
-            '4:3': (base_dim, int(base_dim * 3/4))
-        }
-        
-        if aspect_ratio not in ratios:
+        if aspect_ratio not in self.ASPECT_RATIOS:
             raise ValueError(f"Unsupported aspect ratio: {aspect_ratio}")
             
-        return ratios[aspect_ratio]
\ No newline at end of file
+        return self.ASPECT_RATIOS[aspect_ratio]
\ No newline at end of file
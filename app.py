@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request, send_from_directory, render_template
+from flask import Flask, jsonify, request, render_template, Response, stream_with_context, send_file, g, redirect
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -6,7 +6,23 @@ from pythonjsonlogger import jsonlogger
 from dotenv import load_dotenv
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import asyncio
+import click
+import functools
+import httpx
+import hashlib
+import itertools
+import json
+import math
+import queue
+import re
+import threading
+import time
+import uuid
+from contextlib import AsyncExitStack, ExitStack
+from datetime import datetime, timedelta
+from typing import Optional
+from utils import log_pipeline
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,15 +32,35 @@ logger = logging.getLogger()
 log_file = os.getenv('LOG_FILE', 'app.log')
 log_level = getattr(logging, os.getenv('LOG_LEVEL', 'INFO'))
 
-# Add file handler with rotation
-file_handler = RotatingFileHandler(log_file, maxBytes=1024*1024, backupCount=10)
-file_handler.setFormatter(jsonlogger.JsonFormatter())
-logger.addHandler(file_handler)
+def create_log_handlers():
+    """File handler (rotated per LOG_ROTATION) and console handler, both JSON"""
+    handlers = [
+        log_pipeline.file_handler(log_file, os.getenv('LOG_ROTATION', 'size')),
+        logging.StreamHandler()
+    ]
+    for handler in handlers:
+        handler.setFormatter(jsonlogger.JsonFormatter())
+    return handlers
 
-# Add console handler
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(jsonlogger.JsonFormatter())
-logger.addHandler(console_handler)
+# Sampling drops a share of INFO/DEBUG records, truncation caps prompts and payloads
+log_filters = [
+    log_pipeline.SamplingFilter(float(os.getenv('LOG_SAMPLE_RATE', 1.0))),
+    log_pipeline.TruncatingFilter(int(os.getenv('LOG_MAX_LENGTH', 2000)))
+]
+
+if os.getenv('LOG_ASYNC', 'true').lower() == 'true':
+    # Request threads only enqueue records, a background thread writes them
+    log_queue = log_pipeline.QueueLogging(
+        create_log_handlers,
+        queue_size=int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+        filters=log_filters
+    )
+    logger.addHandler(log_queue.handler)
+else:
+    for handler in create_log_handlers():
+        for log_filter in log_filters:
+            handler.addFilter(log_filter)
+        logger.addHandler(handler)
 
 logger.setLevel(log_level)
 
@@ -43,15 +79,135 @@ limiter = Limiter(
     key_func=get_remote_address,
     storage_uri=os.getenv('RATELIMIT_STORAGE_URL', 'memory://'),
     default_limits=[os.getenv('RATELIMIT_DEFAULT', '30/hour')],
-    strategy=os.getenv('RATELIMIT_STRATEGY', 'fixed-window')
+    strategy=os.getenv('RATELIMIT_STRATEGY', 'fixed-window'),
+    # Off for load tests from a single address
+    enabled=os.getenv('RATELIMIT_ENABLED', 'true').lower() == 'true'
 )
 
 # Load configuration
+# Directory holding images/, metadata/ and cache/ (e.g. a scratch copy for load tests)
+DATA_DIR = os.getenv('DATA_DIR', os.path.dirname(os.path.abspath(__file__)))
 app.config.update(
     REPLICATE_API_TOKEN=os.getenv('REPLICATE_API_TOKEN'),
     OPENAI_API_KEY=os.getenv('OPENAI_API_KEY'),
-    IMAGE_STORAGE_PATH=os.path.join(os.path.dirname(__file__), 'images'),
-    METADATA_STORAGE_PATH=os.path.join(os.path.dirname(__file__), 'metadata')
+    IMAGE_STORAGE_PATH=os.path.join(DATA_DIR, 'images'),
+    METADATA_STORAGE_PATH=os.path.join(DATA_DIR, 'metadata'),
+    CACHE_STORAGE_PATH=os.path.join(DATA_DIR, 'cache')
+)
+# Levels of hash-prefix directories in images/ and metadata/ (0 = flat layout)
+app.config['STORAGE_SHARD_DEPTH'] = int(os.getenv('STORAGE_SHARD_DEPTH', 2))
+app.config.update(
+    # Empty keeps images/ and metadata/ on the local disk; s3://bucket/prefix stores
+    # them in an S3-compatible object store (under <prefix>/images and <prefix>/metadata)
+    STORAGE_URL=os.getenv('STORAGE_URL', ''),
+    S3_ENDPOINT_URL=os.getenv('S3_ENDPOINT_URL') or None,
+    S3_REGION=os.getenv('S3_REGION') or None,
+    # Lifetime of the presigned URLs /images/<filename> redirects to (0 = proxy through the app)
+    STORAGE_PRESIGN_EXPIRES=int(os.getenv('STORAGE_PRESIGN_EXPIRES', 3600)),
+    # Local copies of recently used objects (originals for thumbnails, exports, proxying)
+    STORAGE_CACHE_PATH=os.getenv(
+        'STORAGE_CACHE_PATH',
+        os.path.join(app.config['CACHE_STORAGE_PATH'], 'objects')
+    ),
+    STORAGE_CACHE_MAX_BYTES=int(os.getenv('STORAGE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+)
+app.config.update(
+    THUMBNAIL_STORAGE_PATH=os.getenv(
+        'THUMBNAIL_STORAGE_PATH',
+        os.path.join(app.config['CACHE_STORAGE_PATH'], 'thumbnails')
+    ),
+    THUMBNAIL_WIDTHS=[int(w) for w in os.getenv('THUMBNAIL_WIDTHS', '256,512').split(',')],
+    THUMBNAIL_CACHE_MAX_BYTES=int(os.getenv('THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024)),
+    # Generate variants right after a generation instead of on first request
+    THUMBNAIL_PREGENERATE=os.getenv('THUMBNAIL_PREGENERATE', 'true').lower() == 'true'
+)
+app.config.update(
+    # Nodes sharing STORAGE_URL exchange metadata changes for their local indexes
+    # and image reference counts through Redis (redis://...); 'off' for one node
+    METADATA_SYNC_URL=os.getenv('METADATA_SYNC_URL', ''),
+    # Changes kept for nodes that are behind; one further behind rebuilds its index
+    METADATA_SYNC_MAX_ENTRIES=int(os.getenv('METADATA_SYNC_MAX_ENTRIES', 20000))
+)
+# Reference counts of content-addressed image blobs (empty = one file per image):
+# a SQLite path, or a redis:// URL shared by the nodes of an object store
+app.config['IMAGE_REFS_PATH'] = os.getenv(
+    'IMAGE_REFS_PATH',
+    app.config['METADATA_SYNC_URL']
+    if app.config['STORAGE_URL'] and app.config['METADATA_SYNC_URL'] not in ('', 'off')
+    else os.path.join(app.config['IMAGE_STORAGE_PATH'], 'refs.db')
+)
+app.config['METADATA_INDEX_PATH'] = os.getenv(
+    'METADATA_INDEX_PATH',
+    os.path.join(app.config['METADATA_STORAGE_PATH'], 'index.db')
+)
+app.config.update(
+    # Background storage check and repair (0 = off), run by one worker process per node
+    FSCK_INTERVAL=int(os.getenv('FSCK_INTERVAL', 6 * 3600)),
+    # Images without metadata younger than this may still be mid-generation
+    FSCK_GRACE=int(os.getenv('FSCK_GRACE', 3600))
+)
+app.config.update(
+    JOB_STORE_URL=os.getenv('JOB_STORE_URL', 'memory://'),
+    # threads (one thread per running job) or asyncio (coroutines on one event loop)
+    JOB_EXECUTOR=os.getenv('JOB_EXECUTOR', 'threads'),
+    JOB_TTL=int(os.getenv('JOB_TTL', 86400)),
+    JOB_MAX_QUEUED=int(os.getenv('JOB_MAX_QUEUED', 20)),
+    # Per-model overrides, e.g. "flux-pro=4,flux-schnell-lora=8"
+    JOB_MODEL_CONCURRENCY=os.getenv('JOB_MODEL_CONCURRENCY', ''),
+    # Maximum lifetime of a job event stream and keep-alive interval, in seconds
+    JOB_EVENTS_TIMEOUT=int(os.getenv('JOB_EVENTS_TIMEOUT', 300)),
+    JOB_EVENTS_HEARTBEAT=int(os.getenv('JOB_EVENTS_HEARTBEAT', 15)),
+    BATCH_MAX_VARIANTS=int(os.getenv('BATCH_MAX_VARIANTS', 16)),
+    BATCH_TIMEOUT=int(os.getenv('BATCH_TIMEOUT', 600))
+)
+app.config.update(
+    # sqlite:///<path> (shared by local workers), redis://... or empty to disable
+    TRANSLATION_CACHE_URL=os.getenv(
+        'TRANSLATION_CACHE_URL',
+        'sqlite:///' + os.path.join(app.config['CACHE_STORAGE_PATH'], 'translations.db')
+    ),
+    TRANSLATION_CACHE_MAX_ENTRIES=int(os.getenv('TRANSLATION_CACHE_MAX_ENTRIES', 10000)),
+    TRANSLATION_CACHE_TTL=int(os.getenv('TRANSLATION_CACHE_TTL', 30 * 86400)),
+    TRANSLATION_SKIP_ENGLISH=os.getenv('TRANSLATION_SKIP_ENGLISH', 'true').lower() == 'true'
+)
+app.config.update(
+    # Admission control of upstream calls: memory:// (per worker process) or
+    # redis://... (shared by all workers and nodes)
+    ADMISSION_STORE_URL=os.getenv('ADMISSION_STORE_URL', 'memory://'),
+    # Replicate budget in cost units per minute (0 = unlimited) and the most
+    # that may be spent at once; a generation costs its model's weight
+    ADMISSION_REPLICATE_RATE=float(os.getenv('ADMISSION_REPLICATE_RATE', 120)),
+    ADMISSION_REPLICATE_BURST=float(os.getenv('ADMISSION_REPLICATE_BURST', 30)),
+    # Per-model overrides of ReplicateClient.MODEL_COST, e.g. "flux-pro=5,flux-schnell-lora=1"
+    ADMISSION_MODEL_COSTS=os.getenv('ADMISSION_MODEL_COSTS', ''),
+    # Generations running at Replicate per model across all workers, e.g. "flux-1.1-pro-ultra=2"
+    ADMISSION_MODEL_IN_FLIGHT=os.getenv('ADMISSION_MODEL_IN_FLIGHT', ''),
+    # OpenAI requests per minute (0 = unlimited), burst and concurrent requests (0 = unlimited)
+    ADMISSION_OPENAI_RATE=float(os.getenv('ADMISSION_OPENAI_RATE', 300)),
+    ADMISSION_OPENAI_BURST=float(os.getenv('ADMISSION_OPENAI_BURST', 20)),
+    ADMISSION_OPENAI_IN_FLIGHT=int(os.getenv('ADMISSION_OPENAI_IN_FLIGHT', 0)),
+    # Requests are held back at most this long for capacity, then rejected with Retry-After
+    ADMISSION_MAX_WAIT=float(os.getenv('ADMISSION_MAX_WAIT', 30)),
+    # In-flight slots of workers that died mid-call are freed after this many seconds
+    ADMISSION_SLOT_TTL=float(os.getenv('ADMISSION_SLOT_TTL', 600))
+)
+# Chat model for /api/improve-prompt, e.g. gpt-4o-mini for faster answers
+app.config['OPENAI_IMPROVE_MODEL'] = os.getenv('OPENAI_IMPROVE_MODEL', 'gpt-4')
+
+app.config.update(
+    # Upstream API URL overrides, e.g. a local fake server for load tests
+    REPLICATE_BASE_URL=os.getenv('REPLICATE_BASE_URL'),
+    OPENAI_BASE_URL=os.getenv('OPENAI_BASE_URL'),
+    # Connection pool shared by all requests of a worker, one per upstream API
+    HTTP_CONNECT_TIMEOUT=float(os.getenv('HTTP_CONNECT_TIMEOUT', 5)),
+    HTTP_READ_TIMEOUT=float(os.getenv('HTTP_READ_TIMEOUT', 60)),
+    HTTP_WRITE_TIMEOUT=float(os.getenv('HTTP_WRITE_TIMEOUT', 30)),
+    HTTP_POOL_TIMEOUT=float(os.getenv('HTTP_POOL_TIMEOUT', 10)),
+    HTTP_MAX_CONNECTIONS=int(os.getenv('HTTP_MAX_CONNECTIONS', 20)),
+    HTTP_MAX_KEEPALIVE=int(os.getenv('HTTP_MAX_KEEPALIVE', 10)),
+    HTTP_KEEPALIVE_EXPIRY=float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30)),
+    HTTP2=os.getenv('HTTP2', 'true').lower() == 'true',
+    HTTP_MAX_RETRIES=int(os.getenv('HTTP_MAX_RETRIES', 3))
 )
 
 # Validate required environment variables
@@ -59,22 +215,226 @@ if not app.config['REPLICATE_API_TOKEN']:
     raise ValueError("REPLICATE_API_TOKEN environment variable is required")
 if not app.config['OPENAI_API_KEY']:
     raise ValueError("OPENAI_API_KEY environment variable is required")
+# A node's index and reference database would miss what other nodes write to the bucket
+if app.config['STORAGE_URL'] and not app.config['METADATA_SYNC_URL']:
+    raise ValueError("METADATA_SYNC_URL is required with STORAGE_URL: a redis:// URL shared by "
+                     "all nodes using the bucket, or 'off' when only this node uses it")
+if app.config['STORAGE_URL'] and not app.config['METADATA_INDEX_PATH']:
+    raise ValueError("METADATA_INDEX_PATH cannot be empty with STORAGE_URL: "
+                     "every gallery page and search would list the whole bucket")
+if (app.config['STORAGE_URL'] and app.config['METADATA_SYNC_URL'] != 'off'
+        and app.config['IMAGE_REFS_PATH']
+        and not app.config['IMAGE_REFS_PATH'].startswith(('redis://', 'rediss://', 'unix://'))):
+    raise ValueError("IMAGE_REFS_PATH must be a redis:// URL (or empty to store every image "
+                     "separately) when several nodes share STORAGE_URL")
 
 # Import API clients after environment variables are loaded
 from api.replicate_client import ReplicateClient
 from api.openai_client import OpenAIClient
-from utils.storage import ImageManager, MetadataManager
+from utils.storage import ImageManager, MetadataManager, ObjectCache, create_storage_backend
+from utils.jobs import AsyncJobManager, JobManager, JobQueueFull, create_job_backend
+from utils.translation_cache import create_translation_cache
+from utils.metadata_feed import create_metadata_feed
+from utils.thumbnails import ThumbnailManager
+from utils.export import ARCHIVE_FORMATS, export_members, stream_archive
+from utils.fsck import PeriodicCheck, check_storage
+from utils.admission import AdmissionController, AdmissionRejected, Limit, create_admission_backend
+from utils.lazy import LazyInstance
+from utils import metrics
+
+def parse_model_map(value: str, convert=int) -> dict:
+    """Parse per-model settings like flux-pro=4,flux-schnell-lora=8"""
+    settings = {}
+    for item in filter(None, value.split(',')):
+        model_key, _, setting = item.partition('=')
+        settings[model_key.strip()] = convert(setting)
+    return settings
 
 # Initialize clients and managers
-replicate_client = ReplicateClient(app.config['REPLICATE_API_TOKEN'])
-openai_client = OpenAIClient(app.config['OPENAI_API_KEY'])
-image_manager = ImageManager(app.config['IMAGE_STORAGE_PATH'])
-metadata_manager = MetadataManager(app.config['METADATA_STORAGE_PATH'])
+http_options = {
+    'timeout': httpx.Timeout(
+        app.config['HTTP_READ_TIMEOUT'],
+        connect=app.config['HTTP_CONNECT_TIMEOUT'],
+        write=app.config['HTTP_WRITE_TIMEOUT'],
+        pool=app.config['HTTP_POOL_TIMEOUT']
+    ),
+    'limits': httpx.Limits(
+        max_connections=app.config['HTTP_MAX_CONNECTIONS'],
+        max_keepalive_connections=app.config['HTTP_MAX_KEEPALIVE'],
+        keepalive_expiry=app.config['HTTP_KEEPALIVE_EXPIRY']
+    ),
+    'http2': app.config['HTTP2'],
+    'max_retries': app.config['HTTP_MAX_RETRIES']
+}
+
+# Generations spend a shared Replicate budget weighted by model cost and may
+# be limited in flight per model; OpenAI calls are counted one by one
+REPLICATE_ADMISSION_KEY = 'replicate'
+model_costs = {**ReplicateClient.MODEL_COST,
+               **parse_model_map(app.config['ADMISSION_MODEL_COSTS'], float)}
+admission_limits = {
+    REPLICATE_ADMISSION_KEY: Limit(rate=app.config['ADMISSION_REPLICATE_RATE'],
+                                   burst=app.config['ADMISSION_REPLICATE_BURST']),
+    OpenAIClient.ADMISSION_KEY: Limit(rate=app.config['ADMISSION_OPENAI_RATE'],
+                                      burst=app.config['ADMISSION_OPENAI_BURST'],
+                                      in_flight=app.config['ADMISSION_OPENAI_IN_FLIGHT'])
+}
+for model_key, in_flight in parse_model_map(app.config['ADMISSION_MODEL_IN_FLIGHT']).items():
+    admission_limits[model_key] = Limit(in_flight=in_flight)
+admission = AdmissionController(
+    create_admission_backend(app.config['ADMISSION_STORE_URL']),
+    admission_limits,
+    max_wait=app.config['ADMISSION_MAX_WAIT'],
+    slot_ttl=app.config['ADMISSION_SLOT_TTL']
+)
+
+def create_replicate_client() -> ReplicateClient:
+    """Build the Replicate client of this process"""
+    return ReplicateClient(
+        app.config['REPLICATE_API_TOKEN'],
+        base_url=app.config['REPLICATE_BASE_URL'],
+        **http_options
+    )
+
+def create_openai_client() -> OpenAIClient:
+    """Build the OpenAI client of this process"""
+    return OpenAIClient(
+        app.config['OPENAI_API_KEY'],
+        cache=create_translation_cache(
+            app.config['TRANSLATION_CACHE_URL'],
+            app.config['TRANSLATION_CACHE_MAX_ENTRIES'],
+            app.config['TRANSLATION_CACHE_TTL']
+        ),
+        skip_english=app.config['TRANSLATION_SKIP_ENGLISH'],
+        improve_model=app.config['OPENAI_IMPROVE_MODEL'],
+        admission=admission,
+        base_url=app.config['OPENAI_BASE_URL'],
+        **http_options
+    )
+
+# Both clients import their SDKs and open connection pools, so they are
+# built on first use in each worker process (see /ready)
+replicate_client = LazyInstance(create_replicate_client)
+openai_client = LazyInstance(create_openai_client)
+object_cache = ObjectCache(
+    app.config['STORAGE_CACHE_PATH'],
+    app.config['STORAGE_CACHE_MAX_BYTES']
+) if app.config['STORAGE_URL'] else None
+storage_backend = create_storage_backend(
+    app.config['STORAGE_URL'],
+    os.path.dirname(app.config['IMAGE_STORAGE_PATH']),
+    object_cache,
+    endpoint_url=app.config['S3_ENDPOINT_URL'],
+    region=app.config['S3_REGION']
+)
+image_manager = ImageManager(
+    app.config['IMAGE_STORAGE_PATH'],
+    shard_depth=app.config['STORAGE_SHARD_DEPTH'],
+    refs_path=app.config['IMAGE_REFS_PATH'] or None,
+    backend=storage_backend.child('images')
+)
+thumbnail_manager = ThumbnailManager(
+    image_manager,
+    app.config['THUMBNAIL_STORAGE_PATH'],
+    widths=app.config['THUMBNAIL_WIDTHS'],
+    max_bytes=app.config['THUMBNAIL_CACHE_MAX_BYTES']
+)
+metadata_manager = MetadataManager(
+    app.config['METADATA_STORAGE_PATH'],
+    index_path=app.config['METADATA_INDEX_PATH'],
+    shard_depth=app.config['STORAGE_SHARD_DEPTH'],
+    backend=storage_backend.child('metadata'),
+    feed=create_metadata_feed(
+        app.config['METADATA_SYNC_URL'] if app.config['STORAGE_URL'] else '',
+        app.config['METADATA_SYNC_MAX_ENTRIES']
+    )
+)
+# Once per node: in the gunicorn master with preload, otherwise the first
+# worker builds a missing index while the others wait for it
+metadata_manager.ensure_index()
+
+# Per-model concurrency limits for the generation job pool
+model_concurrency = {**ReplicateClient.MODEL_CONCURRENCY,
+                     **parse_model_map(app.config['JOB_MODEL_CONCURRENCY'])}
+
+# Threads block on the upstream APIs; the asyncio executor keeps many jobs
+# in flight on one event loop
+job_manager_class = {'threads': JobManager, 'asyncio': AsyncJobManager}[app.config['JOB_EXECUTOR']]
+job_manager = job_manager_class(
+    create_job_backend(app.config['JOB_STORE_URL'], app.config['JOB_TTL']),
+    model_concurrency,
+    max_queued=app.config['JOB_MAX_QUEUED']
+)
 
 # Ensure storage directories exist
 os.makedirs(app.config['IMAGE_STORAGE_PATH'], exist_ok=True)
 os.makedirs(app.config['METADATA_STORAGE_PATH'], exist_ok=True)
 
+@app.cli.command('rebuild-index')
+def rebuild_index_command():
+    """Rebuild the metadata index from the JSON files on disk"""
+    count = metadata_manager.rebuild_index()
+    print(f"Indexed {count} metadata records")
+
+@app.cli.command('migrate-storage')
+def migrate_storage_command():
+    """Move images and metadata from the flat layout into shard directories"""
+    images = image_manager.migrate_to_sharded()
+    metadata = metadata_manager.migrate_to_sharded()
+    print(f"Migrated {images} images and {metadata} metadata files")
+
+def run_storage_check(repair: bool = True, deep: bool = False) -> dict:
+    """Check images, metadata and the index for inconsistencies, see check_storage"""
+    report = check_storage(image_manager, metadata_manager, repair=repair, deep=deep,
+                           grace_seconds=app.config['FSCK_GRACE'])
+    if repair:
+        for filename in report['orphan_images'] + report['missing_images']:
+            thumbnail_manager.delete_variants(filename)
+    return report
+
+storage_check = PeriodicCheck(
+    run_storage_check,
+    os.path.join(app.config['CACHE_STORAGE_PATH'], 'fsck.lock'),
+    app.config['FSCK_INTERVAL']
+) if app.config['FSCK_INTERVAL'] > 0 else None
+background_pid = None
+background_lock = threading.Lock()
+
+@app.before_request
+def start_background_tasks():
+    """
+    Start the background threads of this process with its first request
+
+    Threads do not survive a fork, so they are started in the processes
+    that serve requests: not in a preloaded gunicorn master, nor in CLI
+    commands.
+    """
+    global background_pid
+    if background_pid == os.getpid():
+        return
+    with background_lock:
+        if background_pid != os.getpid():
+            background_pid = os.getpid()
+            if storage_check is not None:
+                storage_check.start()
+
+@app.cli.command('fsck')
+@click.option('--repair', is_flag=True, help='Fix what is found instead of only reporting it')
+@click.option('--deep', is_flag=True, help='Also validate records that are in the index')
+def fsck_command(repair, deep):
+    """Find orphan images, corrupt metadata and index drift"""
+    report = run_storage_check(repair=repair, deep=deep)
+    for finding, names in report.items():
+        print(f"{finding}: {len(names)}")
+        for name in names[:20]:
+            print(f"  {name}")
+
+@app.cli.command('dedup-images')
+def dedup_images_command():
+    """Move images stored as separate files into shared content-addressed blobs"""
+    result = image_manager.deduplicate()
+    print(f"Deduplicated {result['images']} images, freed {result['freed_bytes']} bytes")
+
 # Custom error handlers
 @app.errorhandler(400)
 def bad_request_error(error):
@@ -100,12 +460,27 @@ def not_found_error(error):
 def ratelimit_error(error):
     """Rate limit exceeded error handler"""
     logger.warning(f"Rate limit exceeded: {str(error)}")
+    metrics.RATE_LIMIT_HITS.labels(request.endpoint or 'unknown').inc()
     return jsonify({
         'error': 'Too many requests',
         'message': 'Rate limit exceeded. Please try again later.',
         'type': 'RateLimitError'
     }), 429
 
+def admission_rejected_response(error: AdmissionRejected):
+    """429 response telling the client when upstream capacity is expected back"""
+    logger.warning(str(error))
+    metrics.ADMISSION_REJECTIONS.labels(error.key).inc()
+    retry_after = max(math.ceil(error.retry_after), 1)
+    response = jsonify({
+        'error': 'Upstream capacity exhausted',
+        'message': str(error),
+        'type': 'AdmissionRejected',
+        'retry_after': retry_after
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
 @app.errorhandler(500)
 def internal_error(error):
     """Internal server error handler"""
@@ -131,54 +506,555 @@ def index():
     """Render main page"""
     return render_template('index.html')
 
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics_endpoint():
+    """Prometheus metrics, aggregated over all worker processes"""
+    payload, content_type = metrics.render_metrics(storage_usage)
+    return Response(payload, content_type=content_type)
+
 @app.route('/health', methods=['GET'])
-@limiter.limit("60/minute")
+@limiter.exempt
 def health_check():
-    """Basic health check endpoint"""
+    """Liveness check: the process answers requests, nothing else is touched"""
     return jsonify({'status': 'healthy'})
 
+def check_storage_access() -> None:
+    """Raise if images cannot be stored"""
+    if image_manager.backend.local:
+        if not os.access(app.config['IMAGE_STORAGE_PATH'], os.W_OK):
+            raise PermissionError(f"{app.config['IMAGE_STORAGE_PATH']} is not writable")
+    else:
+        # Fails on missing credentials or bucket, a missing object is fine
+        image_manager.backend.exists('ready')
+
+@app.route('/ready', methods=['GET'])
+@limiter.exempt
+def readiness_check():
+    """
+    Readiness check: this worker can serve the gallery and generations
+
+    Builds the API clients of the worker, so probing it before it takes
+    traffic keeps that cost out of the first user request. Answers 503
+    with the failed checks until everything works.
+    """
+    probes = {
+        'replicate_client': replicate_client.get,
+        'openai_client': openai_client.get,
+        'storage': check_storage_access,
+        'job_store': job_manager.backend.ping,
+        'admission_store': admission.backend.ping
+    }
+    if metadata_manager.index is not None:
+        probes['metadata_index'] = metadata_manager.index.ping
+    if metadata_manager.feed is not None:
+        probes['metadata_feed'] = metadata_manager.feed.ping
+
+    checks = {}
+    for name, probe in probes.items():
+        try:
+            probe()
+            checks[name] = 'ok'
+        except Exception as e:
+            logger.warning(f"Readiness check {name} failed: {str(e)}")
+            checks[name] = str(e)
+
+    ready = all(result == 'ok' for result in checks.values())
+    return jsonify({'status': 'ready' if ready else 'not ready', 'checks': checks}), 200 if ready else 503
+
+def find_cached_result(model: str, translated_prompt: str, aspect_ratio: str,
+                       seed: int) -> Optional[dict]:
+    """Result of an earlier generation with the same model, prompt, size and seed, or None"""
+    width, height = ReplicateClient.ASPECT_RATIOS[aspect_ratio]
+    metadata = metadata_manager.find_result(model, translated_prompt, width, height, seed)
+    if metadata is None or not image_manager.image_exists(metadata['image_filename']):
+        return None
+
+    metrics.RESULT_CACHE_HITS.labels(model).inc()
+    logger.info(f"Result cache hit: {metadata['image_filename']}", extra={'model': model, 'seed': seed})
+    return {
+        'image_id': os.path.splitext(metadata['image_filename'])[0],
+        'image_url': f"/images/{metadata['image_filename']}",
+        'cached': True
+    }
+
+def reserve_generation(model: str) -> float:
+    """
+    Spend a generation's cost from the Replicate budget when it is accepted
+
+    Returns:
+        float: time.monotonic() before which the generation must not start;
+            pass it to the pipeline as not_before
+
+    Raises:
+        AdmissionRejected: When the budget is exhausted for longer than ADMISSION_MAX_WAIT
+    """
+    return time.monotonic() + admission.reserve(REPLICATE_ADMISSION_KEY, model_costs[model])
+
+def refund_generation(model: str) -> None:
+    """Return the budget of a generation that did not reach Replicate"""
+    admission.refund(REPLICATE_ADMISSION_KEY, model_costs[model])
+
+def run_generation(set_state, prompt: str, model: str, aspect_ratio: str,
+                   translated_prompt: str = None, seed: int = None,
+                   extra_metadata: dict = None, use_cache: bool = False,
+                   improve: bool = False, not_before: float = None) -> dict:
+    """
+    Generation pipeline executed by the job pool
+
+    `improve` translates and enhances the prompt in one completion;
+    a given translated_prompt skips the language model entirely.
+    `not_before` comes from reserve_generation; the reservation is
+    refunded when the job ends before calling Replicate.
+    """
+    with metrics.track_generation(model):
+        try:
+            # Translate prompt to English unless the caller already did
+            if translated_prompt is None and improve:
+                set_state('translating')
+                with metrics.track_stage('translate_improve', model):
+                    translated_prompt = openai_client.translate_and_improve(prompt)['improved_prompt']
+                extra_metadata = {**(extra_metadata or {}), 'prompt_improved': True}
+            elif translated_prompt is None:
+                set_state('translating')
+                with metrics.track_stage('translate', model):
+                    translated_prompt = openai_client.translate_to_english(prompt)
+
+            # A seeded request may have been generated before
+            cached = None
+            if use_cache and seed is not None:
+                cached = find_cached_result(model, translated_prompt, aspect_ratio, seed)
+        except Exception:
+            if not_before is not None:
+                refund_generation(model)
+            raise
+        if cached is not None:
+            if not_before is not None:
+                refund_generation(model)
+            return cached
+
+        # Wait out the budget borrowed on admission (translation time counts),
+        # then for an in-flight slot of the model
+        if not_before is not None and not_before > time.monotonic():
+            set_state('waiting')
+            with metrics.track_stage('admission_wait', model):
+                time.sleep(max(not_before - time.monotonic(), 0))
+        with ExitStack() as stack:
+            try:
+                stack.enter_context(admission.slot(model))
+            except AdmissionRejected:
+                # No slot freed up, so Replicate was never called
+                if not_before is not None:
+                    refund_generation(model)
+                raise
+            # Generate image using Replicate with translated prompt
+            set_state('generating')
+            with metrics.track_stage('generate', model):
+                result = replicate_client.generate_image(translated_prompt, model, aspect_ratio,
+                                                         seed=seed)
+
+        # Stream image into storage (includes the download), then save metadata
+        set_state('saving')
+        with metrics.track_stage('save_image', model):
+            saved = image_manager.save_image_from_stream(result['output'])
+        return finish_generation(model, result['metadata'], saved, prompt, translated_prompt,
+                                 extra_metadata)
+
+async def run_generation_async(set_state, prompt: str, model: str, aspect_ratio: str,
+                               translated_prompt: str = None, seed: int = None,
+                               extra_metadata: dict = None, use_cache: bool = False,
+                               improve: bool = False, not_before: float = None) -> dict:
+    """Generation pipeline executed by the asyncio job executor (JOB_EXECUTOR=asyncio)"""
+    with metrics.track_generation(model):
+        try:
+            if translated_prompt is None and improve:
+                set_state('translating')
+                with metrics.track_stage('translate_improve', model):
+                    processed = await openai_client.translate_and_improve_async(prompt)
+                translated_prompt = processed['improved_prompt']
+                extra_metadata = {**(extra_metadata or {}), 'prompt_improved': True}
+            elif translated_prompt is None:
+                set_state('translating')
+                with metrics.track_stage('translate', model):
+                    translated_prompt = await openai_client.translate_to_english_async(prompt)
+
+            cached = None
+            if use_cache and seed is not None:
+                cached = await asyncio.to_thread(find_cached_result, model, translated_prompt,
+                                                 aspect_ratio, seed)
+        except Exception:
+            if not_before is not None:
+                await asyncio.to_thread(refund_generation, model)
+            raise
+        if cached is not None:
+            if not_before is not None:
+                await asyncio.to_thread(refund_generation, model)
+            return cached
+
+        if not_before is not None and not_before > time.monotonic():
+            set_state('waiting')
+            with metrics.track_stage('admission_wait', model):
+                await asyncio.sleep(max(not_before - time.monotonic(), 0))
+        async with AsyncExitStack() as stack:
+            try:
+                await stack.enter_async_context(admission.slot_async(model))
+            except AdmissionRejected:
+                if not_before is not None:
+                    await asyncio.to_thread(refund_generation, model)
+                raise
+            set_state('generating')
+            with metrics.track_stage('generate', model):
+                result = await replicate_client.generate_image_async(translated_prompt, model,
+                                                                     aspect_ratio, seed=seed)
+
+        set_state('saving')
+        with metrics.track_stage('save_image', model):
+            saved = await image_manager.save_image_from_async_stream(result['output'])
+        return await asyncio.to_thread(finish_generation, model, result['metadata'], saved,
+                                       prompt, translated_prompt, extra_metadata)
+
+def finish_generation(model: str, metadata: dict, saved: dict, prompt: str,
+                      translated_prompt: str, extra_metadata: dict = None) -> dict:
+    """Save metadata and variants of a stored image, the last stage of both pipelines"""
+    # Add original and translated prompts to metadata
+    metadata['original_prompt'] = prompt
+    metadata['translated_prompt'] = translated_prompt
+    if extra_metadata:
+        metadata.update(extra_metadata)
+
+    image_filename = saved['filename']
+    metadata['content_hash'] = saved['content_hash']
+    metadata['size_bytes'] = saved['size']
+    # The metadata file commits the generation; without it the image is an orphan
+    with metrics.track_stage('save_metadata', model):
+        try:
+            metadata_manager.save_metadata(image_filename, metadata)
+        except Exception:
+            image_manager.delete_image(image_filename)
+            raise
+
+    if app.config['THUMBNAIL_PREGENERATE']:
+        try:
+            with metrics.track_stage('thumbnails', model):
+                thumbnail_manager.generate_all(image_filename)
+        except Exception as e:
+            # Variants are regenerated on first request
+            logger.warning(f"Could not pregenerate variants of {image_filename}: {str(e)}")
+
+    return {
+        'image_id': os.path.splitext(image_filename)[0],
+        'image_url': f'/images/{image_filename}'
+    }
+
+generation_pipeline = (run_generation_async if isinstance(job_manager, AsyncJobManager)
+                       else run_generation)
+
+def storage_usage() -> dict:
+    """Storage sizes reported by /metrics"""
+    usage = {'bytes': {'thumbnails': thumbnail_manager.cache_size()}}
+    if metadata_manager.index is not None:
+        usage['bytes']['images'] = metadata_manager.index.total_size()
+        usage['bytes']['metadata_index'] = os.path.getsize(app.config['METADATA_INDEX_PATH'])
+        usage['images'] = metadata_manager.index.count()
+    if image_manager.refs is not None:
+        # Shared blobs are counted once
+        usage['bytes']['images'] = image_manager.refs.total_size()
+    if object_cache is not None:
+        usage['bytes']['object_cache'] = object_cache.cache_size()
+    return usage
+
+# Images are keyed by UUID and never rewritten
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600
+
 # Rate-limited endpoints
 @app.route('/api/generate-image', methods=['POST'])
 @limiter.limit("5/minute")
 def generate_image():
-    """Generate image endpoint with rate limiting"""
+    """Enqueue an image generation job with rate limiting"""
     try:
         data = request.get_json()
         prompt = data.get('prompt')
         model = data.get('model', 'flux-pro')
         aspect_ratio = data.get('aspect_ratio', '1:1')
+        seed = data.get('seed')
+        # Generate again even when this seeded request has been answered before
+        force = bool(data.get('force', False))
+        # The prompt is final English text (e.g. from /api/improve-prompt): no translation
+        prompt_processed = bool(data.get('prompt_processed', False))
+        # Translate and enhance the prompt in one language model call
+        improve = bool(data.get('improve', False))
 
         if not prompt:
             return jsonify({'error': 'Prompt is required'}), 400
+        if prompt_processed and improve:
+            return jsonify({'error': 'improve cannot be combined with prompt_processed'}), 400
+        if model not in ReplicateClient.SUPPORTED_MODELS:
+            return jsonify({'error': f'Unsupported model: {model}'}), 400
+        if aspect_ratio not in ReplicateClient.ASPECT_RATIOS:
+            return jsonify({'error': f'Unsupported aspect ratio: {aspect_ratio}'}), 400
+        if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+            return jsonify({'error': 'Seed must be an integer'}), 400
 
-        # Translate prompt to English
-        translated_prompt = openai_client.translate_to_english(prompt)
-
-        # Generate image using Replicate with translated prompt
-        result = replicate_client.generate_image(translated_prompt, model, aspect_ratio)
-
-        # Add original and translated prompts to metadata
-        result['metadata']['original_prompt'] = prompt
-        result['metadata']['translated_prompt'] = translated_prompt
+        # Answer a repeated seeded request right away when its translation is known locally
+        # (improved prompts differ on every call, so they are never known)
+        translated_prompt = prompt if prompt_processed else None
+        if seed is not None and not force and not improve:
+            try:
+                translated_prompt = translated_prompt or openai_client.cached_translation(prompt)
+                cached = translated_prompt is not None and find_cached_result(
+                    model, translated_prompt, aspect_ratio, seed
+                )
+                if cached:
+                    return jsonify({'status': 'done', **cached})
+            except Exception as e:
+                # The job below repeats the lookup
+                logger.warning(f"Result cache lookup failed: {str(e)}")
 
-        # Save image and metadata
-        image_filename = image_manager.save_image_from_file(result['image_url'])
-        metadata_filename = metadata_manager.save_metadata(image_filename, result['metadata'])
+        # Fails fast when the Replicate budget is exhausted beyond ADMISSION_MAX_WAIT
+        not_before = reserve_generation(model)
+        try:
+            job = job_manager.submit(
+                model,
+                functools.partial(generation_pipeline, prompt=prompt, model=model,
+                                  aspect_ratio=aspect_ratio, seed=seed, use_cache=not force,
+                                  translated_prompt=translated_prompt if prompt_processed else None,
+                                  improve=improve, not_before=not_before),
+                aspect_ratio=aspect_ratio,
+                seed=seed
+            )
+        except JobQueueFull:
+            refund_generation(model)
+            raise
 
         return jsonify({
-            'status': 'success',
-            'image_id': os.path.splitext(image_filename)[0],
-            'image_url': f'/images/{image_filename}'
-        })
+            'status': job['status'],
+            'job_id': job['id'],
+            'status_url': f"/api/jobs/{job['id']}",
+            'events_url': f"/api/jobs/{job['id']}/events"
+        }), 202
 
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    except JobQueueFull as e:
+        logger.warning(str(e))
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         logger.error(f"Error generating image: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/generate-batch', methods=['POST'])
+@limiter.limit("5/minute")
+def generate_batch():
+    """
+    Generate variants of one prompt across models, aspect ratios and seeds
+
+    The prompt is translated once (not at all with `prompt_processed`,
+    together with its enhancement with `improve`), the variants run
+    concurrently on the job pools and each result is streamed back as a
+    JSON line when it finishes.
+    """
+    try:
+        data = request.get_json()
+        prompt = data.get('prompt')
+        models = data.get('models') or [data.get('model', 'flux-pro')]
+        aspect_ratios = data.get('aspect_ratios') or [data.get('aspect_ratio', '1:1')]
+        seeds = data.get('seeds')
+        count = data.get('count', 1)
+
+        if not prompt:
+            return jsonify({'error': 'Prompt is required'}), 400
+        if not seeds:
+            if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+                return jsonify({'error': 'Count must be a positive integer'}), 400
+            seeds = [None] * count
+        for model in models:
+            if model not in ReplicateClient.SUPPORTED_MODELS:
+                return jsonify({'error': f'Unsupported model: {model}'}), 400
+        for aspect_ratio in aspect_ratios:
+            if aspect_ratio not in ReplicateClient.ASPECT_RATIOS:
+                return jsonify({'error': f'Unsupported aspect ratio: {aspect_ratio}'}), 400
+        if any(seed is not None and (not isinstance(seed, int) or isinstance(seed, bool))
+               for seed in seeds):
+            return jsonify({'error': 'Seeds must be integers'}), 400
+
+        if data.get('prompt_processed') and data.get('improve'):
+            return jsonify({'error': 'improve cannot be combined with prompt_processed'}), 400
+
+        variants = list(itertools.product(models, aspect_ratios, seeds))
+        if len(variants) > app.config['BATCH_MAX_VARIANTS']:
+            return jsonify({
+                'error': f"Batch is limited to {app.config['BATCH_MAX_VARIANTS']} variants"
+            }), 400
+
+        # The whole batch is admitted or rejected, before the prompt is translated
+        reserved = []
+        try:
+            for model, _, _ in variants:
+                reserved.append((model, reserve_generation(model)))
+
+            batch_metadata = {}
+            if data.get('prompt_processed'):
+                translated_prompt = prompt
+            elif data.get('improve'):
+                translated_prompt = openai_client.translate_and_improve(prompt)['improved_prompt']
+                batch_metadata['prompt_improved'] = True
+            else:
+                translated_prompt = openai_client.translate_to_english(prompt)
+        except Exception:
+            for model, _ in reserved:
+                refund_generation(model)
+            raise
+
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error starting batch: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+    batch_id = str(uuid.uuid4())
+    finished = queue.Queue()
+
+    for index, (model, aspect_ratio, seed) in enumerate(variants):
+        pipeline = functools.partial(
+            generation_pipeline,
+            prompt=prompt,
+            model=model,
+            aspect_ratio=aspect_ratio,
+            translated_prompt=translated_prompt,
+            seed=seed,
+            extra_metadata={'batch_id': batch_id, 'batch_index': index, 'batch_size': len(variants),
+                            **batch_metadata},
+            not_before=reserved[index][1]
+        )
+        try:
+            job_manager.submit(model, pipeline, on_finish=finished.put, batch_id=batch_id,
+                               batch_index=index, aspect_ratio=aspect_ratio, seed=seed)
+        except JobQueueFull as e:
+            refund_generation(model)
+            finished.put({'status': 'failed', 'error': str(e), 'batch_index': index,
+                          'model': model, 'aspect_ratio': aspect_ratio, 'seed': seed})
+
+    def generate():
+        yield json.dumps({
+            'type': 'batch',
+            'batch_id': batch_id,
+            'size': len(variants),
+            'translated_prompt': translated_prompt
+        }) + '\n'
+
+        deadline = time.monotonic() + app.config['BATCH_TIMEOUT']
+        for _ in variants:
+            try:
+                job = finished.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                yield json.dumps({'type': 'timeout', 'batch_id': batch_id}) + '\n'
+                return
+            line = {
+                'type': 'result',
+                'job_id': job.get('id'),
+                'batch_index': job['batch_index'],
+                'model': job['model'],
+                'aspect_ratio': job['aspect_ratio'],
+                'seed': job['seed'],
+                'status': job['status']
+            }
+            if job['status'] == 'done':
+                line.update(job['result'])
+            else:
+                line['error'] = job['error']
+            yield json.dumps(line) + '\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/batches/<batch_id>', methods=['GET'])
+@limiter.limit("30/minute")
+def get_batch(batch_id):
+    """Get metadata of all images generated by a batch"""
+    try:
+        images = metadata_manager.list_batch(batch_id)
+        if not images:
+            return jsonify({'error': 'Batch not found'}), 404
+        return jsonify({'batch_id': batch_id, 'images': images})
+
+    except Exception as e:
+        logger.error(f"Error getting batch: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@limiter.limit("120/minute")
+def get_job(job_id):
+    """Get generation job status with rate limiting"""
+    try:
+        job = job_manager.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job)
+
+    except Exception as e:
+        logger.error(f"Error getting job: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+@limiter.limit("30/minute")
+def job_events(job_id):
+    """Stream job state transitions as Server-Sent Events"""
+    if job_manager.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        deadline = time.monotonic() + app.config['JOB_EVENTS_TIMEOUT']
+        for job in job_manager.watch(job_id, app.config['JOB_EVENTS_HEARTBEAT']):
+            if job is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: state\ndata: {json.dumps(job)}\n\n"
+            if time.monotonic() > deadline:
+                break
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def improve_prompt_events(prompt: str):
+    """Server-Sent Events of a streamed prompt improvement"""
+    started = time.perf_counter()
+    parts = []
+    try:
+        with metrics.track_stage('improve_prompt', 'openai'):
+            for text in openai_client.improve_prompt_stream(prompt):
+                if not parts:
+                    metrics.STAGE_SECONDS.labels('improve_prompt_first_token', 'openai').observe(
+                        time.perf_counter() - started
+                    )
+                parts.append(text)
+                yield f"event: token\ndata: {json.dumps({'text': text})}\n\n"
+        yield f"event: done\ndata: {json.dumps({'improved_prompt': ''.join(parts).strip()})}\n\n"
+    except AdmissionRejected:
+        # Raised before the first event, answered with 429 by improve_prompt
+        raise
+    except Exception as e:
+        # Headers are already sent, the failure is reported in the stream
+        logger.error(f"Error improving prompt: {str(e)}", exc_info=True)
+        yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
 @app.route('/api/improve-prompt', methods=['POST'])
 @limiter.limit("10/minute")
 def improve_prompt():
-    """Improve prompt endpoint with rate limiting"""
+    """
+    Improve prompt endpoint with rate limiting
+
+    With `"stream": true` the completion is sent as Server-Sent Events while
+    it is generated: `token` events carry text fragments, the final `done`
+    event the whole improved prompt (`error` if the completion fails).
+    """
     try:
         data = request.get_json()
         prompt = data.get('prompt')
@@ -186,37 +1062,153 @@ def improve_prompt():
         if not prompt:
             return jsonify({'error': 'Prompt is required'}), 400
 
-        improved_prompt = openai_client.improve_prompt(prompt)
+        if data.get('stream'):
+            events = improve_prompt_events(prompt)
+            # Admission is decided before the first event, while a 429 can still be sent
+            first = next(events)
+            return Response(
+                stream_with_context(itertools.chain([first], events)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        with metrics.track_stage('improve_prompt', 'openai'):
+            improved_prompt = openai_client.improve_prompt(prompt)
         return jsonify({'improved_prompt': improved_prompt})
 
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
     except Exception as e:
         logger.error(f"Error improving prompt: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/translation-cache', methods=['GET'])
+@limiter.limit("30/minute")
+def translation_cache_stats():
+    """Translation cache hit/miss counters"""
+    try:
+        stats = openai_client.translation_stats()
+        if stats is None:
+            return jsonify({'error': 'Translation cache is disabled'}), 404
+        return jsonify(stats)
+
+    except Exception as e:
+        logger.error(f"Error getting translation cache stats: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/images', methods=['GET'])
 @limiter.limit("30/minute")
 def list_images():
-    """List images with pagination and rate limiting"""
+    """
+    List images with pagination and rate limiting
+
+    Passing `after` (empty for the first page, then the returned `next_cursor`)
+    switches to keyset pagination, which skips the total count.
+    """
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 12))
-        
-        result = metadata_manager.list_images(page, per_page)
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 12)), 1), 100)
+        after = request.args.get('after')
+
+        result = metadata_manager.list_images(page, per_page, after=after)
         return jsonify(result)
 
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error listing images: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/metadata/<image_id>', methods=['GET'])
+def parse_date_bound(value: Optional[str], end: bool = False) -> Optional[str]:
+    """Timestamp bound from an ISO date or datetime; a date-only `end` covers the whole day"""
+    if not value:
+        return None
+    try:
+        bound = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}")
+    if end and len(value) == 10:
+        bound += timedelta(days=1)
+    return bound.isoformat()
+
+@app.route('/api/search', methods=['GET'])
 @limiter.limit("30/minute")
+def search_images():
+    """
+    Search images by prompt text and model
+
+    Query parameters: `q` (words matched as prefixes, diacritics ignored),
+    `model`, `aspect_ratio`, `from`/`to` (ISO dates, inclusive), `sort`
+    (`rank` or `newest`), `page` and `per_page`.
+    """
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 12)), 1), 100)
+
+        result = metadata_manager.search(
+            request.args.get('q', ''),
+            model=request.args.get('model') or None,
+            aspect_ratio=request.args.get('aspect_ratio') or None,
+            since=parse_date_bound(request.args.get('from')),
+            until=parse_date_bound(request.args.get('to'), end=True),
+            order=request.args.get('sort', 'rank'),
+            page=page,
+            per_page=per_page
+        )
+        return jsonify(result)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error searching images: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+def metadata_etag(metadata: dict) -> str:
+    """Strong validator for a metadata record"""
+    return hashlib.sha256(json.dumps(metadata, sort_keys=True).encode()).hexdigest()[:32]
+
+def image_etag(filename: str, width: int = None) -> str:
+    """Content-hash ETag of an image or one of its variants, None for images saved without a hash"""
+    metadata = metadata_manager.get_metadata(f"{os.path.splitext(filename)[0]}.json")
+    if not metadata or not metadata.get('content_hash'):
+        return None
+    if width is None:
+        return metadata['content_hash']
+    return f"{metadata['content_hash']}-w{thumbnail_manager.nearest_width(width)}"
+
+def request_etag() -> str:
+    """Current ETag of the resource addressed by the request, looked up once per request"""
+    if 'etag' not in g:
+        view_args = request.view_args or {}
+        if request.endpoint == 'serve_image':
+            g.etag = image_etag(view_args['filename'], request.args.get('w', type=int))
+        elif request.endpoint == 'get_metadata':
+            metadata = metadata_manager.get_metadata(f"{view_args['image_id']}.json")
+            g.etag = metadata_etag(metadata) if metadata else None
+        else:
+            g.etag = None
+    return g.etag
+
+def is_revalidation() -> bool:
+    """Whether the client already holds the current version (answered with 304, no rate-limit cost)"""
+    if not request.if_none_match:
+        return False
+    etag = request_etag()
+    return etag is not None and request.if_none_match.contains(etag)
+
+@app.route('/api/metadata/<image_id>', methods=['GET'])
+@limiter.limit("30/minute", exempt_when=is_revalidation)
 def get_metadata(image_id):
-    """Get metadata for an image with rate limiting"""
+    """Get metadata for an image with rate limiting and ETag validation"""
     try:
         metadata = metadata_manager.get_metadata(f"{image_id}.json")
         if metadata is None:
             return jsonify({'error': 'Metadata not found'}), 404
-        return jsonify(metadata)
+
+        response = jsonify(metadata)
+        response.set_etag(request_etag())
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
 
     except Exception as e:
         logger.error(f"Error getting metadata: {str(e)}", exc_info=True)
@@ -230,8 +1222,11 @@ def delete_image(image_id):
         image_filename = f"{image_id}.webp"
         metadata_filename = f"{image_id}.json"
 
-        image_manager.delete_image(image_filename)
+        # Metadata first: an interrupted delete leaves an orphan image for fsck,
+        # never a gallery entry pointing to a missing file
         metadata_manager.delete_metadata(metadata_filename)
+        image_manager.delete_image(image_filename)
+        thumbnail_manager.delete_variants(image_filename)
 
         return jsonify({'status': 'success'})
 
@@ -239,11 +1234,162 @@ def delete_image(image_id):
         logger.error(f"Error deleting image: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+# Image ids are UUIDs; anything else could address files outside the stores
+IMAGE_ID_PATTERN = re.compile(r'^[A-Za-z0-9-]+$')
+
+def select_images(data: dict) -> list:
+    """
+    Image ids chosen by a bulk request
+
+    Args:
+        data (dict): Request body with either `ids` (list of image ids) or
+            `filter` ({'older_than': ISO date, 'model': model key}, at least one)
+
+    Returns:
+        list: Image ids
+    """
+    image_ids = data.get('ids')
+    filters = data.get('filter')
+    if (image_ids is None) == (filters is None):
+        raise ValueError("Provide either ids or filter")
+
+    if image_ids is not None:
+        if not isinstance(image_ids, list) or not all(
+                isinstance(image_id, str) and IMAGE_ID_PATTERN.match(image_id) for image_id in image_ids):
+            raise ValueError("ids must be a list of image ids")
+        return list(dict.fromkeys(image_ids))
+
+    # An empty filter would select the whole gallery
+    if not isinstance(filters, dict) or not (filters.get('older_than') or filters.get('model')):
+        raise ValueError("filter needs older_than and/or model")
+    return metadata_manager.find_image_ids(
+        model=filters.get('model') or None,
+        until=parse_date_bound(filters.get('older_than'))
+    )
+
+@app.route('/api/images/delete', methods=['POST'])
+@limiter.limit("10/minute")
+def delete_images():
+    """
+    Delete many images and their metadata in one batched operation
+
+    Takes `ids` or a `filter` (see select_images); `dry_run` only reports
+    what would be deleted.
+    """
+    try:
+        data = request.get_json() or {}
+        image_ids = select_images(data)
+        if data.get('dry_run'):
+            return jsonify({'status': 'dry_run', 'count': len(image_ids), 'image_ids': image_ids})
+
+        # Metadata first, like delete_image
+        metadata_manager.delete_metadata_many([f"{image_id}.json" for image_id in image_ids])
+        image_filenames = [f"{image_id}.webp" for image_id in image_ids]
+        deleted = image_manager.delete_images(image_filenames)
+        for image_filename in image_filenames:
+            thumbnail_manager.delete_variants(image_filename)
+
+        return jsonify({'status': 'success', 'requested': len(image_ids), 'deleted': deleted})
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error deleting images: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export', methods=['POST'])
+@limiter.limit("5/minute")
+def export_images():
+    """
+    Stream an archive of selected images and a metadata.jsonl of their metadata
+
+    Takes `ids` or a `filter` (see select_images) and `format` (`zip` or
+    `tar`). The archive is written straight to the response.
+    """
+    try:
+        data = request.get_json() or {}
+        archive_format = data.get('format', 'zip')
+        if archive_format not in ARCHIVE_FORMATS:
+            return jsonify({'error': f'Unsupported format: {archive_format}'}), 400
+        image_ids = select_images(data)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error starting export: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+    def records():
+        for image_id in image_ids:
+            metadata = metadata_manager.get_metadata(f"{image_id}.json")
+            if metadata:
+                yield metadata
+
+    def generate():
+        try:
+            yield from stream_archive(export_members(records(), image_manager.get_image_path),
+                                      archive_format)
+        except Exception as e:
+            # Headers are sent already; the client sees a truncated archive
+            logger.error(f"Error streaming export: {str(e)}", exc_info=True)
+            raise
+
+    filename = f"images-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{archive_format}"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=ARCHIVE_FORMATS[archive_format],
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 @app.route('/images/<filename>')
-@limiter.limit("60/minute")
+@limiter.limit("60/minute", exempt_when=is_revalidation)
 def serve_image(filename):
-    """Serve image files with rate limiting"""
-    return send_from_directory(app.config['IMAGE_STORAGE_PATH'], filename)
+    """
+    Serve image files with rate limiting
+
+    `?w=<width>` serves a resized variant (snapped to THUMBNAIL_WIDTHS).
+    Images never change once saved, so they are cacheable forever and
+    revalidations are answered with 304 without touching the file.
+    Originals in an object store are served by a redirect to a presigned URL.
+    """
+    width = request.args.get('w', type=int)
+    etag = request_etag()
+
+    if etag is not None and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif width is None and app.config['STORAGE_PRESIGN_EXPIRES'] > 0 and not image_manager.backend.local:
+        image_url = image_manager.get_image_url(filename, app.config['STORAGE_PRESIGN_EXPIRES'])
+        if image_url is None:
+            return jsonify({'error': 'Image not found'}), 404
+        response = redirect(image_url)
+        # The redirect may be reused until shortly before the signature expires
+        response.cache_control.private = True
+        response.cache_control.max_age = app.config['STORAGE_PRESIGN_EXPIRES'] // 2
+        return response
+    elif width is None:
+        image_path = image_manager.get_image_path(filename)
+        if image_path is None:
+            return jsonify({'error': 'Image not found'}), 404
+        response = send_file(image_path,
+                             etag=etag if etag is not None else True,
+                             max_age=IMAGE_CACHE_MAX_AGE)
+    else:
+        variant_path = thumbnail_manager.get_variant(filename, width)
+        if variant_path is None:
+            return jsonify({'error': 'Image not found'}), 404
+        response = send_file(variant_path, mimetype='image/webp',
+                             etag=etag if etag is not None else True,
+                             max_age=IMAGE_CACHE_MAX_AGE)
+
+    if etag is not None:
+        response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
 
 if __name__ == '__main__':
     # Get configuration from environment
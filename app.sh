@@ -40,7 +40,8 @@ case "$1" in
 
     # Run Gunicorn from the virtual environment
     # Assumes Flask app object is named 'app' in 'app.py'
-    venv/bin/gunicorn --bind "$BIND_ADDRESS" app:app
+    # Threaded workers so open event streams do not block other requests
+    venv/bin/gunicorn --worker-class gthread --threads 16 --bind "$BIND_ADDRESS" app:app
     ;;
   --debug)
     echo "Running app.py in debug mode using Flask development server"
@@ -0,0 +1,450 @@
+"""
+Load test the app under gunicorn against the fake upstream APIs
+
+Seeds a scratch DATA_DIR with a gallery of --records images, starts
+benchmarks/fake_upstream.py and gunicorn (gthread workers) on it, and runs
+scripted scenarios, each with --concurrency client threads:
+
+- gallery: random pages of /api/images
+- search: full-text queries on /api/search
+- images: originals and thumbnails from /images/<filename>
+- generate: /api/generate-image bursts, timed until the job is done
+- delete: /api/image/<id> of seeded images
+
+Every scenario reports throughput, p50/p95/p99 latency, errors and the
+peak RSS of each gunicorn worker, as a table on stderr and as JSON on
+stdout (or in --output). With --baseline the result is compared with an
+earlier JSON result, and the exit status is 1 when a scenario lost more
+throughput or gained more latency or memory than --tolerance allows.
+
+Jobs are polled over the connection that created them, which keeps them on
+one worker; pass --env JOB_STORE_URL=redis://... to share jobs instead.
+Worker memory is read from /proc (Linux).
+
+Usage:
+    python benchmarks/bench_app.py [--records 10000] [--requests 300] [--concurrency 16]
+        [--workers 2] [--scenarios gallery search images generate delete]
+        [--output result.json] [--baseline previous.json] [--env NAME=VALUE ...]
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fake_upstream import webp_data_url
+
+SCENARIOS = ('gallery', 'search', 'images', 'generate', 'delete')
+
+WORDS = ['kočka', 'pes', 'les', 'hrad', 'řeka', 'západ', 'slunce', 'hory', 'město', 'noc',
+         'zimní', 'krajina', 'portrét', 'moře', 'loď', 'květiny', 'akvarel', 'drak', 'robot', 'vesmír']
+MODELS = ['flux-pro', 'flux-1.1-pro', 'flux-1.1-pro-ultra', 'flux-schnell-lora']
+
+def seed(data_dir: str, records: int, image_size: int, distinct: int) -> List[str]:
+    """
+    Fill DATA_DIR with a gallery the way the app stores generations
+
+    Images share `distinct` contents (deduplicated into blobs), so large
+    galleries stay cheap on disk while every record has its own image.
+
+    Returns:
+        List[str]: Image filenames, newest last
+    """
+    from utils.storage import ImageManager, MetadataManager
+
+    image_manager = ImageManager(os.path.join(data_dir, 'images'),
+                                 refs_path=os.path.join(data_dir, 'images', 'refs.db'))
+    metadata_path = os.path.join(data_dir, 'metadata')
+    # Records are indexed once at the end instead of one upsert each
+    metadata_manager = MetadataManager(metadata_path)
+    contents = [base64.b64decode(webp_data_url(image_size, image_size).split(',', 1)[1])
+                for _ in range(distinct)]
+
+    filenames = []
+    start = datetime(2024, 1, 1)
+    for i in range(records):
+        saved = image_manager.save_image_from_stream([contents[i % distinct]])
+        prompt = ' '.join(random.sample(WORDS, 4))
+        metadata_manager.save_metadata(saved['filename'], {
+            'model': random.choice(MODELS),
+            'prompt': prompt,
+            'aspect_ratio': '1:1',
+            'width': image_size,
+            'height': image_size,
+            'original_prompt': prompt,
+            'translated_prompt': prompt,
+            'timestamp': (start + timedelta(seconds=i)).isoformat(),
+            'image_filename': saved['filename'],
+            'content_hash': saved['content_hash'],
+            'size_bytes': saved['size']
+        })
+        filenames.append(saved['filename'])
+
+    MetadataManager(metadata_path, index_path=os.path.join(metadata_path, 'index.db'))
+    return filenames
+
+def worker_pids(master_pid: int) -> List[int]:
+    """Process ids of the gunicorn workers (children of the master)"""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The parent pid follows the state, after the command name in parentheses
+        if int(stat.rsplit(')', 1)[1].split()[1]) == master_pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+def rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of a process in MB, None if it is gone"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+class MemorySampler:
+    """Samples the RSS of the gunicorn workers in a background thread, keeping the peaks"""
+
+    def __init__(self, master_pid: int, interval: float = 0.2):
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self) -> None:
+        for pid in worker_pids(self.master_pid):
+            rss = rss_mb(pid)
+            if rss is not None:
+                self.peaks[pid] = max(self.peaks.get(pid, 0), rss)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> 'MemorySampler':
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+# Scenario steps: called with an HTTP client (one per client thread) and the
+# request number, return the status code of the timed request
+
+def gallery_step(context: Dict) -> Callable[[httpx.Client, int], int]:
+    pages = max(1, len(context['filenames']) // 12)
+    return lambda client, i: client.get('/api/images', params={
+        'page': random.randint(1, pages), 'per_page': 12
+    }).status_code
+
+def search_step(context: Dict) -> Callable[[httpx.Client, int], int]:
+    return lambda client, i: client.get('/api/search', params={
+        'q': random.choice(WORDS), 'per_page': 12
+    }).status_code
+
+def images_step(context: Dict) -> Callable[[httpx.Client, int], int]:
+    def step(client: httpx.Client, i: int) -> int:
+        filename = random.choice(context['filenames'])
+        # Every other request asks for a thumbnail
+        params = {'w': 256} if i % 2 else None
+        return client.get(f'/images/{filename}', params=params).status_code
+    return step
+
+def generate_step(context: Dict) -> Callable[[httpx.Client, int], int]:
+    def step(client: httpx.Client, i: int) -> int:
+        response = client.post('/api/generate-image', json={
+            'prompt': f'kočka na okně číslo {i}',
+            'model': context['model']
+        })
+        if response.status_code != 202:
+            return response.status_code
+        status_url = response.json()['status_url']
+        deadline = time.monotonic() + 300
+        while time.monotonic() < deadline:
+            response = client.get(status_url)
+            if response.status_code != 200:
+                return response.status_code
+            status = response.json()['status']
+            if status == 'done':
+                return 200
+            if status == 'failed':
+                return 500
+            time.sleep(0.05)
+        return 504
+    return step
+
+def delete_step(context: Dict) -> Callable[[httpx.Client, int], int]:
+    def step(client: httpx.Client, i: int) -> int:
+        image_id = os.path.splitext(context['deletable'].pop())[0]
+        return client.delete(f'/api/image/{image_id}').status_code
+    return step
+
+SCENARIO_STEPS = {
+    'gallery': gallery_step,
+    'search': search_step,
+    'images': images_step,
+    'generate': generate_step,
+    'delete': delete_step
+}
+
+def run_scenario(name: str, base_url: str, requests: int, concurrency: int, context: Dict,
+                 master_pid: int) -> Dict:
+    """Send `requests` requests of a scenario from `concurrency` threads and measure them"""
+    step = SCENARIO_STEPS[name](context)
+    if name == 'delete':
+        requests = min(requests, len(context['deletable']))
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    latencies = []
+    statuses = {}
+    results_lock = threading.Lock()
+
+    def client_thread() -> None:
+        with httpx.Client(base_url=base_url, timeout=120) as client:
+            while True:
+                with counter_lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                started = time.perf_counter()
+                try:
+                    status = str(step(client, i))
+                except httpx.HTTPError as e:
+                    status = e.__class__.__name__
+                elapsed = time.perf_counter() - started
+                with results_lock:
+                    latencies.append(elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=client_thread) for _ in range(concurrency)]
+    with MemorySampler(master_pid) as memory:
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items()
+                 if not (status.isdigit() and int(status) < 400))
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'status_codes': statuses,
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(latencies) / duration, 2) if duration else 0,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 2),
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p95': round(percentile(latencies, 95) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2)
+        } if latencies else None,
+        # Peak per worker, in worker start order
+        'worker_rss_mb': [round(memory.peaks[pid], 1) for pid in sorted(memory.peaks)]
+    }
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Regressions of result against baseline beyond the tolerated relative change"""
+    regressions = []
+    for name, current in result['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous or not current['latency_ms'] or not previous.get('latency_ms'):
+            continue
+        checks = [
+            ('p95 ms', current['latency_ms']['p95'], previous['latency_ms']['p95'], True),
+            ('p99 ms', current['latency_ms']['p99'], previous['latency_ms']['p99'], True),
+            ('throughput rps', current['throughput_rps'], previous['throughput_rps'], False),
+            ('peak worker RSS MB', max(current['worker_rss_mb'], default=0),
+             max(previous.get('worker_rss_mb', []), default=0), True)
+        ]
+        for metric, now, before, higher_is_worse in checks:
+            if not before:
+                continue
+            change = (now - before) / before
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                regressions.append(f"{name}: {metric} {before} -> {now} ({change:+.0%})")
+    return regressions
+
+def git_commit() -> Optional[str]:
+    """Commit the benchmarked tree is at, None outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def wait_until_ready(base_url: str, server: subprocess.Popen, timeout: float = 120) -> None:
+    """Wait for /health to answer"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {server.returncode}")
+        try:
+            if httpx.get(f'{base_url}/health', timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"App did not become ready within {timeout}s")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--records', type=int, default=10000, help='Images in the seeded gallery')
+    parser.add_argument('--requests', type=int, default=300, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='Client threads')
+    parser.add_argument('--workers', type=int, default=2, help='Gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=16, help='Threads per gunicorn worker')
+    parser.add_argument('--model', default='flux-schnell-lora', help='Model of generate requests')
+    parser.add_argument('--replicate-latency', type=float, default=0.5)
+    parser.add_argument('--openai-latency', type=float, default=0.1)
+    parser.add_argument('--image-size', type=int, default=256,
+                        help='Width and height of seeded and generated images')
+    parser.add_argument('--distinct-images', type=int, default=32,
+                        help='Different image contents in the seeded gallery')
+    parser.add_argument('--port', type=int, default=8910, help='Port of the app')
+    parser.add_argument('--upstream-port', type=int, default=8900, help='Port of the fake upstream')
+    parser.add_argument('--env', nargs='*', default=[], metavar='NAME=VALUE',
+                        help='Extra settings for the app, e.g. JOB_EXECUTOR=asyncio')
+    parser.add_argument('--output', help='Write the JSON result to this file instead of stdout')
+    parser.add_argument('--baseline', help='Earlier JSON result to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative change counted as a regression')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch data directory')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='bench-app-')
+    upstream = server = None
+    try:
+        started = time.perf_counter()
+        filenames = seed(data_dir, args.records, args.image_size, args.distinct_images)
+        print(f"Seeded {args.records} images in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        upstream = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_ROOT, 'benchmarks', 'fake_upstream.py'),
+             '--port', str(args.upstream_port),
+             '--replicate-latency', str(args.replicate_latency),
+             '--openai-latency', str(args.openai_latency),
+             '--image-size', str(args.image_size)],
+            stdout=subprocess.PIPE, text=True
+        )
+        upstream.stdout.readline()
+
+        upstream_url = f'http://127.0.0.1:{args.upstream_port}'
+        env = {
+            **os.environ,
+            'DATA_DIR': data_dir,
+            'REPLICATE_API_TOKEN': 'benchmark',
+            'OPENAI_API_KEY': 'benchmark',
+            'REPLICATE_BASE_URL': upstream_url,
+            'OPENAI_BASE_URL': upstream_url + '/v1',
+            'RATELIMIT_ENABLED': 'false',
+            # Measure the app, not the configured upstream budgets
+            'ADMISSION_REPLICATE_RATE': '0',
+            'ADMISSION_OPENAI_RATE': '0',
+            'FSCK_INTERVAL': '0',
+            'LOG_FILE': os.path.join(data_dir, 'app.{pid}.log'),
+            'PROMETHEUS_MULTIPROC_DIR': os.path.join(data_dir, 'prometheus')
+        }
+        for setting in args.env:
+            name, _, value = setting.partition('=')
+            env[name] = value
+
+        base_url = f'http://127.0.0.1:{args.port}'
+        with open(os.path.join(data_dir, 'gunicorn.log'), 'w') as server_log:
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '--worker-class', 'gthread',
+                 '--workers', str(args.workers), '--threads', str(args.threads),
+                 '--bind', f'127.0.0.1:{args.port}', 'app:app'],
+                cwd=REPO_ROOT, env=env, stdout=server_log, stderr=subprocess.STDOUT
+            )
+        wait_until_ready(base_url, server)
+        idle_rss = [round(rss_mb(pid) or 0, 1) for pid in worker_pids(server.pid)]
+
+        # Deletes take the oldest images, the other scenarios pick from all of them
+        context = {
+            'filenames': filenames,
+            'deletable': list(reversed(filenames[:args.requests])),
+            'model': args.model
+        }
+        result = {
+            'benchmark': 'bench_app',
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'config': {name: value for name, value in vars(args).items()
+                       if name not in ('output', 'baseline', 'keep')},
+            'idle_worker_rss_mb': idle_rss,
+            'scenarios': {}
+        }
+
+        print(f"{'scenario':>9} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} "
+              f"{'p95 ms':>9} {'p99 ms':>9} {'RSS MB':>8}", file=sys.stderr)
+        for name in args.scenarios:
+            measured = run_scenario(name, base_url, args.requests, args.concurrency, context,
+                                    server.pid)
+            result['scenarios'][name] = measured
+            latency = measured['latency_ms'] or {'p50': 0, 'p95': 0, 'p99': 0}
+            print(f"{name:>9} {measured['requests']:>9} {measured['errors']:>7} "
+                  f"{measured['throughput_rps']:>8} {latency['p50']:>9} {latency['p95']:>9} "
+                  f"{latency['p99']:>9} {max(measured['worker_rss_mb'], default=0):>8}",
+                  file=sys.stderr)
+
+        regressions = []
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = compare(result, json.load(f), args.tolerance)
+            result['regressions'] = regressions
+            for regression in regressions:
+                print(f"REGRESSION {regression}", file=sys.stderr)
+
+        payload = json.dumps(result, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(payload + '\n')
+        else:
+            print(payload)
+        if regressions:
+            sys.exit(1)
+    finally:
+        for process in (server, upstream):
+            if process is not None:
+                process.terminate()
+                process.wait()
+        if args.keep:
+            print(f"Data kept in {data_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
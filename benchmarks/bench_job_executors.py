@@ -0,0 +1,145 @@
+"""
+Compare the thread pool and asyncio job executors under many in-flight generations
+
+Runs the generation pipeline (translate, generate, save image, save metadata)
+against the local fake upstream, with the real API clients and storage
+managers, once per executor in a fresh process. Reports wall time,
+throughput, peak thread count and peak RSS.
+
+Usage:
+    python benchmarks/bench_job_executors.py [--jobs 200] [--concurrency 200] [--latency 2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run_one(executor: str, jobs: int, concurrency: int, upstream_url: str) -> dict:
+    """Run all jobs on one executor and return its measurements"""
+    import httpx
+    from api.openai_client import OpenAIClient
+    from api.replicate_client import ReplicateClient
+    from utils.jobs import AsyncJobManager, JobManager, LocalJobBackend
+    from utils.storage import ImageManager, MetadataManager
+
+    workdir = tempfile.mkdtemp(prefix='bench-executors-')
+    try:
+        http_options = {
+            'timeout': httpx.Timeout(60.0, connect=5.0),
+            'limits': httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        }
+        replicate_client = ReplicateClient('token', base_url=upstream_url, **http_options)
+        openai_client = OpenAIClient('key', skip_english=False, base_url=upstream_url + '/v1',
+                                     **http_options)
+        image_manager = ImageManager(os.path.join(workdir, 'images'))
+        metadata_manager = MetadataManager(os.path.join(workdir, 'metadata'),
+                                           index_path=os.path.join(workdir, 'index.db'))
+
+        def pipeline(set_state, prompt):
+            set_state('translating')
+            translated = openai_client.translate_to_english(prompt)
+            set_state('generating')
+            result = replicate_client.generate_image(translated, 'flux-pro', '1:1')
+            set_state('saving')
+            saved = image_manager.save_image_from_stream(result['output'])
+            metadata_manager.save_metadata(saved['filename'], result['metadata'])
+
+        async def pipeline_async(set_state, prompt):
+            set_state('translating')
+            translated = await openai_client.translate_to_english_async(prompt)
+            set_state('generating')
+            result = await replicate_client.generate_image_async(translated, 'flux-pro', '1:1')
+            set_state('saving')
+            saved = await image_manager.save_image_from_async_stream(result['output'])
+            await asyncio.to_thread(metadata_manager.save_metadata, saved['filename'],
+                                    result['metadata'])
+
+        manager_class = AsyncJobManager if executor == 'asyncio' else JobManager
+        manager = manager_class(LocalJobBackend(), {'flux-pro': concurrency}, max_queued=jobs)
+        job_pipeline = pipeline_async if executor == 'asyncio' else pipeline
+
+        done = threading.Semaphore(0)
+        outcomes = []
+        peak_threads = threading.active_count()
+
+        def on_finish(job):
+            outcomes.append(job['status'] if job else 'failed')
+            done.release()
+
+        started = time.perf_counter()
+        for i in range(jobs):
+            manager.submit('flux-pro', lambda set_state, i=i: job_pipeline(set_state, f'kočka {i}'),
+                           on_finish=on_finish)
+        for _ in range(jobs):
+            while not done.acquire(timeout=0.05):
+                peak_threads = max(peak_threads, threading.active_count())
+        elapsed = time.perf_counter() - started
+        manager.shutdown()
+
+        return {
+            'executor': executor,
+            'jobs': jobs,
+            'concurrency': concurrency,
+            'failed': sum(1 for status in outcomes if status != 'done'),
+            'wall_s': round(elapsed, 2),
+            'jobs_per_s': round(jobs / elapsed, 1),
+            'peak_threads': peak_threads,
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=200,
+                        help='Per-model concurrency limit (threads or coroutines)')
+    parser.add_argument('--latency', type=float, default=2.0,
+                        help='Seconds the fake Replicate API takes per prediction')
+    parser.add_argument('--executors', nargs='+', default=['threads', 'asyncio'])
+    parser.add_argument('--port', type=int, default=8900, help='Port of the fake upstream')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    parser.add_argument('--upstream', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(args.run_one, args.jobs, args.concurrency, args.upstream)))
+        return
+
+    # The fake upstream runs in its own process so its threads do not skew the measurements
+    upstream = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_upstream.py'),
+         '--port', str(args.port), '--replicate-latency', str(args.latency),
+         '--openai-latency', str(args.latency / 10)],
+        stdout=subprocess.PIPE, text=True
+    )
+    upstream.stdout.readline()
+
+    print(f"upstream latency {args.latency}s, per-model concurrency {args.concurrency}")
+    print(f"{'executor':>9} {'jobs':>6} {'wall s':>8} {'jobs/s':>8} {'threads':>8} {'RSS MB':>8} {'failed':>7}")
+    try:
+        for executor in args.executors:
+            # A fresh process per executor keeps thread counts and RSS comparable
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run-one', executor,
+                 '--jobs', str(args.jobs), '--concurrency', str(args.concurrency),
+                 '--upstream', f"http://127.0.0.1:{args.port}"],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{executor:>9} {result['jobs']:>6} {result['wall_s']:>8} {result['jobs_per_s']:>8} "
+                  f"{result['peak_threads']:>8} {result['peak_rss_mb']:>8} {result['failed']:>7}")
+    finally:
+        upstream.terminate()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark MetadataManager.list_images with and without the SQLite index
+
+Usage:
+    python benchmarks/bench_list_images.py [--sizes 1000 10000 100000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.storage import MetadataManager
+
+def populate(storage_path: str, count: int) -> None:
+    """Write count fake metadata files"""
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        image_id = str(uuid.uuid4())
+        metadata = {
+            'model': 'flux-pro',
+            'prompt': f'benchmark prompt {i}',
+            'aspect_ratio': '1:1',
+            'width': 1024,
+            'height': 1024,
+            'original_prompt': f'benchmark prompt {i}',
+            'translated_prompt': f'benchmark prompt {i}',
+            'timestamp': (start + timedelta(seconds=i)).isoformat(),
+            'image_filename': f'{image_id}.webp'
+        }
+        with open(os.path.join(storage_path, f'{image_id}.json'), 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+def time_pages(manager: MetadataManager, pages: list, per_page: int, repeat: int) -> float:
+    """Average milliseconds per list_images call over the given pages"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            manager.list_images(page, per_page)
+    return (time.perf_counter() - started) * 1000 / (repeat * len(pages))
+
+def run(size: int, per_page: int, repeat: int) -> None:
+    """Benchmark one store size"""
+    workdir = tempfile.mkdtemp(prefix='bench-list-images-')
+    try:
+        storage_path = os.path.join(workdir, 'metadata')
+        os.makedirs(storage_path)
+        populate(storage_path, size)
+
+        last_page = max(1, (size + per_page - 1) // per_page)
+        pages = [1, max(1, last_page // 2), last_page]
+
+        scan_manager = MetadataManager(storage_path)
+        scan_ms = time_pages(scan_manager, pages, per_page, repeat)
+
+        started = time.perf_counter()
+        index_manager = MetadataManager(storage_path, index_path=os.path.join(workdir, 'index.db'))
+        rebuild_ms = (time.perf_counter() - started) * 1000
+        index_ms = time_pages(index_manager, pages, per_page, repeat)
+
+        print(f"{size:>8} {scan_ms:>12.2f} {index_ms:>12.2f} {scan_ms / index_ms:>9.1f}x {rebuild_ms:>12.0f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--per-page', type=int, default=12)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'entries':>8} {'scan ms':>12} {'index ms':>12} {'speedup':>10} {'rebuild ms':>12}")
+    for size in args.sizes:
+        run(size, args.per_page, args.repeat)
+
+if __name__ == '__main__':
+    main()
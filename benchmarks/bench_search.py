@@ -0,0 +1,94 @@
+"""
+Benchmark prompt search over the SQLite full-text index
+
+Fills an index with synthetic records (random prompts from a small
+vocabulary, so common words match a large share of the gallery) and times
+typical queries.
+
+Usage:
+    python benchmarks/bench_search.py [--size 100000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.metadata_index import MetadataIndex
+
+CZECH_WORDS = ['kočka', 'pes', 'les', 'hrad', 'řeka', 'západ', 'slunce', 'hory', 'město', 'noc',
+               'zimní', 'krajina', 'portrét', 'starý', 'muž', 'žena', 'dítě', 'moře', 'loď', 'květiny',
+               'akvarel', 'olejomalba', 'fotografie', 'neon', 'déšť', 'mlha', 'zámek', 'drak', 'robot', 'vesmír']
+ENGLISH_WORDS = ['cat', 'dog', 'forest', 'castle', 'river', 'sunset', 'sun', 'mountains', 'city', 'night',
+                 'winter', 'landscape', 'portrait', 'old', 'man', 'woman', 'child', 'sea', 'ship', 'flowers',
+                 'watercolor', 'oil painting', 'photograph', 'neon', 'rain', 'fog', 'chateau', 'dragon',
+                 'robot', 'space']
+MODELS = ['flux-pro', 'flux-1.1-pro', 'flux-1.1-pro-ultra', 'flux-schnell-lora']
+ASPECT_RATIOS = ['1:1', '16:9', '3:2', '2:3', '9:16']
+
+QUERIES = {
+    'common word': {'match': 'kočka'},
+    'two words': {'match': 'kočka noc'},
+    'prefix': {'match': 'hor'},
+    'no diacritics': {'match': 'zamek'},
+    'english': {'match': 'dragon castle'},
+    'word + model': {'match': 'pes', 'model': 'flux-pro'},
+    'word + month': {'match': 'les', 'since': '2024-03-01', 'until': '2024-04-01'},
+    'word, newest': {'match': 'řeka', 'order': 'newest'},
+    'word, page 50': {'match': 'moře', 'offset': 49 * 12},
+    'filters only': {'model': 'flux-schnell-lora', 'aspect_ratio': '16:9'},
+}
+
+def records(size: int, seed: int = 1):
+    """Yield (image_id, metadata) pairs of synthetic generations"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    for i in range(size):
+        words = rng.sample(range(len(CZECH_WORDS)), rng.randint(3, 8))
+        yield str(uuid.uuid4()), {
+            'model': rng.choice(MODELS),
+            'aspect_ratio': rng.choice(ASPECT_RATIOS),
+            'original_prompt': ' '.join(CZECH_WORDS[w] for w in words),
+            'translated_prompt': ' '.join(ENGLISH_WORDS[w] for w in words),
+            'timestamp': (start + timedelta(minutes=3 * i)).isoformat(),
+            'image_filename': f'{i}.webp'
+        }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-search-')
+    try:
+        index = MetadataIndex(os.path.join(workdir, 'index.db'))
+        started = time.perf_counter()
+        index.rebuild(records(args.size))
+        print(f"indexed {args.size} records in {time.perf_counter() - started:.1f} s")
+
+        print(f"{'query':>16} {'matches':>9} {'mean ms':>9} {'p95 ms':>9}")
+        for name, params in QUERIES.items():
+            params = dict(params)
+            if 'match' in params:
+                params['match'] = MetadataIndex.match_query(params['match'])
+            timings = []
+            for _ in range(args.repeat):
+                query_started = time.perf_counter()
+                _, total = index.search(**params)
+                timings.append((time.perf_counter() - query_started) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(f"{name:>16} {total:>9} {statistics.mean(timings):>9.2f} {p95:>9.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Measure how fast the app starts: module import and gunicorn boot
+
+- import: `import app` in fresh interpreters (median of --repeat runs), the
+  modules it pulled in, and the first /ready call that builds the clients
+- boot: gunicorn started with and without --preload until /health (live)
+  and /ready (ready for traffic) answer, with the RSS and PSS of each
+  worker (PSS counts pages shared between processes once, which shows
+  what preloading saves)
+
+No upstream API is called, so it runs anywhere gunicorn does (worker memory
+is read from /proc, Linux only). Prints a table on stderr and JSON on stdout
+(or in --output); --baseline compares with an earlier JSON result and exits
+with status 1 when a time or memory figure grew more than --tolerance.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 5] [--workers 4] [--modes import boot]
+        [--output startup.json] [--baseline previous.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.bench_app import git_commit, rss_mb, worker_pids
+
+# Run in a fresh interpreter by measure_import
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/ready')
+ready = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_ready_ms': (ready - imported) * 1000,
+    'ready_status': response.status_code,
+    'modules': len(sys.modules),
+    'sdk_imported': sorted(name for name in ('openai', 'replicate') if name in sys.modules
+                           and name not in before)
+}))
+"""
+
+def app_env(data_dir: str, extra: Dict[str, str]) -> Dict[str, str]:
+    """Environment of an app process on a scratch data directory"""
+    return {
+        **os.environ,
+        'DATA_DIR': data_dir,
+        'REPLICATE_API_TOKEN': os.getenv('REPLICATE_API_TOKEN', 'benchmark'),
+        'OPENAI_API_KEY': os.getenv('OPENAI_API_KEY', 'benchmark'),
+        'LOG_FILE': os.path.join(data_dir, 'app.{pid}.log'),
+        'PROMETHEUS_MULTIPROC_DIR': os.path.join(data_dir, 'prometheus'),
+        **extra
+    }
+
+def pss_mb(pid: int) -> Optional[float]:
+    """Proportional set size of a process in MB (shared pages divided among their users)"""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def measure_import(env: Dict[str, str], repeat: int) -> Dict:
+    """Import the app in `repeat` fresh interpreters"""
+    probe = "import sys\nbefore = set(sys.modules)\n" + IMPORT_PROBE
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', probe], cwd=REPO_ROOT, env=env,
+                                check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'import_ms': round(statistics.median(run['import_ms'] for run in runs), 1),
+        'import_ms_min': round(min(run['import_ms'] for run in runs), 1),
+        'first_ready_ms': round(statistics.median(run['first_ready_ms'] for run in runs), 1),
+        'ready_status': runs[-1]['ready_status'],
+        'modules': runs[-1]['modules'],
+        'sdk_imported_at_ready': runs[-1]['sdk_imported']
+    }
+
+def wait_for(url: str, server: subprocess.Popen, started: float, timeout: float) -> float:
+    """Seconds from `started` until url answers 200"""
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {server.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{url} did not answer within {timeout}s")
+
+def measure_boot(env: Dict[str, str], workers: int, preload: bool, port: int,
+                 timeout: float) -> Dict:
+    """Start gunicorn and time it until live and ready"""
+    command = [sys.executable, '-m', 'gunicorn', '--worker-class', 'gthread', '--threads', '4',
+               '--workers', str(workers), '--bind', f'127.0.0.1:{port}', 'app:app']
+    env = {**env, 'GUNICORN_PRELOAD': 'true' if preload else 'false'}
+    base_url = f'http://127.0.0.1:{port}'
+
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=REPO_ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        live_s = wait_for(f'{base_url}/health', server, started, timeout)
+        ready_s = wait_for(f'{base_url}/ready', server, started, timeout)
+        # Let every worker finish booting before reading its memory
+        deadline = time.perf_counter() + timeout
+        while len(worker_pids(server.pid)) < workers and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        time.sleep(1)
+        pids = worker_pids(server.pid)
+        return {
+            'live_s': round(live_s, 3),
+            'ready_s': round(ready_s, 3),
+            'worker_rss_mb': [round(rss_mb(pid) or 0, 1) for pid in pids],
+            'worker_pss_mb': [round(pss_mb(pid) or 0, 1) for pid in pids],
+            'master_pss_mb': round(pss_mb(server.pid) or 0, 1)
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Figures of result that grew more than the tolerated share over baseline"""
+    def figures(measured: Dict) -> Dict[str, float]:
+        flat = {}
+        if 'import' in measured:
+            flat['import ms'] = measured['import']['import_ms']
+            flat['first /ready ms'] = measured['import']['first_ready_ms']
+        for mode, boot in measured.get('boot', {}).items():
+            flat[f'{mode} live s'] = boot['live_s']
+            flat[f'{mode} ready s'] = boot['ready_s']
+            flat[f'{mode} total worker PSS MB'] = sum(boot['worker_pss_mb'])
+        return flat
+
+    previous = figures(baseline)
+    regressions = []
+    for name, now in figures(result).items():
+        before = previous.get(name)
+        if before and (now - before) / before > tolerance:
+            regressions.append(f"{name} {before} -> {now} ({(now - before) / before:+.0%})")
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', nargs='+', choices=['import', 'boot'], default=['import', 'boot'])
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per import measurement')
+    parser.add_argument('--workers', type=int, default=4, help='Gunicorn worker processes')
+    parser.add_argument('--port', type=int, default=8920)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--env', nargs='*', default=[], metavar='NAME=VALUE',
+                        help='Extra settings for the app')
+    parser.add_argument('--output', help='Write the JSON result to this file instead of stdout')
+    parser.add_argument('--baseline', help='Earlier JSON result to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Relative growth counted as a regression')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='bench-startup-')
+    try:
+        env = app_env(data_dir, dict(setting.partition('=')[::2] for setting in args.env))
+        result = {
+            'benchmark': 'bench_startup',
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'config': {name: value for name, value in vars(args).items()
+                       if name not in ('output', 'baseline')}
+        }
+
+        if 'import' in args.modes:
+            # The first import also creates the data directory and indexes; not measured
+            measure_import(env, 1)
+            result['import'] = measure_import(env, args.repeat)
+            print(f"import {result['import']['import_ms']} ms (min {result['import']['import_ms_min']}), "
+                  f"first /ready {result['import']['first_ready_ms']} ms, "
+                  f"{result['import']['modules']} modules", file=sys.stderr)
+
+        if 'boot' in args.modes:
+            result['boot'] = {}
+            print(f"{'mode':>10} {'live s':>8} {'ready s':>8} {'RSS MB/worker':>14} "
+                  f"{'PSS MB total':>13}", file=sys.stderr)
+            for mode, preload in (('default', False), ('preload', True)):
+                boot = measure_boot(env, args.workers, preload, args.port, args.timeout)
+                result['boot'][mode] = boot
+                rss = statistics.mean(boot['worker_rss_mb']) if boot['worker_rss_mb'] else 0
+                pss = sum(boot['worker_pss_mb']) + boot['master_pss_mb']
+                print(f"{mode:>10} {boot['live_s']:>8} {boot['ready_s']:>8} {rss:>14.1f} {pss:>13.1f}",
+                      file=sys.stderr)
+
+        regressions = []
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = compare(result, json.load(f), args.tolerance)
+            result['regressions'] = regressions
+            for regression in regressions:
+                print(f"REGRESSION {regression}", file=sys.stderr)
+
+        payload = json.dumps(result, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(payload + '\n')
+        else:
+            print(payload)
+        if regressions:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Local fake of the Replicate and OpenAI APIs for load tests
+
+Answers prediction requests (POST /v1/models/<owner>/<name>/predictions)
+with a finished prediction whose output is an inline WebP image (noise of
+a configurable size, so it compresses like a photo), and chat completions
+(POST /v1/chat/completions) with a fixed translation, each after a
+configurable delay. Streamed completions send the text word by word,
+spread over the same delay. Point the app at it with
+REPLICATE_BASE_URL=http://host:port and OPENAI_BASE_URL=http://host:port/v1.
+
+Usage:
+    python benchmarks/fake_upstream.py [--port 8900] [--replicate-latency 2] [--openai-latency 0.3]
+        [--image-size 64]
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+def webp_data_url(width: int = 64, height: int = 64) -> str:
+    """Inline WebP image of random noise, returned as prediction output"""
+    buffer = io.BytesIO()
+    Image.frombytes('RGB', (width, height), os.urandom(width * height * 3)).save(buffer, 'WEBP')
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+# Every chat completion answers with this text
+CHAT_ANSWER = 'a cat sitting on a windowsill'
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chat_stream(self, model: str, latency: float) -> None:
+        """Send the completion as chunked Server-Sent Events, one word per chunk"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def send(data: str) -> None:
+            payload = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+
+        words = CHAT_ANSWER.split(' ')
+        for i, word in enumerate(words):
+            time.sleep(latency / len(words))
+            send(json.dumps({
+                'id': 'fake',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'delta': {'content': word if i == 0 else ' ' + word},
+                    'finish_reason': 'stop' if i == len(words) - 1 else None
+                }]
+            }))
+        send('[DONE]')
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        server.count(self.path)
+
+        if server.error_rate and random.random() < server.error_rate:
+            self._send_json(429, {'detail': 'Rate limited'}, {'Retry-After': '1'})
+            return
+
+        if self.path.endswith('/predictions'):
+            time.sleep(server.replicate_latency)
+            model = self.path.split('/models/', 1)[-1].rsplit('/predictions', 1)[0]
+            prediction_id = f"fake{server.count('prediction-id')}"
+            self._send_json(201, {
+                'id': prediction_id,
+                'model': model,
+                'version': 'fake',
+                'status': 'succeeded',
+                'input': body.get('input'),
+                'output': server.output,
+                'logs': '',
+                'error': None,
+                'urls': {'get': f"http://{self.headers['Host']}/v1/predictions/{prediction_id}"}
+            })
+        elif self.path.endswith('/chat/completions') and body.get('stream'):
+            self._send_chat_stream(body.get('model', 'gpt-4'), server.openai_latency)
+        elif self.path.endswith('/chat/completions'):
+            time.sleep(server.openai_latency)
+            self._send_json(200, {
+                'id': 'fake',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': body.get('model', 'gpt-4'),
+                'choices': [{
+                    'index': 0,
+                    'finish_reason': 'stop',
+                    'message': {'role': 'assistant', 'content': CHAT_ANSWER}
+                }]
+            })
+        else:
+            self._send_json(404, {'detail': 'Not found'})
+
+class FakeUpstream(ThreadingHTTPServer):
+    """Threaded fake API server; start() runs it in a background thread"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port: int = 0, replicate_latency: float = 2.0,
+                 openai_latency: float = 0.3, error_rate: float = 0.0, image_size: int = 64):
+        super().__init__(('127.0.0.1', port), FakeUpstreamHandler)
+        self.replicate_latency = replicate_latency
+        self.openai_latency = openai_latency
+        self.error_rate = error_rate
+        self.output = webp_data_url(image_size, image_size)
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def count(self, key: str) -> int:
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            return self.requests[key]
+
+    def start(self) -> 'FakeUpstream':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--replicate-latency', type=float, default=2.0)
+    parser.add_argument('--openai-latency', type=float, default=0.3)
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Share of requests answered with 429 and Retry-After')
+    parser.add_argument('--image-size', type=int, default=64,
+                        help='Width and height of the generated image (1024 is about 700 KB)')
+    args = parser.parse_args()
+
+    server = FakeUpstream(args.port, args.replicate_latency, args.openai_latency, args.error_rate,
+                          args.image_size)
+    print(f"Fake upstream listening on {server.url}", flush=True)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# Gunicorn loads this file automatically from the working directory
+import gc
+import os
+import shutil
+
+# Import the app once in the master instead of in every worker: workers are
+# forked ready to serve and share its memory (modules, config, the metadata
+# index checked at startup) copy-on-write. API clients and background threads
+# are created per worker on first use, so nothing unsafe crosses the fork.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true'
+
+# Stores that are per process with memory://, and what breaks with several workers
+PROCESS_LOCAL_STORES = {
+    'JOB_STORE_URL': 'job status and /events answer 404 when a request reaches another worker',
+    'ADMISSION_STORE_URL': 'every worker spends the full upstream budget and in-flight limits',
+    'RATELIMIT_STORAGE_URL': 'every worker counts its own rate limits'
+}
+
+def on_starting(server):
+    """Clear metric files left over from a previous run and check the shared stores"""
+    multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+    if server.cfg.workers > 1:
+        # The app reads .env itself, later; without preload it is not loaded yet
+        from dotenv import load_dotenv
+        load_dotenv()
+        for name, problem in PROCESS_LOCAL_STORES.items():
+            if os.getenv(name, 'memory://').startswith('memory://'):
+                server.log.warning(f"{name} is memory:// with {server.cfg.workers} workers: "
+                                   f"{problem}; set it to a redis:// URL")
+
+def when_ready(server):
+    """Keep the garbage collector of the workers from writing to the shared objects"""
+    if preload_app:
+        # Objects of the preloaded app move to the permanent generation, so
+        # collections in the workers do not touch (and copy) their pages
+        gc.freeze()
+
+def child_exit(server, worker):
+    """Drop live gauges of a dead worker so they leave the aggregated metrics"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
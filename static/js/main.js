@@ -1,7 +1,11 @@
 // Form state management
 const STORAGE_KEY = 'replicate-ai-form';
-let currentPage = 1;
+const GALLERY_PAGE_SIZE = 12;
+let nextCursor = '';
+let galleryLoading = false;
 let isGenerating = false;
+// Text returned by prompt improvement; generating it unchanged skips translation
+let processedPrompt = null;
 
 // DOM Elements
 const $form = $('#generationForm');
@@ -11,8 +15,9 @@ const $aspectRatio = $('#aspectRatio');
 const $generateBtn = $('#generateBtn');
 const $improveBtn = $('#improvePrompt');
 const $gallery = $('#imageGallery');
-const $pagination = $('#galleryPagination');
+const $galleryLoader = $('#galleryLoader');
 const $spinner = $('#spinnerOverlay');
+const $spinnerStatus = $('#spinnerStatus');
 const errorModal = new bootstrap.Modal('#errorModal');
 
 // Load saved form state
@@ -50,6 +55,7 @@ function toggleLoading(show) {
         isGenerating = true;
     } else {
         $spinner.css('display', 'none');
+        $spinnerStatus.text('');
         $generateBtn.prop('disabled', false);
         isGenerating = false;
     }
@@ -60,8 +66,13 @@ function createImageCard(image) {
     return `
         <div class="col-md-4 col-lg-3 mb-4">
             <div class="card image-card">
-                <div class="ambient-background" style="background-image: url('/images/${image.image_filename}')"></div>
-                <img src="/images/${image.image_filename}" class="card-img-top" alt="Generated image">
+                <div class="ambient-background" style="background-image: url('/images/${image.image_filename}?w=256')"></div>
+                <img src="/images/${image.image_filename}?w=512"
+                     srcset="/images/${image.image_filename}?w=256 256w, /images/${image.image_filename}?w=512 512w"
+                     sizes="(min-width: 992px) 25vw, (min-width: 768px) 33vw, 100vw"
+                     data-full-src="/images/${image.image_filename}"
+                     loading="lazy" decoding="async"
+                     class="card-img-top" alt="Generated image">
                 <div class="overlay">
                     <div class="d-flex justify-content-between">
                         <button class="btn btn-sm btn-outline-light copy-settings" data-image-id="${image.image_filename}" title="Kopírovat nastavení">
@@ -80,59 +91,111 @@ function createImageCard(image) {
     `;
 }
 
-// Create pagination
-function createPagination(totalPages) {
-    let html = '';
-    
-    // Previous button
-    html += `
-        <li class="page-item ${currentPage === 1 ? 'disabled' : ''}">
-            <a class="page-link" href="#" data-page="${currentPage - 1}">
-                <i class="fas fa-chevron-left"></i>
-            </a>
-        </li>
-    `;
-    
-    // Page numbers
-    for (let i = 1; i <= totalPages; i++) {
-        html += `
-            <li class="page-item ${currentPage === i ? 'active' : ''}">
-                <a class="page-link" href="#" data-page="${i}">${i}</a>
-            </li>
-        `;
-    }
-    
-    // Next button
-    html += `
-        <li class="page-item ${currentPage === totalPages ? 'disabled' : ''}">
-            <a class="page-link" href="#" data-page="${currentPage + 1}">
-                <i class="fas fa-chevron-right"></i>
-            </a>
-        </li>
-    `;
-    
-    return html;
-}
+// Load gallery images (cursor based infinite scroll)
+async function loadGallery(reset = true) {
+    if (galleryLoading) return;
+    if (reset) nextCursor = '';
+    if (nextCursor === null) return; // No more pages
 
-// Load gallery images
-async function loadGallery(page = 1) {
+    galleryLoading = true;
+    $galleryLoader.removeClass('d-none');
     try {
-        const response = await fetch(`/api/images?page=${page}`);
+        const params = new URLSearchParams({ after: nextCursor, per_page: GALLERY_PAGE_SIZE });
+        const response = await fetch(`/api/images?${params}`);
         const data = await response.json();
         
         if (!response.ok) throw new Error(data.error);
         
-        $gallery.empty();
+        if (reset) $gallery.empty();
         data.images.forEach(image => {
             $gallery.append(createImageCard(image));
         });
         
-        currentPage = page;
-        $pagination.html(createPagination(data.total_pages));
+        nextCursor = data.next_cursor;
+
+        // Keep filling while the sentinel is still on screen
+        const sentinelTop = document.getElementById('gallerySentinel').getBoundingClientRect().top;
+        if (nextCursor && sentinelTop < window.innerHeight + 400) {
+            setTimeout(() => loadGallery(false), 0);
+        }
         
     } catch (error) {
         showError('Chyba při načítání galerie: ' + error.message);
+    } finally {
+        galleryLoading = false;
+        $galleryLoader.addClass('d-none');
+    }
+}
+
+// Labels for generation job states
+const JOB_STATUS_LABELS = {
+    queued: 'Ve frontě...',
+    translating: 'Překládám prompt...',
+    waiting: 'Čekám na volnou kapacitu...',
+    generating: 'Generuji obrázek...',
+    saving: 'Ukládám obrázek...'
+};
+
+// Handle a job state update, returns true once the job is finished
+function handleJobState(job) {
+    if (job.status === 'done') {
+        toggleLoading(false);
+        loadGallery(); // Reload from the newest image
+        return true;
+    }
+    if (job.status === 'failed') {
+        toggleLoading(false);
+        showError('Chyba při generování obrázku: ' + job.error);
+        return true;
     }
+    $spinnerStatus.text(JOB_STATUS_LABELS[job.status] || '');
+    return false;
+}
+
+// Follow job state via Server-Sent Events
+function watchJob(data) {
+    const source = new EventSource(data.events_url);
+    let finished = false;
+    
+    source.addEventListener('state', (event) => {
+        if (handleJobState(JSON.parse(event.data))) {
+            finished = true;
+            source.close();
+        }
+    });
+    
+    source.onerror = () => {
+        source.close();
+        if (!finished) pollJob(data.status_url);
+    };
+}
+
+// Fallback: poll job status until the generation finishes
+function pollJob(statusUrl) {
+    let attempts = 0;
+    const maxAttempts = 90; // 3 minutes (90 * 2s)
+    
+    const pollInterval = setInterval(async () => {
+        attempts++;
+        
+        if (attempts >= maxAttempts) {
+            clearInterval(pollInterval);
+            toggleLoading(false);
+            showError('Timeout při generování obrázku');
+            return;
+        }
+        
+        try {
+            const statusResponse = await fetch(statusUrl);
+            const job = await statusResponse.json();
+            
+            if (!statusResponse.ok) throw new Error(job.error);
+            
+            if (handleJobState(job)) clearInterval(pollInterval);
+        } catch (error) {
+            console.error('Error polling status:', error);
+        }
+    }, 2000);
 }
 
 // Generate image
@@ -145,38 +208,28 @@ async function generateImage(prompt, model, aspectRatio) {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ prompt, model, aspect_ratio: aspectRatio })
+            body: JSON.stringify({
+                prompt,
+                model,
+                aspect_ratio: aspectRatio,
+                prompt_processed: prompt === processedPrompt
+            })
         });
         
         const data = await response.json();
         if (!response.ok) throw new Error(data.error);
         
-        // Poll for image status
-        let attempts = 0;
-        const maxAttempts = 12; // 2 minutes (12 * 10s)
+        // A seeded request answered from an already stored image
+        if (data.status === 'done') {
+            handleJobState(data);
+            return;
+        }
         
-        const pollInterval = setInterval(async () => {
-            attempts++;
-            
-            if (attempts >= maxAttempts) {
-                clearInterval(pollInterval);
-                toggleLoading(false);
-                throw new Error('Timeout při generování obrázku');
-            }
-            
-            try {
-                const statusResponse = await fetch(`/api/metadata/${data.image_id}`);
-                const statusData = await statusResponse.json();
-                
-                if (statusResponse.ok) {
-                    clearInterval(pollInterval);
-                    toggleLoading(false);
-                    loadGallery(1); // Reload first page
-                }
-            } catch (error) {
-                console.error('Error polling status:', error);
-            }
-        }, 10000);
+        if (window.EventSource) {
+            watchJob(data);
+        } else {
+            pollJob(data.status_url);
+        }
         
     } catch (error) {
         toggleLoading(false);
@@ -184,7 +237,7 @@ async function generateImage(prompt, model, aspectRatio) {
     }
 }
 
-// Improve prompt
+// Improve prompt; the text appears in the prompt field as it is generated
 async function improvePrompt(prompt) {
     try {
         toggleLoading(true);
@@ -194,16 +247,48 @@ async function improvePrompt(prompt) {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ prompt })
+            body: JSON.stringify({ prompt, stream: true })
         });
         
-        const data = await response.json();
-        if (!response.ok) throw new Error(data.error);
+        if (!response.ok) {
+            const data = await response.json();
+            throw new Error(data.error);
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let improved = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            // Server-Sent Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                
+                const event = (block.match(/^event: (.*)$/m) || [])[1];
+                const data = JSON.parse((block.match(/^data: (.*)$/m) || [])[1] || '{}');
+                if (event === 'token') {
+                    improved += data.text;
+                    $prompt.val(improved.trimStart());
+                } else if (event === 'done') {
+                    $prompt.val(data.improved_prompt);
+                    processedPrompt = data.improved_prompt;
+                } else if (event === 'error') {
+                    throw new Error(data.error);
+                }
+            }
+        }
         
-        $prompt.val(data.improved_prompt);
         saveFormState();
         
     } catch (error) {
+        $prompt.val(prompt);
         showError('Chyba při vylepšování promptu: ' + error.message);
     } finally {
         toggleLoading(false);
@@ -220,7 +305,7 @@ async function deleteImage(imageId) {
         const data = await response.json();
         if (!response.ok) throw new Error(data.error);
         
-        loadGallery(currentPage);
+        loadGallery();
         
     } catch (error) {
         showError('Chyba při mazání obrázku: ' + error.message);
@@ -260,14 +345,13 @@ $(document).ready(() => {
         await improvePrompt(prompt);
     });
     
-    // Pagination clicks
-    $pagination.on('click', '.page-link', async (e) => {
-        e.preventDefault();
-        const page = $(e.currentTarget).data('page');
-        if (page && page !== currentPage) {
-            await loadGallery(page);
+    // Load the next page when the sentinel below the gallery scrolls into view
+    const galleryObserver = new IntersectionObserver((entries) => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadGallery(false);
         }
-    });
+    }, { rootMargin: '400px' });
+    galleryObserver.observe(document.getElementById('gallerySentinel'));
     
     // Initialize delete modal
     const deleteModal = new bootstrap.Modal('#deleteModal');
@@ -328,7 +412,7 @@ $(document).ready(() => {
     // Open image modal
     $gallery.on('click', '.card-img-top', function(e) {
         e.stopPropagation(); // Prevent triggering overlay buttons
-        const imageSrc = $(this).attr('src');
+        const imageSrc = $(this).data('full-src');
         $modalImage.attr('src', imageSrc);
         $imageModal.css('display', 'flex');
         $('body').css('overflow', 'hidden'); // Prevent scrolling
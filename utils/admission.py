@@ -0,0 +1,346 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+import uuid
+from contextlib import AsyncExitStack, ExitStack, asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+class AdmissionRejected(Exception):
+    """Raised when upstream capacity will not be available within the allowed wait"""
+
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"Upstream capacity for {key} exhausted, retry after {math.ceil(retry_after)}s")
+        self.key = key
+        self.retry_after = retry_after
+
+class Limit(NamedTuple):
+    """Upstream limit of one key"""
+    # Cost units refilled per minute (0 = no token bucket)
+    rate: float = 0
+    # Bucket capacity: cost that may be spent at once after a quiet period
+    burst: float = 0
+    # Concurrent upstream calls across all workers (0 = unlimited)
+    in_flight: int = 0
+
+class AdmissionBackend:
+    """Base class for shared token buckets and in-flight counters"""
+
+    def take(self, key: str, cost: float, rate: float, burst: float,
+             max_wait: float) -> Tuple[bool, float]:
+        """
+        Reserve tokens from a bucket, borrowing against future refills
+
+        Args:
+            key (str): Bucket name
+            cost (float): Tokens to take
+            rate (float): Tokens refilled per second
+            burst (float): Bucket capacity
+            max_wait (float): Longest wait for the borrowed tokens that is accepted
+
+        Returns:
+            Tuple[bool, float]: Whether the tokens were taken, and the seconds until
+                they are covered by refills (the wait that would be needed if not)
+        """
+        raise NotImplementedError
+
+    def give_back(self, key: str, cost: float, rate: float, burst: float) -> None:
+        """Return tokens of a reservation that was not used"""
+        raise NotImplementedError
+
+    def acquire_slot(self, key: str, limit: int, lease: str, ttl: float) -> bool:
+        """Hold one of `limit` in-flight slots; the lease expires after ttl seconds"""
+        raise NotImplementedError
+
+    def release_slot(self, key: str, lease: str) -> None:
+        """Free a slot held by acquire_slot"""
+        raise NotImplementedError
+
+    def ping(self) -> None:
+        """Raise if the shared state cannot be reached"""
+
+def _refill(tokens: float, elapsed: float, rate: float, burst: float) -> float:
+    return min(burst, tokens + max(elapsed, 0) * rate)
+
+class LocalAdmissionBackend(AdmissionBackend):
+    """In-process buckets and slots, for development, single workers and tests"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, cost: float, rate: float, burst: float,
+             max_wait: float) -> Tuple[bool, float]:
+        """Reserve tokens from a bucket, see AdmissionBackend.take"""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (burst, now))
+            left = _refill(tokens, now - updated, rate, burst) - cost
+            wait = -left / rate if left < 0 else 0.0
+            if wait > max_wait:
+                return False, wait
+            self._buckets[key] = (left, now)
+            return True, wait
+
+    def give_back(self, key: str, cost: float, rate: float, burst: float) -> None:
+        """Return unused tokens"""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (burst, now))
+            self._buckets[key] = (min(burst, _refill(tokens, now - updated, rate, burst) + cost), now)
+
+    def acquire_slot(self, key: str, limit: int, lease: str, ttl: float) -> bool:
+        """Hold an in-flight slot"""
+        with self._lock:
+            now = time.monotonic()
+            leases = {held: expires for held, expires in self._slots.get(key, {}).items()
+                      if expires > now}
+            self._slots[key] = leases
+            if len(leases) >= limit:
+                return False
+            leases[lease] = now + ttl
+            return True
+
+    def release_slot(self, key: str, lease: str) -> None:
+        """Free an in-flight slot"""
+        with self._lock:
+            self._slots.get(key, {}).pop(lease, None)
+
+class RedisAdmissionBackend(AdmissionBackend):
+    """
+    Buckets and slots shared by all workers and nodes through Redis
+
+    Every operation is one Lua script, so concurrent workers cannot both
+    spend the last tokens; scripts use the Redis clock, not the workers'.
+    Slots are sorted-set leases that expire, so a worker killed mid-call
+    cannot hold its slot forever.
+    """
+
+    KEY_PREFIX = 'admission:'
+
+    TAKE_SCRIPT = """
+        local now = redis.call('TIME')
+        now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+        local cost, rate, burst, max_wait = tonumber(ARGV[1]), tonumber(ARGV[2]),
+            tonumber(ARGV[3]), tonumber(ARGV[4])
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or burst
+        local updated = tonumber(state[2]) or now
+        local left = math.min(burst, tokens + math.max(now - updated, 0) * rate) - cost
+        local wait = 0
+        if left < 0 then wait = -left / rate end
+        if wait > max_wait then return {0, tostring(wait)} end
+        redis.call('HSET', KEYS[1], 'tokens', tostring(left), 'updated', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil((burst - left) / rate) + 60)
+        return {1, tostring(wait)}
+    """
+
+    GIVE_BACK_SCRIPT = """
+        local now = redis.call('TIME')
+        now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+        local cost, rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        if not state[1] then return 0 end
+        local tokens = math.min(burst, tonumber(state[1]) + math.max(now - tonumber(state[2]), 0) * rate)
+        tokens = math.min(burst, tokens + cost)
+        redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+        return 1
+    """
+
+    ACQUIRE_SLOT_SCRIPT = """
+        local now = redis.call('TIME')
+        now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+        local limit, ttl = tonumber(ARGV[1]), tonumber(ARGV[3])
+        redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+        if redis.call('ZCARD', KEYS[1]) >= limit then return 0 end
+        redis.call('ZADD', KEYS[1], now + ttl, ARGV[2])
+        redis.call('EXPIRE', KEYS[1], math.ceil(ttl) + 60)
+        return 1
+    """
+
+    def __init__(self, url: str):
+        """Initialize with a redis:// URL"""
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self._take = self.redis.register_script(self.TAKE_SCRIPT)
+        self._give_back = self.redis.register_script(self.GIVE_BACK_SCRIPT)
+        self._acquire_slot = self.redis.register_script(self.ACQUIRE_SLOT_SCRIPT)
+
+    def take(self, key: str, cost: float, rate: float, burst: float,
+             max_wait: float) -> Tuple[bool, float]:
+        """Reserve tokens from a bucket, see AdmissionBackend.take"""
+        taken, wait = self._take(keys=[f"{self.KEY_PREFIX}bucket:{key}"],
+                                 args=[cost, rate, burst, max_wait])
+        return bool(taken), float(wait)
+
+    def give_back(self, key: str, cost: float, rate: float, burst: float) -> None:
+        """Return unused tokens"""
+        self._give_back(keys=[f"{self.KEY_PREFIX}bucket:{key}"], args=[cost, rate, burst])
+
+    def acquire_slot(self, key: str, limit: int, lease: str, ttl: float) -> bool:
+        """Hold an in-flight slot"""
+        return bool(self._acquire_slot(keys=[f"{self.KEY_PREFIX}slots:{key}"],
+                                       args=[limit, lease, ttl]))
+
+    def release_slot(self, key: str, lease: str) -> None:
+        """Free an in-flight slot"""
+        self.redis.zrem(f"{self.KEY_PREFIX}slots:{key}", lease)
+
+    def ping(self) -> None:
+        """Raise if Redis cannot be reached"""
+        self.redis.ping()
+
+def create_admission_backend(url: str) -> AdmissionBackend:
+    """Create an admission backend from a URL (memory:// or redis://)"""
+    if url.startswith('memory://'):
+        return LocalAdmissionBackend()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisAdmissionBackend(url)
+    raise ValueError(f"Unsupported admission store URL: {url}")
+
+class AdmissionController:
+    """
+    Admission control in front of the upstream APIs
+
+    Each key may have a token bucket (spend per minute, requests are
+    weighted by cost) and an in-flight limit. A request that would exceed
+    them waits when capacity frees up within max_wait, and is rejected
+    right away with the time to retry otherwise, so bursts are smoothed
+    out here instead of piling up on upstream 429 responses.
+    """
+
+    # Pause between attempts to get an in-flight slot
+    SLOT_POLL_INTERVAL = 0.1
+
+    def __init__(self, backend: AdmissionBackend, limits: Dict[str, Limit],
+                 max_wait: float = 30.0, slot_ttl: float = 600.0):
+        """
+        Initialize admission controller
+
+        Args:
+            backend (AdmissionBackend): Shared state of buckets and slots
+            limits (Dict[str, Limit]): Limits per key; keys without one are not limited
+            max_wait (float): Longest time a request is held back before it is rejected
+            slot_ttl (float): Seconds after which a slot that was never released
+                (worker killed mid-call) is freed
+        """
+        self.backend = backend
+        self.limits = limits
+        self.max_wait = max_wait
+        self.slot_ttl = slot_ttl
+
+    def reserve(self, key: str, cost: float = 1.0) -> float:
+        """
+        Spend cost from the key's bucket
+
+        Args:
+            key (str): Bucket key
+            cost (float): Weight of the request
+
+        Returns:
+            float: Seconds to wait before calling upstream
+
+        Raises:
+            AdmissionRejected: When the wait would exceed max_wait
+        """
+        limit = self.limits.get(key)
+        if limit is None or limit.rate <= 0:
+            return 0.0
+        # A request costing more than the bucket holds could never be admitted
+        cost = min(cost, limit.burst)
+        taken, wait = self.backend.take(key, cost, limit.rate / 60, limit.burst, self.max_wait)
+        if not taken:
+            raise AdmissionRejected(key, wait - self.max_wait)
+        return wait
+
+    def refund(self, key: str, cost: float = 1.0) -> None:
+        """Return a reservation that did not reach upstream (e.g. answered from a cache)"""
+        limit = self.limits.get(key)
+        if limit is None or limit.rate <= 0:
+            return
+        try:
+            self.backend.give_back(key, min(cost, limit.burst), limit.rate / 60, limit.burst)
+        except Exception as e:
+            logger.warning(f"Could not refund {cost} to {key}: {str(e)}")
+
+    def _try_slot(self, key: str, lease: str) -> bool:
+        return self.backend.acquire_slot(key, self.limits[key].in_flight, lease, self.slot_ttl)
+
+    def _has_slots(self, key: str) -> bool:
+        limit = self.limits.get(key)
+        return limit is not None and limit.in_flight > 0
+
+    @contextmanager
+    def slot(self, key: str) -> Iterator[None]:
+        """
+        Hold an in-flight slot of the key for the duration of an upstream call
+
+        Raises:
+            AdmissionRejected: When no slot frees up within max_wait
+        """
+        if not self._has_slots(key):
+            yield
+            return
+        lease = str(uuid.uuid4())
+        deadline = time.monotonic() + self.max_wait
+        while not self._try_slot(key, lease):
+            if time.monotonic() >= deadline:
+                raise AdmissionRejected(key, max(self.max_wait, 1))
+            time.sleep(self.SLOT_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            self.backend.release_slot(key, lease)
+
+    @asynccontextmanager
+    async def slot_async(self, key: str) -> AsyncIterator[None]:
+        """Async variant of slot; the event loop keeps running while waiting"""
+        if not self._has_slots(key):
+            yield
+            return
+        lease = str(uuid.uuid4())
+        deadline = time.monotonic() + self.max_wait
+        while not await asyncio.to_thread(self._try_slot, key, lease):
+            if time.monotonic() >= deadline:
+                raise AdmissionRejected(key, max(self.max_wait, 1))
+            await asyncio.sleep(self.SLOT_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self.backend.release_slot, key, lease)
+
+    @contextmanager
+    def admit(self, key: str, cost: float = 1.0) -> Iterator[None]:
+        """
+        Reserve from the key's bucket, wait for the reservation, then hold a slot
+
+        The reservation is refunded when no slot frees up or the wait is
+        interrupted, as upstream was never called.
+        """
+        wait = self.reserve(key, cost)
+        with ExitStack() as stack:
+            try:
+                time.sleep(wait)
+                stack.enter_context(self.slot(key))
+            except BaseException:
+                self.refund(key, cost)
+                raise
+            yield
+
+    @asynccontextmanager
+    async def admit_async(self, key: str, cost: float = 1.0) -> AsyncIterator[None]:
+        """Async variant of admit"""
+        wait = await asyncio.to_thread(self.reserve, key, cost)
+        async with AsyncExitStack() as stack:
+            try:
+                await asyncio.sleep(wait)
+                await stack.enter_async_context(self.slot_async(key))
+            except BaseException:
+                # Also on cancellation; the refund must not be cancelled with it
+                await asyncio.shield(asyncio.to_thread(self.refund, key, cost))
+                raise
+            yield
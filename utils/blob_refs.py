@@ -0,0 +1,318 @@
+import sqlite3
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+from utils.sqlite import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+class BlobRefs:
+    """
+    Reference counts of content-addressed image blobs
+
+    Every stored image id points to the blob holding its bytes; a blob is
+    kept while at least one image refers to it. Unlike the metadata index
+    this is the only record of which image uses which blob, so it is never
+    reset.
+    """
+
+    def __init__(self, db_path: str):
+        """Open (or create) the reference database at db_path"""
+        self.db_path = db_path
+        self.db = SQLiteDatabase(db_path)
+        self._ensure_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get a connection for the current thread and process"""
+        return self.db.connect()
+
+    def _ensure_schema(self) -> None:
+        """Create tables"""
+        conn = self._connect()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    content_hash TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    refcount INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS refs (
+                    image_id TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    created REAL
+                )
+            """)
+            # Databases from before references recorded their creation time
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(refs)')]
+            if 'created' not in columns:
+                conn.execute('ALTER TABLE refs ADD COLUMN created REAL')
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Write transaction holding the database lock
+
+        Blob files are created and removed inside it, so a blob cannot be
+        deleted by one process while another adds a reference to it.
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            yield conn
+
+    def get_hash(self, image_id: str) -> Optional[str]:
+        """Content hash of the blob an image points to, None for unknown images"""
+        row = self._connect().execute(
+            'SELECT content_hash FROM refs WHERE image_id = ?', (image_id,)
+        ).fetchone()
+        return row['content_hash'] if row is not None else None
+
+    def add(self, conn: sqlite3.Connection, image_id: str, content_hash: str, size: int) -> int:
+        """
+        Point an image at a blob (within transaction())
+
+        Returns:
+            int: Reference count of the blob afterwards (1 for a new blob)
+        """
+        conn.execute(
+            'INSERT INTO blobs (content_hash, size, refcount) VALUES (?, ?, 1) '
+            'ON CONFLICT (content_hash) DO UPDATE SET refcount = refcount + 1',
+            (content_hash, size)
+        )
+        conn.execute(
+            'INSERT INTO refs (image_id, content_hash, created) VALUES (?, ?, ?)',
+            (image_id, content_hash, time.time())
+        )
+        return conn.execute(
+            'SELECT refcount FROM blobs WHERE content_hash = ?', (content_hash,)
+        ).fetchone()[0]
+
+    def remove(self, conn: sqlite3.Connection, image_id: str) -> Optional[Tuple[str, int]]:
+        """
+        Drop the reference of an image (within transaction())
+
+        Returns:
+            Optional[Tuple[str, int]]: Content hash and remaining reference count
+                of its blob (the blob record is gone at 0), None for unknown images
+        """
+        row = conn.execute(
+            'SELECT content_hash FROM refs WHERE image_id = ?', (image_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        content_hash = row['content_hash']
+        conn.execute('DELETE FROM refs WHERE image_id = ?', (image_id,))
+        conn.execute(
+            'UPDATE blobs SET refcount = refcount - 1 WHERE content_hash = ?', (content_hash,)
+        )
+        remaining = conn.execute(
+            'SELECT refcount FROM blobs WHERE content_hash = ?', (content_hash,)
+        ).fetchone()[0]
+        if remaining <= 0:
+            conn.execute('DELETE FROM blobs WHERE content_hash = ?', (content_hash,))
+        return content_hash, remaining
+
+    def is_referenced(self, conn: sqlite3.Connection, content_hash: str) -> bool:
+        """Whether a blob has a record (within transaction())"""
+        return conn.execute(
+            'SELECT 1 FROM blobs WHERE content_hash = ?', (content_hash,)
+        ).fetchone() is not None
+
+    def all_refs(self) -> Dict[str, Tuple[str, Optional[float]]]:
+        """Content hash and creation time (None for old references) of every image"""
+        rows = self._connect().execute('SELECT image_id, content_hash, created FROM refs')
+        return {row['image_id']: (row['content_hash'], row['created']) for row in rows}
+
+    def total_size(self) -> int:
+        """Bytes of all stored blobs, each counted once"""
+        return self._connect().execute(
+            'SELECT COALESCE(SUM(size), 0) FROM blobs'
+        ).fetchone()[0]
+
+    def counts(self) -> Tuple[int, int]:
+        """Number of blobs and of image references"""
+        conn = self._connect()
+        blobs = conn.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+        refs = conn.execute('SELECT COUNT(*) FROM refs').fetchone()[0]
+        return blobs, refs
+
+class RedisBlobRefs:
+    """
+    Reference counts of content-addressed image blobs shared through Redis
+
+    Same interface as BlobRefs, for several nodes on one object store. Each
+    count changes in one Lua script; a transaction() additionally holds a
+    lock on the content hash it works on, so a blob file cannot be deleted
+    by one node while another adds a reference to it.
+    """
+
+    KEY_PREFIX = 'blob-refs:'
+    # Longest a blob lock is held (an upload or delete of one blob), in seconds
+    LOCK_TIMEOUT = 300
+
+    ADD_SCRIPT = """
+        if redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2]) == 0 then
+            return redis.error_reply('image ' .. ARGV[1] .. ' already has a reference')
+        end
+        redis.call('HSET', KEYS[2], ARGV[1], ARGV[4])
+        local refcount = redis.call('HINCRBY', KEYS[3], ARGV[2], 1)
+        if refcount == 1 then
+            redis.call('HSET', KEYS[4], ARGV[2], ARGV[3])
+            redis.call('INCRBY', KEYS[5], ARGV[3])
+        end
+        return refcount
+    """
+
+    REMOVE_SCRIPT = """
+        local content_hash = redis.call('HGET', KEYS[1], ARGV[1])
+        if not content_hash then return false end
+        redis.call('HDEL', KEYS[1], ARGV[1])
+        redis.call('HDEL', KEYS[2], ARGV[1])
+        local refcount = redis.call('HINCRBY', KEYS[3], content_hash, -1)
+        if refcount <= 0 then
+            redis.call('HDEL', KEYS[3], content_hash)
+            local size = redis.call('HGET', KEYS[4], content_hash)
+            redis.call('HDEL', KEYS[4], content_hash)
+            if size then redis.call('DECRBY', KEYS[5], size) end
+        end
+        return {content_hash, refcount}
+    """
+
+    def __init__(self, url: str):
+        """Initialize with a redis:// URL"""
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        # Image id -> content hash and creation time, content hash -> count and size
+        self.keys = [f"{self.KEY_PREFIX}{name}"
+                     for name in ('refs', 'created', 'counts', 'sizes', 'total-size')]
+        self._add = self.redis.register_script(self.ADD_SCRIPT)
+        self._remove = self.redis.register_script(self.REMOVE_SCRIPT)
+
+    @contextmanager
+    def transaction(self) -> Iterator['RedisRefsTransaction']:
+        """
+        Hold blob locks for the reference changes made within
+
+        Blob files are created and removed inside it, like with BlobRefs.
+        Redis cannot roll back, so on an error the references added within
+        are removed again; a blob left after a removal is an orphan for fsck.
+        """
+        transaction = RedisRefsTransaction(self)
+        try:
+            yield transaction
+        except BaseException:
+            for image_id in transaction.added:
+                self._remove(keys=self.keys, args=[image_id])
+            raise
+        finally:
+            transaction.release()
+
+    def get_hash(self, image_id: str) -> Optional[str]:
+        """Content hash of the blob an image points to, None for unknown images"""
+        return self.redis.hget(self.keys[0], image_id)
+
+    def add(self, transaction: 'RedisRefsTransaction', image_id: str, content_hash: str,
+            size: int) -> int:
+        """
+        Point an image at a blob (within transaction())
+
+        Returns:
+            int: Reference count of the blob afterwards (1 for a new blob)
+        """
+        transaction.hold(content_hash)
+        refcount = int(self._add(keys=self.keys, args=[image_id, content_hash, size, time.time()]))
+        transaction.added.append(image_id)
+        return refcount
+
+    def remove(self, transaction: 'RedisRefsTransaction', image_id: str) -> Optional[Tuple[str, int]]:
+        """
+        Drop the reference of an image (within transaction())
+
+        Returns:
+            Optional[Tuple[str, int]]: Content hash and remaining reference count
+                of its blob (the blob record is gone at 0), None for unknown images
+        """
+        # An image never changes its blob, so the hash read before locking stays valid
+        content_hash = self.get_hash(image_id)
+        if content_hash is None:
+            return None
+        transaction.hold(content_hash)
+        removed = self._remove(keys=self.keys, args=[image_id])
+        if removed is None:
+            return None
+        return removed[0], int(removed[1])
+
+    def is_referenced(self, transaction: 'RedisRefsTransaction', content_hash: str) -> bool:
+        """Whether a blob has a record (within transaction())"""
+        transaction.hold(content_hash)
+        return bool(self.redis.hexists(self.keys[2], content_hash))
+
+    def all_refs(self) -> Dict[str, Tuple[str, Optional[float]]]:
+        """Content hash and creation time of every image"""
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hgetall(self.keys[0])
+        pipe.hgetall(self.keys[1])
+        refs, created = pipe.execute()
+        return {image_id: (content_hash, float(created[image_id]) if image_id in created else None)
+                for image_id, content_hash in refs.items()}
+
+    def total_size(self) -> int:
+        """Bytes of all stored blobs, each counted once"""
+        return int(self.redis.get(self.keys[4]) or 0)
+
+    def counts(self) -> Tuple[int, int]:
+        """Number of blobs and of image references"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hlen(self.keys[2])
+        pipe.hlen(self.keys[0])
+        blobs, refs = pipe.execute()
+        return blobs, refs
+
+class RedisRefsTransaction:
+    """
+    Blob locks of one RedisBlobRefs.transaction()
+
+    Holds the lock of one content hash at a time: moving on to another blob
+    releases the previous one, so two transactions never wait for each other
+    in a cycle. Work on a blob follows the reference change on it, before
+    the next one.
+    """
+
+    def __init__(self, refs: RedisBlobRefs):
+        """Start without holding a lock"""
+        self.refs = refs
+        self.content_hash = None
+        self.lock = None
+        # Image ids whose references were added, undone on errors
+        self.added = []
+
+    def hold(self, content_hash: str) -> None:
+        """Take the lock of a blob, releasing the one held before"""
+        if content_hash == self.content_hash:
+            return
+        self.release()
+        lock = self.refs.redis.lock(f"{self.refs.KEY_PREFIX}lock:{content_hash}",
+                                    timeout=self.refs.LOCK_TIMEOUT)
+        lock.acquire()
+        self.lock, self.content_hash = lock, content_hash
+
+    def release(self) -> None:
+        """Release the held lock"""
+        if self.lock is None:
+            return
+        from redis.exceptions import LockError
+        try:
+            self.lock.release()
+        except LockError:
+            logger.warning(f"Lock of blob {self.content_hash} expired before it was released")
+        self.lock = self.content_hash = None
+
+def create_blob_refs(location: str):
+    """Create a reference store from a SQLite database path or a redis:// URL"""
+    if location.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBlobRefs(location)
+    return BlobRefs(location)
@@ -0,0 +1,106 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+class DiskLRU:
+    """
+    Size accounting and least recently used eviction for a cache directory
+
+    Cached files are touched on access, so their mtime is the last use. The
+    directory may be shared by several worker processes: the size is counted
+    once and then tracked per process, and eviction rescans the directory.
+    Names starting with a dot (temporary and staging files) are not cached
+    files.
+    """
+
+    def __init__(self, path: str, max_bytes: int, label: str = 'files'):
+        """
+        Initialize cache accounting
+
+        Args:
+            path (str): Cache directory, scanned recursively
+            max_bytes (int): Size above which least recently used files are evicted
+            label (str): What the files are, for the eviction log message
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.label = label
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def touch(path: str) -> bool:
+        """Mark a cached file as used, False if it does not exist"""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def size(self) -> int:
+        """Bytes used by cached files"""
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, size, _ in self._scan())
+            return self._bytes
+
+    def add(self, added_bytes: int, keep: str) -> None:
+        """Account a file added to the cache and evict once over max_bytes, sparing `keep`"""
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._bytes += added_bytes
+            if self._bytes > self.max_bytes:
+                self._evict(keep)
+
+    def remove(self, path: str) -> bool:
+        """Delete a cached file and stop counting it, False if it did not exist"""
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                return False
+            if self._bytes is not None:
+                self._bytes = max(self._bytes - size, 0)
+            return True
+
+    def _scan(self) -> list:
+        """List cached files as (path, size, last access) tuples"""
+        files = []
+        for root, dirs, names in os.walk(self.path):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            for name in names:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict(self, keep: str) -> None:
+        """Drop least recently used files down to 90% of max_bytes (caller holds the lock)"""
+        # Rescan: other worker processes share the directory
+        files = sorted(self._scan(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for path, size, _ in files:
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._bytes = total
+        logger.info(f"Evicted {evicted} cached {self.label}")
@@ -0,0 +1,124 @@
+import io
+import json
+import logging
+import os
+import tarfile
+import time
+import zipfile
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Supported archive formats and their content types
+ARCHIVE_FORMATS = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar'
+}
+
+CHUNK_SIZE = 1024 * 1024
+
+# Archive member: name, content chunks and size in bytes
+Member = Tuple[str, Iterable[bytes], int]
+
+class _StreamBuffer(io.RawIOBase):
+    """Unseekable sink collecting what an archive writer emits until it is drained"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def file_chunks(path: str) -> Iterator[bytes]:
+    """Read a file in chunks"""
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            yield chunk
+
+def metadata_lines(records: Iterable[Dict]) -> Iterator[bytes]:
+    """Serialize metadata records as JSON lines"""
+    for metadata in records:
+        yield json.dumps(metadata, ensure_ascii=False, sort_keys=True).encode('utf-8') + b'\n'
+
+def export_members(records: Iterable[Dict],
+                   image_path: Callable[[str], Optional[str]]) -> Iterator[Member]:
+    """
+    Archive members of an export: metadata.jsonl, then images/<filename> per record
+
+    Args:
+        records (Iterable[Dict]): Exported metadata records, read once; metadata.jsonl
+            and the images come from that one snapshot, so images saved or deleted
+            meanwhile cannot change the size its tar header promised
+        image_path (Callable): Resolves an image filename to its path, None if missing
+    """
+    records = list(records)
+    lines = list(metadata_lines(records))
+    yield 'metadata.jsonl', lines, sum(len(line) for line in lines)
+
+    for metadata in records:
+        filename = metadata.get('image_filename')
+        path = image_path(filename) if filename else None
+        if path is None:
+            logger.warning(f"Image missing from export: {filename}")
+            continue
+        yield f"images/{filename}", file_chunks(path), os.path.getsize(path)
+
+def stream_zip(members: Iterable[Member]) -> Iterator[bytes]:
+    """Write members to a ZIP archive (stored, images are already compressed), chunk by chunk"""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for name, chunks, size in members:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.file_size = size
+            with archive.open(info, 'w') as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+def stream_tar(members: Iterable[Member]) -> Iterator[bytes]:
+    """Write members to an uncompressed tar archive, chunk by chunk"""
+    mtime = int(time.time())
+    for name, chunks, size in members:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = mtime
+        info.mode = 0o644
+        yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        written = 0
+        for chunk in chunks:
+            written += len(chunk)
+            yield chunk
+        if written != size:
+            # The header already promised `size` bytes; a mismatch would shift every later member
+            raise RuntimeError(f"{name} changed during export ({written} bytes, expected {size})")
+        yield tarfile.NUL * (-size % tarfile.BLOCKSIZE)
+    # End-of-archive marker (at least two zero blocks), one full record of them
+    yield tarfile.NUL * tarfile.RECORDSIZE
+
+def stream_archive(members: Iterable[Member], archive_format: str) -> Iterator[bytes]:
+    """
+    Stream an archive without building it in memory or on disk
+
+    Args:
+        members (Iterable[Member]): Archive members, see export_members
+        archive_format (str): 'zip' or 'tar'
+
+    Returns:
+        Iterator[bytes]: Archive bytes, at most one chunk of one member buffered
+    """
+    writer = {'zip': stream_zip, 'tar': stream_tar}.get(archive_format)
+    if writer is None:
+        raise ValueError(f"Unsupported archive format: {archive_format}")
+    return (data for data in writer(members) if data)
@@ -0,0 +1,250 @@
+import fcntl
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+from utils.storage import ImageManager, MetadataManager
+
+logger = logging.getLogger(__name__)
+
+# Kinds of inconsistencies reported by check_storage
+FINDINGS = ('corrupt_metadata', 'missing_images', 'orphan_images', 'orphan_blobs',
+            'unindexed', 'stale_index')
+
+def check_storage(image_manager: ImageManager, metadata_manager: MetadataManager,
+                  repair: bool = False, deep: bool = False,
+                  grace_seconds: int = 3600) -> Dict[str, List[str]]:
+    """
+    Find (and optionally repair) inconsistencies between images, metadata and the index
+
+    Images are saved before their metadata and deleted after it, so a
+    metadata file is the commit record of a generation:
+
+    - corrupt_metadata: unreadable records; rewritten from the index, as a
+      minimal record when only the image survived, or removed
+    - missing_images: records whose image is gone; removed
+    - orphan_images: images without a record older than grace_seconds
+      (interrupted generations); removed
+    - orphan_blobs: blob files without a reference record; removed
+    - unindexed, stale_index: records missing from or left over in the index
+
+    Each store is listed once by name, without per-file stat calls; record
+    files are only read when the index does not know them (all with deep).
+    Safe to run while the app serves traffic.
+
+    Args:
+        image_manager (ImageManager): Image store
+        metadata_manager (MetadataManager): Metadata store
+        repair (bool): Fix what is found, otherwise only report
+        deep (bool): Also read and validate records that are in the index
+        grace_seconds (int): Age below which images without a record are
+            assumed to be still in the middle of a generation
+
+    Returns:
+        Dict[str, List[str]]: Filenames per finding
+    """
+    try:
+        cutoff = time.time() - grace_seconds
+        report = {finding: [] for finding in FINDINGS}
+        index = metadata_manager.index
+
+        # Listing order matters for concurrent writers: the index first, then
+        # records, then images. A record saved after its ids were read is seen
+        # as unindexed (re-indexing it is harmless), and every listed record's
+        # image was saved before it, so the image listing cannot miss it.
+        metadata_manager.sync_index()
+        indexed = index.ids() if index is not None else set()
+        records = {os.path.splitext(stored.name)[0]: stored
+                   for stored in metadata_manager.iter_objects('json', stat=False)}
+
+        # Image id -> filename, for images with their own file and references to blobs
+        images = {}
+        image_keys = {}
+        created = {}
+        for extension in image_manager.FILE_EXTENSIONS:
+            for stored in image_manager.iter_objects(extension, stat=False):
+                image_id = os.path.splitext(stored.name)[0]
+                images[image_id] = stored.name
+                image_keys[image_id] = stored.key
+        if image_manager.refs is not None:
+            blobs = {}
+            for extension in image_manager.FILE_EXTENSIONS:
+                for stored in image_manager.blobs.iter_objects(extension, stat=False):
+                    blobs[os.path.splitext(stored.name)[0]] = f".{extension}"
+            refs = image_manager.refs.all_refs()
+            for image_id, (content_hash, ref_created) in refs.items():
+                if content_hash in blobs:
+                    images[image_id] = f"{image_id}{blobs[content_hash]}"
+                    created[image_id] = ref_created
+            referenced = {content_hash for content_hash, _ in refs.values()}
+            for content_hash, extension in blobs.items():
+                if content_hash not in referenced:
+                    report['orphan_blobs'].append(f"{content_hash}{extension}")
+
+        # Records the index does not vouch for are read and validated
+        removed = set()
+        for image_id, stored in records.items():
+            if image_id in indexed and not deep:
+                continue
+            data = metadata_manager.backend.get_bytes(stored.key)
+            if data is None:
+                # Deleted since the listing
+                removed.add(image_id)
+                continue
+            metadata = metadata_manager.parse_metadata(data)
+            if metadata is None:
+                report['corrupt_metadata'].append(stored.name)
+                if repair and not _repair_record(metadata_manager, stored.key, image_id,
+                                                 images.get(image_id)):
+                    removed.add(image_id)
+            elif index is not None and image_id not in indexed:
+                report['unindexed'].append(stored.name)
+                if repair:
+                    index.upsert(image_id, metadata)
+
+        report['stale_index'] = [f"{image_id}.json" for image_id in indexed - records.keys()]
+        if repair and report['stale_index']:
+            index.remove_many([os.path.splitext(name)[0] for name in report['stale_index']])
+
+        for image_id in records.keys() - images.keys() - removed:
+            # The listing is a snapshot; check the image itself before dropping its record
+            if not any(image_manager.image_exists(f"{image_id}.{extension}")
+                       for extension in image_manager.FILE_EXTENSIONS):
+                report['missing_images'].append(f"{image_id}.json")
+        if repair and report['missing_images']:
+            metadata_manager.delete_metadata_many(report['missing_images'])
+            # Drops references left pointing to a missing blob
+            image_manager.delete_images([f"{os.path.splitext(name)[0]}.webp"
+                                         for name in report['missing_images']])
+
+        for image_id in images.keys() - records.keys():
+            if image_id in image_keys:
+                stat = image_manager.backend.stat(image_keys[image_id])
+                saved_at = stat.mtime if stat is not None else None
+            else:
+                saved_at = created.get(image_id)
+            # References from before creation times were recorded count as old
+            if saved_at is None or saved_at < cutoff:
+                report['orphan_images'].append(images[image_id])
+        if repair and report['orphan_images']:
+            image_manager.delete_images(report['orphan_images'])
+
+        if repair:
+            report['orphan_blobs'] = [name for name in report['orphan_blobs']
+                                      if image_manager.delete_orphan_blob(name)]
+
+        logger.info(
+            f"Storage check of {len(records)} records and {len(images)} images"
+            f"{' (repaired)' if repair else ''}: "
+            + ', '.join(f"{finding}={len(names)}" for finding, names in report.items())
+        )
+        return report
+
+    except Exception as e:
+        logger.error(f"Error checking storage: {str(e)}", exc_info=True)
+        raise
+
+def _repair_record(metadata_manager: MetadataManager, key: str, image_id: str,
+                   image_filename: str = None) -> bool:
+    """
+    Replace a corrupt record from the index, or with a minimal one if the image exists
+
+    Returns:
+        bool: Whether a record was written (False: it was removed)
+    """
+    index = metadata_manager.index
+    metadata = index.get(image_id) if index is not None else None
+    if metadata is None and image_filename is not None:
+        # Keep the image in the gallery even though its prompt is lost
+        metadata = {
+            'image_filename': image_filename,
+            'timestamp': datetime.utcnow().isoformat(),
+            'recovered': True
+        }
+    if metadata is None:
+        metadata_manager.delete_metadata_many([f"{image_id}.json"])
+        return False
+
+    metadata_manager.backend.put_bytes(key, json.dumps(metadata, indent=2).encode('utf-8'))
+    if index is not None:
+        index.upsert(image_id, metadata)
+    logger.info(f"Repaired corrupt metadata: {image_id}.json")
+    return True
+
+class PeriodicCheck:
+    """
+    Runs a task every `interval` seconds in one process per node
+
+    Every worker process starts one; an exclusive flock on lock_path lets
+    only one of them run the task at a time, and the time of the last
+    completed run stored in the lock file keeps the others from repeating
+    it within the interval.
+    """
+
+    def __init__(self, task: Callable[[], None], lock_path: str, interval: int):
+        """
+        Initialize periodic check
+
+        Args:
+            task (Callable[[], None]): Work to run
+            lock_path (str): Lock file shared by the processes of the node
+            interval (int): Seconds between runs
+        """
+        self.task = task
+        self.lock_path = lock_path
+        self.interval = interval
+        self._stop = threading.Event()
+        os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+
+    def start(self) -> 'PeriodicCheck':
+        """Start the background thread"""
+        threading.Thread(target=self._run, name='periodic-check', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        """Stop after the current run"""
+        self._stop.set()
+
+    def _run(self) -> None:
+        # Wake up several times per interval (with jitter, so worker processes
+        # do not contend for the lock in step); run_if_due decides whether to run
+        while not self._stop.wait(self.interval * random.uniform(0.1, 0.2)):
+            try:
+                self.run_if_due()
+            except Exception as e:
+                logger.error(f"Periodic check failed: {str(e)}", exc_info=True)
+
+    def run_if_due(self) -> bool:
+        """
+        Run the task unless another process is running it or ran it within the interval
+
+        Returns:
+            bool: Whether the task ran
+        """
+        with open(self.lock_path, 'a+') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            try:
+                lock_file.seek(0)
+                try:
+                    last_run = float(lock_file.read() or 0)
+                except ValueError:
+                    last_run = 0
+                if time.time() - last_run < self.interval:
+                    return False
+
+                self.task()
+
+                lock_file.seek(0)
+                lock_file.truncate()
+                lock_file.write(str(time.time()))
+                lock_file.flush()
+                return True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,403 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait as wait_for_futures
+from datetime import datetime
+from typing import Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Job lifecycle: queued -> translating -> [waiting] -> generating -> saving -> done | failed
+FINAL_STATES = ('done', 'failed')
+
+class JobQueueFull(Exception):
+    """Raised when a model already has too many queued jobs"""
+
+class JobBackend:
+    """Base class for job state storage"""
+
+    def create(self, job: Dict) -> None:
+        """Store a new job"""
+        raise NotImplementedError
+
+    def update(self, job_id: str, **fields) -> Optional[Dict]:
+        """Update fields of a job and return the new state"""
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Get job state or None if unknown"""
+        raise NotImplementedError
+
+    def watch(self, job_id: str, heartbeat: float = 15.0) -> Iterator[Optional[Dict]]:
+        """
+        Stream job state changes
+
+        Yields the current state first, then every new state until the job
+        reaches a final state. Yields None when nothing changed for
+        `heartbeat` seconds so callers can keep connections alive.
+        """
+        raise NotImplementedError
+
+    def ping(self) -> None:
+        """Raise if the store cannot be reached"""
+
+class LocalJobBackend(JobBackend):
+    """In-process job storage, for development and tests"""
+
+    def __init__(self, ttl: int = 86400):
+        """Initialize with the number of seconds finished jobs are kept"""
+        self.ttl = ttl
+        self._jobs = {}
+        self._versions = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def _prune(self) -> None:
+        """Drop finished jobs past their TTL (caller holds the lock)"""
+        now = time.monotonic()
+        for job_id in [j for j, expires in self._expires.items() if expires < now]:
+            self._jobs.pop(job_id, None)
+            self._versions.pop(job_id, None)
+            del self._expires[job_id]
+
+    def create(self, job: Dict) -> None:
+        """Store a new job"""
+        with self._lock:
+            self._prune()
+            self._jobs[job['id']] = dict(job)
+            self._versions[job['id']] = 0
+
+    def update(self, job_id: str, **fields) -> Optional[Dict]:
+        """Update fields of a job and return the new state"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            if job['status'] in FINAL_STATES:
+                self._expires[job_id] = time.monotonic() + self.ttl
+            self._versions[job_id] += 1
+            self._changed.notify_all()
+            return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Get job state or None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def watch(self, job_id: str, heartbeat: float = 15.0) -> Iterator[Optional[Dict]]:
+        """Stream job state changes (see JobBackend.watch)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            version = self._versions.get(job_id)
+        if job is None:
+            return
+        yield dict(job)
+
+        while job['status'] not in FINAL_STATES:
+            with self._changed:
+                changed = self._changed.wait_for(
+                    lambda: self._versions.get(job_id) != version, timeout=heartbeat
+                )
+                job = self._jobs.get(job_id)
+                version = self._versions.get(job_id)
+                if job is not None:
+                    job = dict(job)
+            if job is None:
+                return
+            yield job if changed else None
+
+class RedisJobBackend(JobBackend):
+    """Redis job storage, shared by all gunicorn workers"""
+
+    KEY_PREFIX = 'job:'
+    CHANNEL_PREFIX = 'job-events:'
+
+    def __init__(self, url: str, ttl: int = 86400):
+        """Initialize with a redis:// URL and job TTL in seconds"""
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def ping(self) -> None:
+        """Raise if Redis cannot be reached"""
+        self.redis.ping()
+
+    def create(self, job: Dict) -> None:
+        """Store a new job"""
+        self.redis.set(self.KEY_PREFIX + job['id'], json.dumps(job), ex=self.ttl)
+
+    def update(self, job_id: str, **fields) -> Optional[Dict]:
+        """Update fields of a job and return the new state"""
+        # Only the worker running a job writes to it, so read-modify-write is safe
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.update(fields)
+        payload = json.dumps(job)
+        self.redis.set(self.KEY_PREFIX + job_id, payload, ex=self.ttl)
+        self.redis.publish(self.CHANNEL_PREFIX + job_id, payload)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Get job state or None if unknown"""
+        raw = self.redis.get(self.KEY_PREFIX + job_id)
+        return json.loads(raw) if raw is not None else None
+
+    def watch(self, job_id: str, heartbeat: float = 15.0) -> Iterator[Optional[Dict]]:
+        """Stream job state changes (see JobBackend.watch)"""
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            # Subscribe before reading so no transition is missed in between
+            pubsub.subscribe(self.CHANNEL_PREFIX + job_id)
+            job = self.get(job_id)
+            if job is None:
+                return
+            yield job
+
+            while job['status'] not in FINAL_STATES:
+                message = pubsub.get_message(timeout=heartbeat)
+                if message is None:
+                    yield None
+                    continue
+                job = json.loads(message['data'])
+                yield job
+        finally:
+            pubsub.close()
+
+def create_job_backend(url: str, ttl: int = 86400) -> JobBackend:
+    """Create a job backend from a URL (memory:// or redis://)"""
+    if url.startswith('memory://'):
+        return LocalJobBackend(ttl)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisJobBackend(url, ttl)
+    raise ValueError(f"Unsupported job store URL: {url}")
+
+class JobManager:
+    """Runs generation jobs on bounded per-model thread pools"""
+
+    def __init__(self, backend: JobBackend, model_limits: Dict[str, int],
+                 default_limit: int = 1, max_queued: int = 20):
+        """
+        Initialize job manager
+
+        Args:
+            backend (JobBackend): Storage for job state
+            model_limits (Dict[str, int]): Maximum concurrent jobs per model key
+            default_limit (int): Concurrency for models missing from model_limits
+            max_queued (int): Maximum waiting jobs per model before rejecting new ones
+        """
+        self.backend = backend
+        self.model_limits = model_limits
+        self.default_limit = default_limit
+        self.max_queued = max_queued
+        self._executors = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _executor(self, model_key: str) -> ThreadPoolExecutor:
+        """Get the thread pool for a model (caller holds the lock)"""
+        executor = self._executors.get(model_key)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=self.model_limits.get(model_key, self.default_limit),
+                thread_name_prefix=f"job-{model_key}"
+            )
+            self._executors[model_key] = executor
+        return executor
+
+    def submit(self, model_key: str, pipeline: Callable[[Callable[[str], None]], Dict],
+               on_finish: Optional[Callable[[Dict], None]] = None, **fields) -> Dict:
+        """
+        Enqueue a job
+
+        Args:
+            model_key (str): Model the job runs on, selects the pool
+            pipeline (Callable): Called with a set_state(status) callback, returns the job result
+            on_finish (Optional[Callable]): Called in the worker thread with the final job state
+            **fields: Extra fields stored with the job
+
+        Returns:
+            Dict: Initial job state
+        """
+        now = datetime.utcnow().isoformat()
+        job = {
+            'id': str(uuid.uuid4()),
+            'status': 'queued',
+            'model': model_key,
+            'created_at': now,
+            'updated_at': now,
+            'result': None,
+            'error': None,
+            **fields
+        }
+
+        with self._lock:
+            pending = self._pending.get(model_key, 0)
+            limit = self.model_limits.get(model_key, self.default_limit)
+            if pending >= limit + self.max_queued:
+                raise JobQueueFull(f"Too many queued jobs for model {model_key}")
+            self._pending[model_key] = pending + 1
+            self.backend.create(job)
+            self._dispatch(job['id'], model_key, pipeline, on_finish)
+
+        logger.info("Job queued", extra={'job_id': job['id'], 'model': model_key})
+        return job
+
+    def _dispatch(self, job_id: str, model_key: str, pipeline: Callable,
+                  on_finish: Optional[Callable[[Dict], None]]) -> None:
+        """Hand a job to the model's pool (caller holds the lock)"""
+        self._executor(model_key).submit(self._run, job_id, model_key, pipeline, on_finish)
+
+    def _set_state(self, job_id: str) -> Callable[[str], None]:
+        """Build the set_state(status) callback passed to a pipeline"""
+        def set_state(status: str) -> None:
+            self.backend.update(job_id, status=status, updated_at=datetime.utcnow().isoformat())
+        return set_state
+
+    def _run(self, job_id: str, model_key: str, pipeline: Callable,
+             on_finish: Optional[Callable[[Dict], None]]) -> None:
+        """Execute a job and record its outcome"""
+        try:
+            result = pipeline(self._set_state(job_id))
+        except Exception as e:
+            self._complete(job_id, model_key, on_finish, error=e)
+        else:
+            self._complete(job_id, model_key, on_finish, result=result)
+
+    def _complete(self, job_id: str, model_key: str, on_finish: Optional[Callable[[Dict], None]],
+                  result: Optional[Dict] = None, error: Optional[Exception] = None) -> None:
+        """Record the outcome of a job, free its queue slot and call on_finish"""
+        job = None
+        try:
+            if error is None:
+                job = self.backend.update(job_id, status='done', result=result,
+                                          updated_at=datetime.utcnow().isoformat())
+                logger.info("Job finished", extra={'job_id': job_id, 'model': model_key})
+            else:
+                logger.error(f"Job {job_id} failed: {str(error)}", exc_info=error)
+                job = self.backend.update(job_id, status='failed', error=str(error),
+                                          error_type=error.__class__.__name__,
+                                          updated_at=datetime.utcnow().isoformat())
+        except Exception as e:
+            logger.error(f"Error recording outcome of job {job_id}: {str(e)}", exc_info=True)
+        finally:
+            with self._lock:
+                self._pending[model_key] -= 1
+            if on_finish is not None:
+                try:
+                    on_finish(job)
+                except Exception as e:
+                    logger.error(f"Error in job {job_id} finish callback: {str(e)}", exc_info=True)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Get job state or None if unknown"""
+        return self.backend.get(job_id)
+
+    def watch(self, job_id: str, heartbeat: float = 15.0) -> Iterator[Optional[Dict]]:
+        """Stream job state changes, see JobBackend.watch"""
+        return self.backend.watch(job_id, heartbeat)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop all pools"""
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+        for executor in executors:
+            executor.shutdown(wait=wait)
+
+class AsyncJobManager(JobManager):
+    """
+    Runs generation jobs as coroutines on one event loop per process
+
+    Pipelines are async functions; while they wait on the remote APIs the
+    loop runs other jobs, so hundreds of generations stay in flight without
+    a thread each. Per-model limits are enforced with semaphores. Job state
+    is written by one writer thread, in order, so a blocking backend (a Redis
+    round trip) never stalls the loop.
+    """
+
+    def __init__(self, backend: JobBackend, model_limits: Dict[str, int],
+                 default_limit: int = 1, max_queued: int = 20):
+        """Initialize job manager, see JobManager"""
+        super().__init__(backend, model_limits, default_limit, max_queued)
+        self._loop = None
+        self._loop_pid = None
+        self._writer = None
+        self._semaphores = {}
+        self._futures = set()
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        """Get the loop of this process, starting its thread on first use (caller holds the lock)"""
+        # A loop inherited through fork has no running thread in the child
+        if self._loop is None or self._loop_pid != os.getpid():
+            self._loop = asyncio.new_event_loop()
+            self._loop_pid = os.getpid()
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='job-writer')
+            self._semaphores = {}
+            threading.Thread(target=self._loop.run_forever, name='job-loop', daemon=True).start()
+        return self._loop
+
+    def _dispatch(self, job_id: str, model_key: str, pipeline: Callable,
+                  on_finish: Optional[Callable[[Dict], None]]) -> None:
+        """Schedule a job on the event loop (caller holds the lock)"""
+        future = asyncio.run_coroutine_threadsafe(
+            self._run_async(job_id, model_key, pipeline, on_finish), self._event_loop()
+        )
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+
+    def _set_state(self, job_id: str) -> Callable[[str], None]:
+        """Build a set_state(status) callback that queues the update to the writer thread"""
+        writer = self._writer
+        update = super()._set_state(job_id)
+
+        def set_state(status: str) -> None:
+            writer.submit(update, status).add_done_callback(self._log_write_error)
+        return set_state
+
+    @staticmethod
+    def _log_write_error(future) -> None:
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Error updating job state: {str(error)}", exc_info=error)
+
+    async def _run_async(self, job_id: str, model_key: str, pipeline: Callable,
+                         on_finish: Optional[Callable[[Dict], None]]) -> None:
+        """Execute a job once the model has a free slot and record its outcome"""
+        semaphore = self._semaphores.get(model_key)
+        if semaphore is None:
+            # Only touched from the loop thread
+            semaphore = asyncio.Semaphore(self.model_limits.get(model_key, self.default_limit))
+            self._semaphores[model_key] = semaphore
+
+        async with semaphore:
+            # Queued after the job's state updates, and awaited so the semaphore
+            # is released only once the outcome is recorded
+            outcome = {}
+            try:
+                outcome['result'] = await pipeline(self._set_state(job_id))
+            except Exception as e:
+                outcome['error'] = e
+            await asyncio.get_running_loop().run_in_executor(
+                self._writer, functools.partial(self._complete, job_id, model_key, on_finish, **outcome)
+            )
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the event loop, after running jobs finish if `wait`"""
+        with self._lock:
+            loop, writer, futures = self._loop, self._writer, list(self._futures)
+            self._loop = None
+        if loop is None:
+            return
+        if wait:
+            wait_for_futures(futures)
+        loop.call_soon_threadsafe(loop.stop)
+        writer.shutdown(wait=wait)
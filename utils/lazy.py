@@ -0,0 +1,44 @@
+import os
+import threading
+from typing import Any, Callable
+
+class LazyInstance:
+    """
+    Stands in for an object that is built on first use, once per process
+
+    Attribute access is forwarded to the object, building it the first time.
+    Processes that never use it (gunicorn workers serving only the gallery,
+    CLI commands) never pay for it, and an object built in a preloaded
+    master is dropped in forked workers, which build their own: connection
+    pools must not be shared across a fork.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        """Initialize with the callable building the object"""
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self) -> None:
+        # The lock may have been held by another thread of the parent
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        """Whether the object exists in this process"""
+        return self._instance is not None
+
+    def get(self) -> Any:
+        """Get the object, building it on first use"""
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+                instance = self._instance
+        return instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
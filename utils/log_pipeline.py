@@ -0,0 +1,149 @@
+import atexit
+import copy
+import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+from typing import Callable, List, Optional
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+STANDARD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+class TruncatingFilter(logging.Filter):
+    """Shortens long messages and string `extra` fields (prompts, API payloads)"""
+
+    def __init__(self, max_length: int = 2000):
+        """Initialize with the maximum length of a message or field"""
+        super().__init__()
+        self.max_length = max_length
+
+    def _truncate(self, value: str) -> str:
+        return f"{value[:self.max_length]}... [{len(value) - self.max_length} chars truncated]"
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        if len(message) > self.max_length:
+            record.msg = self._truncate(message)
+            record.args = None
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRS and isinstance(value, str) and len(value) > self.max_length:
+                setattr(record, key, self._truncate(value))
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keeps a random share of records below WARNING; warnings and errors are always kept"""
+
+    def __init__(self, rate: float = 1.0):
+        """Initialize with the share (0-1) of INFO and DEBUG records to keep"""
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queue handler that drops records instead of blocking when the writer falls behind"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Make the record picklable and cheap to pass, keeping exc_info for the formatter"""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # Called under the handler lock, so the counter needs no extra locking
+        try:
+            if self.dropped:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': f"Log queue full, dropped {self.dropped} records"
+                }))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class QueueLogging:
+    """
+    Moves log formatting and I/O to a background thread
+
+    Request threads only put records on a bounded queue; a listener thread
+    formats and writes them. After a fork (gunicorn workers of a preloaded
+    app) the child gets a fresh queue, listener and handlers.
+    """
+
+    def __init__(self, handler_factory: Callable[[], List[logging.Handler]],
+                 queue_size: int = 10000, filters: Optional[List[logging.Filter]] = None):
+        """
+        Initialize queue logging
+
+        Args:
+            handler_factory (Callable): Builds the handlers that do the actual writing
+                (called again in forked children)
+            queue_size (int): Records buffered before new ones are dropped
+            filters (Optional[List[logging.Filter]]): Applied in the calling thread, before queuing
+        """
+        self.handler_factory = handler_factory
+        self.queue_size = queue_size
+        self.handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        for log_filter in filters or []:
+            self.handler.addFilter(log_filter)
+        self.listener = None
+        self._start()
+        atexit.register(self.stop)
+        os.register_at_fork(after_in_child=self._restart_after_fork)
+
+    def _start(self) -> None:
+        self.listener = QueueListener(self.handler.queue, *self.handler_factory(),
+                                      respect_handler_level=True)
+        self.listener.start()
+
+    def _restart_after_fork(self) -> None:
+        # The parent's listener thread does not exist in the child; reopen the
+        # files too so a `{pid}` log file name picks up the worker's pid
+        if self.listener is not None:
+            for handler in self.listener.handlers:
+                handler.close()
+        self.handler.queue = queue.Queue(self.queue_size)
+        self.handler.dropped = 0
+        self._start()
+
+    def stop(self) -> None:
+        """Flush queued records and close the handlers"""
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
+
+def file_handler(log_file: str, rotation: str = 'size', max_bytes: int = 1024 * 1024,
+                 backup_count: int = 10) -> logging.Handler:
+    """
+    Create the log file handler
+
+    Args:
+        log_file (str): Path; `{pid}` is replaced by the process id so each
+            worker writes (and rotates) its own file
+        rotation (str): 'size' rotates in-process, 'external' reopens the file
+            after logrotate moved it (safe with a file shared by several workers)
+        max_bytes (int): Rotation size for 'size'
+        backup_count (int): Rotated files kept for 'size'
+    """
+    log_file = log_file.replace('{pid}', str(os.getpid()))
+    directory = os.path.dirname(log_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if rotation == 'external':
+        return WatchedFileHandler(log_file)
+    if rotation == 'size':
+        return RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    raise ValueError(f"Unsupported log rotation: {rotation}")
@@ -0,0 +1,108 @@
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (feed id, 'upsert' or 'remove', image ids, metadata of an upsert)
+Change = Tuple[str, str, List[str], Optional[Dict]]
+
+class MetadataFeed:
+    """
+    Saves and deletes of metadata records, shared by the nodes of one object store
+
+    Every node keeps its own SQLite index of the bucket and applies the
+    changes all nodes publish here (see MetadataManager.sync_index). The
+    feed is a Redis stream holding the last max_entries changes; a node
+    whose cursor is older than the trimmed part missed some of them and
+    rebuilds its index from the bucket instead.
+    """
+
+    STREAM_KEY = 'metadata-changes'
+    # Id of the newest entry trimmed from the stream
+    TRIMMED_KEY = 'metadata-changes:trimmed'
+
+    # Changes applied per index transaction
+    READ_COUNT = 500
+
+    PUBLISH_SCRIPT = """
+        local id = redis.call('XADD', KEYS[1], '*', 'op', ARGV[1], 'ids', ARGV[2], 'metadata', ARGV[3])
+        local excess = redis.call('XLEN', KEYS[1]) - tonumber(ARGV[4])
+        if excess > 0 then
+            local dropped = redis.call('XRANGE', KEYS[1], '-', '+', 'COUNT', excess)
+            redis.call('SET', KEYS[2], dropped[#dropped][1])
+            redis.call('XTRIM', KEYS[1], 'MAXLEN', ARGV[4])
+        end
+        return id
+    """
+
+    def __init__(self, url: str, max_entries: int = 20000):
+        """
+        Initialize with a redis:// URL
+
+        Args:
+            url (str): Redis URL
+            max_entries (int): Changes kept for nodes that are behind
+        """
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.max_entries = max_entries
+        self._publish = self.redis.register_script(self.PUBLISH_SCRIPT)
+
+    @staticmethod
+    def _parse_id(entry_id: str) -> Tuple[int, int]:
+        """Stream id as a comparable (milliseconds, sequence) pair"""
+        ms, _, seq = entry_id.partition('-')
+        return int(ms), int(seq or 0)
+
+    def publish_upsert(self, image_id: str, metadata: Dict) -> str:
+        """Publish a saved record, returns its feed id"""
+        return self._publish(keys=[self.STREAM_KEY, self.TRIMMED_KEY],
+                             args=['upsert', json.dumps([image_id]), json.dumps(metadata),
+                                   self.max_entries])
+
+    def publish_remove(self, image_ids: List[str]) -> str:
+        """Publish deleted records, returns the feed id"""
+        return self._publish(keys=[self.STREAM_KEY, self.TRIMMED_KEY],
+                             args=['remove', json.dumps(image_ids), '', self.max_entries])
+
+    def last_id(self) -> str:
+        """Id of the newest change ('0-0' for an empty feed)"""
+        entries = self.redis.xrevrange(self.STREAM_KEY, count=1)
+        return entries[0][0] if entries else '0-0'
+
+    def read(self, after: Optional[str], count: int = READ_COUNT) -> Optional[List[Change]]:
+        """
+        Changes published after a cursor, oldest first
+
+        Args:
+            after (Optional[str]): Feed id of the last applied change
+            count (int): Most changes to return
+
+        Returns:
+            Optional[List[Change]]: Up to count changes, None when some after
+                the cursor were already trimmed (or there is no cursor)
+        """
+        if after is None:
+            return None
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.get(self.TRIMMED_KEY)
+        pipe.xrange(self.STREAM_KEY, min=f'({after}', count=count)
+        trimmed, entries = pipe.execute()
+        if trimmed is not None and self._parse_id(after) < self._parse_id(trimmed):
+            return None
+        return [(entry_id, fields['op'], json.loads(fields['ids']),
+                 json.loads(fields['metadata']) if fields['metadata'] else None)
+                for entry_id, fields in entries]
+
+    def ping(self) -> None:
+        """Raise if Redis cannot be reached"""
+        self.redis.ping()
+
+def create_metadata_feed(url: str, max_entries: int = 20000) -> Optional[MetadataFeed]:
+    """Create the metadata change feed from a URL (redis://), None if empty or 'off'"""
+    if not url or url == 'off':
+        return None
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return MetadataFeed(url, max_entries)
+    raise ValueError(f"Unsupported metadata sync URL: {url}")
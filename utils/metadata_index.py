@@ -0,0 +1,430 @@
+import hashlib
+import json
+import re
+import sqlite3
+import logging
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils.sqlite import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+class MetadataIndex:
+    """SQLite index over metadata records, ordered by timestamp, with full-text prompt search"""
+
+    # Bump when the schema changes; the index is rebuilt from disk on mismatch
+    SCHEMA_VERSION = 5
+
+    COLUMNS = ('image_id', 'timestamp', 'batch_id', 'result_key', 'model', 'aspect_ratio', 'metadata')
+    INSERT_SQL = (f"INSERT INTO images ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+                  "ON CONFLICT (image_id) DO UPDATE SET "
+                  + ', '.join(f"{column} = excluded.{column}" for column in COLUMNS[1:]))
+
+    # bm25 weights of the original prompt, translated prompt and model columns
+    SEARCH_WEIGHTS = (1.0, 1.0, 0.5)
+
+    def __init__(self, db_path: str):
+        """Open (or create) the index database at db_path"""
+        self.db_path = db_path
+        self.db = SQLiteDatabase(db_path)
+        self._ensure_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get a connection for the current thread and process"""
+        return self.db.connect()
+
+    def _ensure_schema(self) -> None:
+        """Create tables, dropping them first if the schema version changed"""
+        conn = self._connect()
+        with conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                if version:
+                    logger.info(f"Metadata index schema changed ({version} -> {self.SCHEMA_VERSION}), resetting")
+                conn.execute('DROP TABLE IF EXISTS images')
+                conn.execute('DROP TABLE IF EXISTS images_fts')
+                conn.execute('DROP TABLE IF EXISTS index_state')
+                conn.execute('DROP TABLE IF EXISTS index_journal')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS images (
+                    image_id TEXT PRIMARY KEY,
+                    timestamp TEXT NOT NULL,
+                    batch_id TEXT,
+                    result_key TEXT,
+                    model TEXT,
+                    aspect_ratio TEXT,
+                    metadata TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_images_timestamp
+                ON images (timestamp DESC, image_id DESC)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_images_batch
+                ON images (batch_id) WHERE batch_id IS NOT NULL
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_images_model
+                ON images (model, timestamp DESC)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_images_result_key
+                ON images (result_key, timestamp DESC) WHERE result_key IS NOT NULL
+            """)
+            # Prompts of each image under the rowid of its images row; diacritics are
+            # folded so "kocka" finds "kočka", prefix indexes keep prefix queries fast
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5 (
+                    original_prompt, translated_prompt, model,
+                    tokenize = 'unicode61 remove_diacritics 2',
+                    prefix = '2 3'
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS index_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+            # Images changed while a rebuild reads the stored records, see rebuild
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS index_journal (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    image_id TEXT NOT NULL
+                )
+            """)
+            conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+
+    def is_built(self) -> bool:
+        """Whether the index has been populated from disk at least once"""
+        row = self._connect().execute(
+            "SELECT value FROM index_state WHERE key = 'built'"
+        ).fetchone()
+        return row is not None
+
+    @staticmethod
+    def result_key(model: str, prompt: str, width: int, height: int, seed: int) -> str:
+        """Lookup key of a deterministic generation (same inputs, same image)"""
+        raw = json.dumps([model, prompt, width, height, seed], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _row_values(self, image_id: str, metadata: Dict) -> Tuple:
+        """Column values for a metadata record"""
+        inputs = (metadata.get('model'), metadata.get('translated_prompt', metadata.get('prompt')),
+                  metadata.get('width'), metadata.get('height'), metadata.get('seed'))
+        result_key = self.result_key(*inputs) if None not in inputs else None
+        return (image_id, metadata.get('timestamp', ''), metadata.get('batch_id'), result_key,
+                metadata.get('model'), metadata.get('aspect_ratio'), json.dumps(metadata))
+
+    # Search text of the images rows selected by the WHERE clause it is completed with
+    FTS_INSERT_SQL = (
+        "INSERT INTO images_fts (rowid, original_prompt, translated_prompt, model) "
+        "SELECT rowid, COALESCE(json_extract(metadata, '$.original_prompt'), ''), "
+        "COALESCE(json_extract(metadata, '$.translated_prompt'), json_extract(metadata, '$.prompt'), ''), "
+        "COALESCE(model, '') FROM images"
+    )
+
+    # Journals the image ids of a write while a rebuild is running
+    JOURNAL_SQL = ("INSERT INTO index_journal (image_id) SELECT ? "
+                   "WHERE EXISTS (SELECT 1 FROM index_state WHERE key = 'rebuilding')")
+
+    def _write_upsert(self, conn: sqlite3.Connection, image_id: str, metadata: Dict) -> None:
+        """Insert or replace the record for an image and its search text (within a transaction)"""
+        conn.execute(self.JOURNAL_SQL, (image_id,))
+        # An upsert keeps the rowid, which the search table is keyed by
+        conn.execute(self.INSERT_SQL, self._row_values(image_id, metadata))
+        conn.execute(
+            'DELETE FROM images_fts WHERE rowid = (SELECT rowid FROM images WHERE image_id = ?)',
+            (image_id,)
+        )
+        conn.execute(f'{self.FTS_INSERT_SQL} WHERE image_id = ?', (image_id,))
+
+    def _write_remove(self, conn: sqlite3.Connection, image_ids: List[str]) -> None:
+        """Remove the records of images (within a transaction)"""
+        params = [(image_id,) for image_id in image_ids]
+        conn.executemany(self.JOURNAL_SQL, params)
+        conn.executemany(
+            'DELETE FROM images_fts WHERE rowid = (SELECT rowid FROM images WHERE image_id = ?)',
+            params
+        )
+        conn.executemany('DELETE FROM images WHERE image_id = ?', params)
+
+    def upsert(self, image_id: str, metadata: Dict) -> None:
+        """Insert or replace the record for an image and its search text"""
+        conn = self._connect()
+        with conn:
+            self._write_upsert(conn, image_id, metadata)
+
+    def remove(self, image_id: str) -> None:
+        """Remove the record for an image"""
+        self.remove_many([image_id])
+
+    def remove_many(self, image_ids: List[str]) -> None:
+        """Remove the records of many images in one transaction"""
+        conn = self._connect()
+        with conn:
+            self._write_remove(conn, image_ids)
+
+    def feed_cursor(self) -> Optional[str]:
+        """Id of the last change applied from the metadata feed, None before the first build"""
+        row = self._connect().execute(
+            "SELECT value FROM index_state WHERE key = 'feed_cursor'"
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def apply_changes(self, after: str, changes: List[Tuple[str, str, List[str], Optional[Dict]]]) -> bool:
+        """
+        Apply changes read from the metadata feed and move the cursor past them
+
+        Args:
+            after (str): Cursor the changes were read after
+            changes (List[Tuple[str, str, List[str], Optional[Dict]]]): Feed id,
+                operation ('upsert' or 'remove'), image ids and metadata, oldest first
+
+        Returns:
+            bool: False when another process moved the cursor meanwhile (nothing applied)
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT value FROM index_state WHERE key = 'feed_cursor'").fetchone()
+            if row is None or row[0] != after:
+                return False
+            for _, operation, image_ids, metadata in changes:
+                if operation == 'upsert':
+                    self._write_upsert(conn, image_ids[0], metadata)
+                else:
+                    self._write_remove(conn, image_ids)
+            conn.execute("UPDATE index_state SET value = ? WHERE key = 'feed_cursor'",
+                         (changes[-1][0],))
+        return True
+
+    def rebuild(self, records: Iterable[Tuple[str, Dict]], feed_cursor: Optional[str] = None) -> int:
+        """
+        Replace the whole index with the given records
+
+        Records are read (the iterable consumed) without holding the write
+        lock, so saves and deletes go on meanwhile. Those writes are journaled
+        and win over what was read: an image changed during the rebuild keeps
+        its current row, or stays removed.
+
+        Args:
+            records (Iterable[Tuple[str, Dict]]): Pairs of image id and metadata,
+                best a generator reading them from storage
+            feed_cursor (Optional[str]): Id of the newest metadata feed change
+                taken before reading the records; later ones are applied on top
+
+        Returns:
+            int: Number of indexed records
+        """
+        conn = self._connect()
+        token = uuid.uuid4().hex
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO index_state (key, value) VALUES ('rebuilding', ?)",
+                         (token,))
+            start = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM index_journal').fetchone()[0]
+
+        rows = [self._row_values(image_id, metadata) for image_id, metadata in records]
+
+        with conn:
+            # Take the write lock up front so concurrent rebuilds serialize
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS changed (image_id TEXT PRIMARY KEY)')
+            conn.execute('DELETE FROM temp.changed')
+            conn.execute('INSERT OR IGNORE INTO temp.changed SELECT image_id FROM index_journal '
+                         'WHERE seq > ?', (start,))
+            conn.execute('DELETE FROM images WHERE image_id NOT IN (SELECT image_id FROM temp.changed)')
+            conn.execute('DELETE FROM images_fts')
+            changed = {row[0] for row in conn.execute('SELECT image_id FROM temp.changed')}
+            rows = [row for row in rows if row[0] not in changed]
+            conn.executemany(self.INSERT_SQL, rows)
+            conn.execute(self.FTS_INSERT_SQL)
+            conn.execute("INSERT OR REPLACE INTO index_state (key, value) VALUES ('built', '1')")
+            if feed_cursor is not None:
+                conn.execute("INSERT OR REPLACE INTO index_state (key, value) VALUES ('feed_cursor', ?)",
+                             (feed_cursor,))
+            # A rebuild started later still needs the journal
+            rebuilding = conn.execute("SELECT value FROM index_state WHERE key = 'rebuilding'").fetchone()
+            if rebuilding is not None and rebuilding[0] == token:
+                conn.execute("DELETE FROM index_state WHERE key = 'rebuilding'")
+                conn.execute('DELETE FROM index_journal')
+            count = conn.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+        return count
+
+    def get(self, image_id: str) -> Optional[Dict]:
+        """Get the record for an image or None"""
+        row = self._connect().execute(
+            'SELECT metadata FROM images WHERE image_id = ?', (image_id,)
+        ).fetchone()
+        return json.loads(row['metadata']) if row is not None else None
+
+    def find_result(self, result_key: str) -> Optional[Dict]:
+        """Newest record generated from the inputs behind result_key, or None"""
+        row = self._connect().execute(
+            'SELECT metadata FROM images WHERE result_key = ? ORDER BY timestamp DESC LIMIT 1',
+            (result_key,)
+        ).fetchone()
+        return json.loads(row['metadata']) if row is not None else None
+
+    def find_ids(self, model: Optional[str] = None, until: Optional[str] = None) -> List[str]:
+        """Ids of records of a model and/or older than a timestamp, newest first"""
+        conditions, params = [], []
+        if model is not None:
+            conditions.append('model = ?')
+            params.append(model)
+        if until is not None:
+            conditions.append('timestamp < ?')
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self._connect().execute(
+            f'SELECT image_id FROM images {where} ORDER BY timestamp DESC, image_id DESC', params
+        ).fetchall()
+        return [row['image_id'] for row in rows]
+
+    def ids(self) -> set:
+        """Ids of all indexed records"""
+        return {row[0] for row in self._connect().execute('SELECT image_id FROM images')}
+
+    def ping(self) -> None:
+        """Raise if the database cannot be queried"""
+        self._connect().execute('SELECT 1').fetchone()
+
+    def count(self) -> int:
+        """Total number of indexed records"""
+        return self._connect().execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def total_size(self) -> int:
+        """Sum of the recorded image sizes (images saved before sizes were recorded count as 0)"""
+        return self._connect().execute(
+            "SELECT COALESCE(SUM(json_extract(metadata, '$.size_bytes')), 0) FROM images"
+        ).fetchone()[0]
+
+    def list_page(self, offset: int, limit: int) -> List[Dict]:
+        """Get a page of metadata records, newest first"""
+        rows = self._connect().execute(
+            'SELECT metadata FROM images ORDER BY timestamp DESC, image_id DESC LIMIT ? OFFSET ?',
+            (limit, offset)
+        ).fetchall()
+        return [json.loads(row['metadata']) for row in rows]
+
+    def list_after(self, cursor_key: Optional[Tuple[str, str]], limit: int) -> List[Tuple[str, str, Dict]]:
+        """
+        Keyset page of records strictly older than cursor_key, newest first
+
+        Args:
+            cursor_key (Optional[Tuple[str, str]]): (timestamp, image_id) of the last
+                record already seen, or None to start from the newest
+            limit (int): Maximum number of records
+
+        Returns:
+            List[Tuple[str, str, Dict]]: (timestamp, image_id, metadata) triples
+        """
+        if cursor_key is None:
+            rows = self._connect().execute(
+                'SELECT timestamp, image_id, metadata FROM images '
+                'ORDER BY timestamp DESC, image_id DESC LIMIT ?',
+                (limit,)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                'SELECT timestamp, image_id, metadata FROM images '
+                'WHERE (timestamp, image_id) < (?, ?) '
+                'ORDER BY timestamp DESC, image_id DESC LIMIT ?',
+                (cursor_key[0], cursor_key[1], limit)
+            ).fetchall()
+        return [(row['timestamp'], row['image_id'], json.loads(row['metadata'])) for row in rows]
+
+    def list_batch(self, batch_id: str) -> List[Dict]:
+        """Get all records of a batch in batch order"""
+        rows = self._connect().execute(
+            'SELECT metadata FROM images WHERE batch_id = ?', (batch_id,)
+        ).fetchall()
+        records = [json.loads(row['metadata']) for row in rows]
+        return sorted(records, key=lambda metadata: metadata.get('batch_index', 0))
+
+    @staticmethod
+    def match_query(text: str) -> Optional[str]:
+        """
+        Turn free text into an FTS5 query: every word must match, as a prefix
+
+        Words are quoted, so user input cannot inject query syntax.
+
+        Returns:
+            Optional[str]: Query, None when the text has no words
+        """
+        words = re.findall(r'\w+', text)
+        return ' '.join(f'"{word}"*' for word in words) or None
+
+    def search(self, match: Optional[str] = None, model: Optional[str] = None,
+               aspect_ratio: Optional[str] = None, since: Optional[str] = None,
+               until: Optional[str] = None, order: str = 'rank', offset: int = 0,
+               limit: int = 12) -> Tuple[List[Dict], int]:
+        """
+        Search records by prompt text and filters
+
+        Args:
+            match (Optional[str]): FTS5 query (see match_query), None to filter only
+            model (Optional[str]): Model key
+            aspect_ratio (Optional[str]): Aspect ratio, e.g. '16:9'
+            since (Optional[str]): Earliest timestamp (inclusive, ISO format)
+            until (Optional[str]): Latest timestamp (exclusive, ISO format)
+            order (str): 'rank' (best match first) or 'newest'
+            offset (int): Records to skip
+            limit (int): Maximum number of records
+
+        Returns:
+            Tuple[List[Dict], int]: Page of metadata records and the total number of matches
+        """
+        if order not in ('rank', 'newest'):
+            raise ValueError(f"Unsupported order: {order}")
+
+        filters, params = [], []
+        for condition, value in (('images.model = ?', model),
+                                 ('images.aspect_ratio = ?', aspect_ratio),
+                                 ('images.timestamp >= ?', since),
+                                 ('images.timestamp < ?', until)):
+            if value is not None:
+                filters.append(condition)
+                params.append(value)
+
+        conn = self._connect()
+        if match is None:
+            where = f"WHERE {' AND '.join(filters)}" if filters else ''
+            total = conn.execute(f'SELECT COUNT(*) FROM images {where}', params).fetchone()[0]
+            rows = conn.execute(
+                f'SELECT metadata FROM images {where} '
+                'ORDER BY timestamp DESC, image_id DESC LIMIT ? OFFSET ?',
+                (*params, limit, offset)
+            ).fetchall()
+            return [json.loads(row['metadata']) for row in rows], total
+
+        weights = ', '.join(str(weight) for weight in self.SEARCH_WEIGHTS)
+        if not filters:
+            # Neither counting nor ranking needs the images table, only the page does
+            total = conn.execute(
+                'SELECT COUNT(*) FROM images_fts WHERE images_fts MATCH ?', (match,)
+            ).fetchone()[0]
+            if order == 'rank':
+                rows = conn.execute(
+                    f'SELECT images.metadata FROM ('
+                    f'  SELECT rowid, bm25(images_fts, {weights}) AS score FROM images_fts'
+                    f'  WHERE images_fts MATCH ? ORDER BY score LIMIT ? OFFSET ?'
+                    f') AS hits JOIN images ON images.rowid = hits.rowid ORDER BY hits.score',
+                    (match, limit, offset)
+                ).fetchall()
+                return [json.loads(row['metadata']) for row in rows], total
+
+        # The unary + keeps SQLite from driving the query by a column index
+        # and running the full-text match once per candidate row
+        where = ' AND '.join(['images_fts MATCH ?'] + [f'+{condition}' for condition in filters])
+        source = f'images_fts JOIN images ON images.rowid = images_fts.rowid WHERE {where}'
+        if filters:
+            total = conn.execute(f'SELECT COUNT(*) FROM {source}', (match, *params)).fetchone()[0]
+        order_by = (f'bm25(images_fts, {weights}), images.timestamp DESC' if order == 'rank'
+                    else 'images.timestamp DESC, images.image_id DESC')
+        rows = conn.execute(
+            f'SELECT images.metadata FROM {source} ORDER BY {order_by} LIMIT ? OFFSET ?',
+            (match, *params, limit, offset)
+        ).fetchall()
+        return [json.loads(row['metadata']) for row in rows], total
@@ -0,0 +1,134 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Tuple
+from prometheus_client import (
+    CollectorRegistry, CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, REGISTRY, generate_latest
+)
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# With several gunicorn workers every process writes its samples to files in
+# PROMETHEUS_MULTIPROC_DIR and /metrics aggregates them (see gunicorn.conf.py)
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Generations take seconds to minutes, storage stages milliseconds
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    'generation_stage_seconds',
+    'Duration of generation pipeline stages',
+    ['stage', 'model'],
+    buckets=STAGE_BUCKETS
+)
+GENERATION_SECONDS = Histogram(
+    'generation_seconds',
+    'Duration of whole generation jobs, excluding time spent queued',
+    ['model', 'status'],
+    buckets=STAGE_BUCKETS
+)
+ERRORS = Counter(
+    'generation_errors_total',
+    'Failed pipeline stages by exception type (ModelError, OpenAI errors, ...)',
+    ['stage', 'model', 'error_type']
+)
+RATE_LIMIT_HITS = Counter(
+    'rate_limit_hits_total',
+    'Requests rejected by the rate limiter',
+    ['endpoint']
+)
+ADMISSION_REJECTIONS = Counter(
+    'admission_rejections_total',
+    'Requests rejected because upstream capacity was exhausted',
+    ['key']
+)
+RESULT_CACHE_HITS = Counter(
+    'result_cache_hits_total',
+    'Seeded generation requests answered with an already stored image',
+    ['model']
+)
+IN_PROGRESS = Gauge(
+    'generations_in_progress',
+    'Generation jobs currently running',
+    ['model'],
+    multiprocess_mode='livesum'
+)
+
+@contextmanager
+def track_stage(stage: str, model: str) -> Iterator[None]:
+    """
+    Time a pipeline stage and count its failures
+
+    Args:
+        stage (str): Stage name (translate, generate, save_image, ...)
+        model (str): Model key the work belongs to
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        ERRORS.labels(stage, model, e.__class__.__name__).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage, model).observe(time.perf_counter() - start)
+
+@contextmanager
+def track_generation(model: str) -> Iterator[None]:
+    """Count a running generation and time it as a whole"""
+    IN_PROGRESS.labels(model).inc()
+    start = time.perf_counter()
+    status = 'failed'
+    try:
+        yield
+        status = 'done'
+    finally:
+        IN_PROGRESS.labels(model).dec()
+        GENERATION_SECONDS.labels(model, status).observe(time.perf_counter() - start)
+
+class StorageCollector:
+    """Reports storage usage, computed once per scrape instead of per worker"""
+
+    def __init__(self, usage: Callable[[], Dict[str, Dict[str, float]]]):
+        """Initialize with a callable returning {'bytes': {store: n}, 'images': n}
+        ('images' may be missing when the count is unknown)"""
+        self.usage = usage
+
+    def collect(self):
+        size = GaugeMetricFamily('storage_bytes', 'Bytes used by each store', labels=['store'])
+        images = GaugeMetricFamily('stored_images', 'Number of stored images')
+        try:
+            usage = self.usage()
+            for store, value in usage['bytes'].items():
+                size.add_metric([store], value)
+            if 'images' in usage:
+                images.add_metric([], usage['images'])
+        except Exception as e:
+            logger.warning(f"Could not collect storage usage: {str(e)}")
+        yield size
+        yield images
+
+def render_metrics(usage: Callable[[], Dict] = None) -> Tuple[bytes, str]:
+    """
+    Render metrics in the Prometheus text format
+
+    Args:
+        usage (Callable): Optional storage usage callable for StorageCollector
+
+    Returns:
+        Tuple[bytes, str]: Payload and its content type
+    """
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    payload = generate_latest(registry)
+
+    if usage is not None:
+        storage_registry = CollectorRegistry()
+        storage_registry.register(StorageCollector(usage))
+        payload += generate_latest(storage_registry)
+    return payload, CONTENT_TYPE_LATEST
@@ -0,0 +1,27 @@
+import os
+import sqlite3
+import threading
+
+class SQLiteDatabase:
+    """Per-thread SQLite connections to one database file, safe across fork"""
+
+    def __init__(self, db_path: str):
+        """Initialize with the database path, creating its directory"""
+        self.db_path = db_path
+        self._local = threading.local()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def connect(self) -> sqlite3.Connection:
+        """Get a connection for the current thread and process"""
+        conn = getattr(self._local, 'conn', None)
+        # Connections must not cross a fork (gunicorn workers)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
@@ -1,71 +1,830 @@
+import asyncio
+import base64
+import fcntl
+import hashlib
 import json
+import mimetypes
 import os
+import posixpath
+import re
+import tempfile
+import time
+import unicodedata
 import uuid
 import logging
-from typing import Dict, List, Optional
-import requests
+from typing import AsyncIterable, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 from datetime import datetime
 import shutil
+from utils.blob_refs import create_blob_refs
+from utils.disk_lru import DiskLRU
+from utils.metadata_feed import MetadataFeed
+from utils.metadata_index import MetadataIndex
 
 logger = logging.getLogger(__name__)
 
+def fsync_directory(path: str) -> None:
+    """Persist the directory entries of path (a completed rename or new file)"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def copy_file_data(src, dst) -> None:
+    """Copy an open file into another in the kernel (sendfile), without a user-space buffer"""
+    offset = 0
+    size = os.fstat(src.fileno()).st_size
+    try:
+        while offset < size:
+            sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    except OSError:
+        # sendfile to a regular file is Linux only
+        if offset:
+            raise
+        shutil.copyfileobj(src, dst)
+
+class StoredObject(NamedTuple):
+    """An object listed by a storage backend (size and mtime are None when listed without stat)"""
+    key: str
+    size: Optional[int]
+    mtime: Optional[float]
+
+    @property
+    def name(self) -> str:
+        """Last path component of the key (the filename)"""
+        return posixpath.basename(self.key)
+
+class StorageBackend:
+    """
+    Where a file manager keeps its files
+
+    Keys are '/'-separated paths relative to the root of the store
+    (e.g. 'ab/cd/<uuid>.webp'). New files are written completely to a
+    temporary file in staging_dir and then handed over with put_file;
+    put_file and put_bytes never expose a partially written object.
+    """
+
+    # Files are on the local filesystem: get_path costs nothing, put_file is a rename
+    local = True
+
+    @property
+    def staging_dir(self) -> str:
+        """Local directory for temporary files that are passed to put_file"""
+        raise NotImplementedError
+
+    def child(self, prefix: str) -> 'StorageBackend':
+        """Backend for the keys under a prefix (e.g. 'blobs')"""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        """Whether an object exists"""
+        raise NotImplementedError
+
+    def stat(self, key: str) -> Optional[StoredObject]:
+        """Size and modification time of an object, None if it does not exist"""
+        raise NotImplementedError
+
+    def put_file(self, key: str, source_path: str) -> None:
+        """Store a complete local file under key; the file is consumed"""
+        raise NotImplementedError
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        """Store a small object"""
+        raise NotImplementedError
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        """Read a small object, None if it does not exist"""
+        raise NotImplementedError
+
+    def get_path(self, key: str) -> Optional[str]:
+        """Local path with the object's content, None if it does not exist"""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """Delete an object (missing objects are ignored)"""
+        raise NotImplementedError
+
+    def move(self, source_key: str, dest_key: str) -> None:
+        """Rename an object"""
+        raise NotImplementedError
+
+    def iter_objects(self, suffix: str = '', max_depth: int = 0,
+                     descend: Optional[Callable[[str], bool]] = None,
+                     stat: bool = True) -> Iterator[StoredObject]:
+        """
+        List objects
+
+        Args:
+            suffix (str): Only keys ending with it
+            max_depth (int): Directory levels below the root to include
+            descend (Optional[Callable[[str], bool]]): Directory names to include
+            stat (bool): Include size and mtime; False lists names only, without
+                a stat call per file on local stores
+        """
+        raise NotImplementedError
+
+    def presigned_url(self, key: str, expires: int, content_type: Optional[str] = None) -> Optional[str]:
+        """Time-limited URL clients can download the object from directly, None if unsupported"""
+        return None
+
+class LocalBackend(StorageBackend):
+    """Files in a local directory"""
+
+    def __init__(self, root: str):
+        """Initialize with the root directory, creating it"""
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    @property
+    def staging_dir(self) -> str:
+        # Same filesystem as the objects, so put_file is an atomic rename
+        return self.root
+
+    def child(self, prefix: str) -> 'LocalBackend':
+        return LocalBackend(self._path(prefix))
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def stat(self, key: str) -> Optional[StoredObject]:
+        try:
+            stat = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return StoredObject(key, stat.st_size, stat.st_mtime)
+
+    def put_file(self, key: str, source_path: str) -> None:
+        # The caller has fsync'd source_path; the rename is made durable here
+        dest_path = self._path(key)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        try:
+            os.replace(source_path, dest_path)
+        except OSError:
+            # Different filesystem: copy under a temporary name, then rename
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), prefix='.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as dst, open(source_path, 'rb') as src:
+                    copy_file_data(src, dst)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, dest_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+            os.unlink(source_path)
+        fsync_directory(os.path.dirname(dest_path))
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        # Write to a temporary file, fsync and rename: readers see the old or the
+        # new content, and a crash cannot leave a truncated file behind
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        fsync_directory(directory)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def move(self, source_key: str, dest_key: str) -> None:
+        dest_path = self._path(dest_key)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        os.replace(self._path(source_key), dest_path)
+        fsync_directory(os.path.dirname(dest_path))
+
+    def iter_objects(self, suffix: str = '', max_depth: int = 0,
+                     descend: Optional[Callable[[str], bool]] = None,
+                     stat: bool = True) -> Iterator[StoredObject]:
+        stack = [(self.root, '', 0)]
+        while stack:
+            path, prefix, depth = stack.pop()
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if depth < max_depth and (descend is None or descend(entry.name)):
+                            stack.append((entry.path, f"{prefix}{entry.name}/", depth + 1))
+                    elif not entry.name.endswith(suffix):
+                        continue
+                    elif stat:
+                        entry_stat = entry.stat()
+                        yield StoredObject(prefix + entry.name, entry_stat.st_size, entry_stat.st_mtime)
+                    else:
+                        # Names and types come from the directory listing itself
+                        yield StoredObject(prefix + entry.name, None, None)
+
+class ObjectCache:
+    """
+    Size-bounded local copies of remote objects, least recently used evicted first
+
+    Shared by the worker processes of a node; files are touched on access
+    and eviction rescans the directory.
+    """
+
+    def __init__(self, cache_path: str, max_bytes: int = 1024 * 1024 * 1024):
+        """
+        Initialize object cache
+
+        Args:
+            cache_path (str): Cache directory
+            max_bytes (int): Size above which least recently used objects are evicted
+        """
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.staging_dir = os.path.join(cache_path, '.staging')
+        self._lru = DiskLRU(cache_path, max_bytes, 'objects')
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_path, *key.split('/'))
+
+    def get(self, key: str) -> Optional[str]:
+        """Path of a cached object, None on a miss"""
+        path = self._path(key)
+        return path if self._lru.touch(path) else None
+
+    def adopt(self, key: str, source_path: str) -> str:
+        """Move a local file (in staging_dir) into the cache as the copy of key"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(source_path, path)
+        except OSError:
+            # Different filesystem: copy, then remove the source
+            shutil.copyfile(source_path, path)
+            os.unlink(source_path)
+        self._lru.add(os.path.getsize(path), keep=path)
+        return path
+
+    def fetch(self, key: str, download: Callable[[str], None]) -> str:
+        """Download an object into the cache with download(dest_path) and return its path"""
+        fd, temp_path = tempfile.mkstemp(dir=self.staging_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            download(temp_path)
+            os.chmod(temp_path, 0o644)
+            return self.adopt(key, temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def discard(self, key: str) -> None:
+        """Drop the cached copy of an object"""
+        self._lru.remove(self._path(key))
+
+    def cache_size(self) -> int:
+        """Bytes used by cached objects"""
+        return self._lru.size()
+
+class S3Backend(StorageBackend):
+    """
+    Objects in an S3-compatible bucket (AWS S3, MinIO, ...)
+
+    Large files are uploaded in parts and reads go through a local
+    ObjectCache, so images are downloaded once per node.
+    """
+
+    local = False
+
+    # Files above the threshold are uploaded as multipart uploads of this part size
+    MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, bucket: str, prefix: str, cache: ObjectCache,
+                 endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 client=None):
+        """
+        Initialize S3 backend
+
+        Args:
+            bucket (str): Bucket name
+            prefix (str): Key prefix of the store inside the bucket ('' for the bucket root)
+            cache (ObjectCache): Local cache for downloaded and uploaded objects
+            endpoint_url (Optional[str]): Endpoint of an S3-compatible service (MinIO, moto)
+            region (Optional[str]): Bucket region
+            client: Existing boto3 S3 client to share
+        """
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.cache = cache
+        self.client = client or boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(retries={'mode': 'adaptive', 'max_attempts': 5}, max_pool_connections=32)
+        )
+        self.transfer_config = TransferConfig(multipart_threshold=self.MULTIPART_CHUNK_SIZE,
+                                              multipart_chunksize=self.MULTIPART_CHUNK_SIZE)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _is_missing(self, error) -> bool:
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    @property
+    def staging_dir(self) -> str:
+        # Uploaded files become the cached copy, which is a rename from here
+        return self.cache.staging_dir
+
+    def child(self, prefix: str) -> 'S3Backend':
+        return S3Backend(self.bucket, self._key(prefix), self.cache, client=self.client)
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def stat(self, key: str) -> Optional[StoredObject]:
+        from botocore.exceptions import ClientError
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return StoredObject(key, response['ContentLength'], response['LastModified'].timestamp())
+
+    def put_file(self, key: str, source_path: str) -> None:
+        content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        self.client.upload_file(source_path, self.bucket, self._key(key),
+                                ExtraArgs={'ContentType': content_type},
+                                Config=self.transfer_config)
+        # The just written object is the one most likely to be read next (variants, export)
+        self.cache.adopt(self._key(key), source_path)
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data,
+                               ContentType=content_type)
+        self.cache.discard(self._key(key))
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        from botocore.exceptions import ClientError
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+            return response['Body'].read()
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+
+    def get_path(self, key: str) -> Optional[str]:
+        from botocore.exceptions import ClientError
+        full_key = self._key(key)
+        path = self.cache.get(full_key)
+        if path is not None:
+            return path
+        try:
+            return self.cache.fetch(
+                full_key, lambda dest: self.client.download_file(self.bucket, full_key, dest,
+                                                                 Config=self.transfer_config)
+            )
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        self.cache.discard(self._key(key))
+
+    def move(self, source_key: str, dest_key: str) -> None:
+        self.client.copy({'Bucket': self.bucket, 'Key': self._key(source_key)},
+                         self.bucket, self._key(dest_key), Config=self.transfer_config)
+        self.delete(source_key)
+
+    def iter_objects(self, suffix: str = '', max_depth: int = 0,
+                     descend: Optional[Callable[[str], bool]] = None,
+                     stat: bool = True) -> Iterator[StoredObject]:
+        # Listings carry sizes and mtimes anyway, 1000 keys per request
+        root = f"{self.prefix}/" if self.prefix else ''
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=root):
+            for item in page.get('Contents', []):
+                key = item['Key'][len(root):]
+                *directories, name = key.split('/')
+                if (name.startswith('.') or not name.endswith(suffix) or len(directories) > max_depth
+                        or (descend is not None and not all(map(descend, directories)))):
+                    continue
+                yield StoredObject(key, item['Size'], item['LastModified'].timestamp())
+
+    def presigned_url(self, key: str, expires: int, content_type: Optional[str] = None) -> Optional[str]:
+        params = {'Bucket': self.bucket, 'Key': self._key(key)}
+        if content_type:
+            params['ResponseContentType'] = content_type
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires)
+
+def create_storage_backend(url: str, local_path: str, cache: Optional[ObjectCache] = None,
+                           **options) -> StorageBackend:
+    """
+    Create a storage backend from a URL (empty for the local directory, or s3://bucket/prefix)
+
+    Args:
+        url (str): Storage URL
+        local_path (str): Directory of the local store
+        cache (Optional[ObjectCache]): Local cache, required for S3
+        **options: endpoint_url and region of the S3-compatible service
+    """
+    if not url:
+        return LocalBackend(local_path)
+    if url.startswith('s3://'):
+        if cache is None:
+            raise ValueError("S3 storage needs a local object cache")
+        bucket, _, prefix = url[len('s3://'):].partition('/')
+        return S3Backend(bucket, prefix, cache, **options)
+    raise ValueError(f"Unsupported storage URL: {url}")
+
 class FileManager:
     """Base class for file management"""
+
+    # Extensions of the files owned by the manager (used by migrate_to_sharded)
+    FILE_EXTENSIONS: Tuple[str, ...] = ()
     
-    def __init__(self, storage_path: str):
-        """Initialize with storage path"""
+    def __init__(self, storage_path: str, shard_depth: int = 2,
+                 backend: Optional[StorageBackend] = None):
+        """
+        Initialize with storage path
+
+        Args:
+            storage_path (str): Root directory of the store
+            shard_depth (int): Number of two-character hash prefix directories
+                (2 gives ab/cd/<name>); 0 keeps the flat layout
+            backend (Optional[StorageBackend]): Where the files are kept, the
+                storage_path directory by default
+        """
         self.storage_path = storage_path
-        os.makedirs(storage_path, exist_ok=True)
+        self.shard_depth = shard_depth
+        self.backend = backend or LocalBackend(storage_path)
 
     def _generate_filename(self, extension: str) -> str:
         """Generate unique filename using UUID"""
         return f"{uuid.uuid4()}.{extension}"
 
-    def _get_full_path(self, filename: str) -> str:
-        """Get full path for a file"""
-        return os.path.join(self.storage_path, filename)
+    def _get_key(self, filename: str) -> str:
+        """Get the key of a file in the sharded layout (where new files are written)"""
+        if not self.shard_depth:
+            return filename
+        digest = hashlib.sha1(os.path.splitext(filename)[0].encode('utf-8')).hexdigest()
+        shards = [digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+        return '/'.join(shards + [filename])
+
+    def _resolve_key(self, filename: str) -> Optional[str]:
+        """Find an existing file in the sharded layout or the legacy flat layout"""
+        key = self._get_key(filename)
+        if self.backend.exists(key):
+            return key
+        if key != filename and self.backend.exists(filename):
+            return filename
+        # The file may have been migrated between the two checks
+        return key if self.backend.exists(key) else None
+
+    def iter_objects(self, extension: str, stat: bool = True) -> Iterator[StoredObject]:
+        """Yield stored files with an extension, in both layouts (see StorageBackend.iter_objects)"""
+        return self.backend.iter_objects(f".{extension}", self.shard_depth,
+                                         descend=lambda name: len(name) == 2, stat=stat)
+
+    def migrate_to_sharded(self) -> int:
+        """
+        Move files from the legacy flat layout into shard directories
+
+        Safe to run while the app serves traffic: every move is an atomic
+        rename (copy, then delete on object stores) and reads fall back to
+        the flat layout.
+
+        Returns:
+            int: Number of moved files
+        """
+        if not self.shard_depth:
+            return 0
+
+        try:
+            moved = 0
+            for stored in list(self.backend.iter_objects(stat=False)):
+                if os.path.splitext(stored.name)[1].lstrip('.') not in self.FILE_EXTENSIONS:
+                    continue
+                self.backend.move(stored.key, self._get_key(stored.name))
+                moved += 1
+            logger.info(f"Migrated {moved} files to sharded layout in {self.storage_path}")
+            return moved
+
+        except Exception as e:
+            logger.error(f"Error migrating storage: {str(e)}", exc_info=True)
+            raise
 
 class ImageManager(FileManager):
-    """Manager for handling image files"""
+    """
+    Manager for handling image files
+
+    With a reference database the bytes of each image are stored once as a
+    content-addressed blob (blobs/<sha256>.webp) and image ids point to it,
+    so identical generations (re-runs with the same seed, retries) share one
+    file. Images saved before deduplication keep their own files until
+    deduplicate() moves them over.
+    """
+
+    FILE_EXTENSIONS = ('webp', 'png')
     
-    def __init__(self, storage_path: str):
-        """Initialize image manager"""
-        super().__init__(storage_path)
+    def __init__(self, storage_path: str, shard_depth: int = 2, refs_path: Optional[str] = None,
+                 backend: Optional[StorageBackend] = None):
+        """
+        Initialize image manager
+
+        Args:
+            storage_path (str): Root directory of the store
+            shard_depth (int): Shard directory levels, see FileManager
+            refs_path (Optional[str]): SQLite reference database, or a redis:// URL
+                for nodes sharing an object store; without it every image gets its own file
+            backend (Optional[StorageBackend]): Where the images are kept, see FileManager
+        """
+        super().__init__(storage_path, shard_depth, backend)
+        self.refs = create_blob_refs(refs_path) if refs_path else None
+        # Two-character shard directories only, so blobs/ is never listed as legacy images
+        self.blobs = FileManager(
+            os.path.join(storage_path, 'blobs'), shard_depth, self.backend.child('blobs')
+        ) if self.refs else None
+
+    @staticmethod
+    def _hash_file(path: str) -> Tuple[str, int]:
+        """SHA-256 and size of a file"""
+        hasher = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+                size += len(chunk)
+        return hasher.hexdigest(), size
+
+    def _store_file(self, source_path: str, content_hash: str, size: int,
+                    filename: Optional[str] = None) -> str:
+        """
+        Move a complete file into the store under an image filename
+
+        Args:
+            source_path (str): File to take over (consumed)
+            content_hash (str): Hex SHA-256 of its bytes
+            size (int): Its size in bytes
+            filename (Optional[str]): Image filename, a new UUID name if not given
+
+        Returns:
+            str: Image filename
+        """
+        filename = filename or self._generate_filename('webp')
+        if self.refs is None:
+            self.backend.put_file(self._get_key(filename), source_path)
+            return filename
 
-    def save_image_from_file(self, source_path: str) -> str:
+        image_id, extension = os.path.splitext(filename)
+        blob_key = self.blobs._get_key(f"{content_hash}{extension}")
+        with self.refs.transaction() as conn:
+            refcount = self.refs.add(conn, image_id, content_hash, size)
+            if self.blobs.backend.exists(blob_key):
+                os.unlink(source_path)
+                logger.info(f"Image {filename} deduplicated ({refcount} references to {content_hash})")
+            else:
+                self.blobs.backend.put_file(blob_key, source_path)
+        return filename
+
+    def save_image_from_file(self, source_path: str) -> Dict[str, any]:
         """
         Save image from a local file
         
+        The file is moved into place with a rename when it is on the same
+        filesystem, otherwise copied in the kernel (sendfile) or uploaded to
+        the object store, and removed.
+
         Args:
             source_path (str): Path to the source image file
             
         Returns:
-            str: Filename of saved image
+            Dict: Same as save_image_from_stream
         """
         try:
-            filename = self._generate_filename('webp')
-            dest_path = self._get_full_path(filename)
-            
-            # Copy the file using binary mode
-            with open(source_path, 'rb') as src, open(dest_path, 'wb') as dst:
-                dst.write(src.read())
-            
-            # Remove the temporary file
-            os.unlink(source_path)
-                    
+            # Hashed even without deduplication: the hash goes into the metadata
+            content_hash, size = self._hash_file(source_path)
+            filename = self._store_file(source_path, content_hash, size)
             logger.info(f"Saved image: {filename}")
-            return filename
+            return {
+                'filename': filename,
+                'content_hash': content_hash,
+                'size': size
+            }
             
         except Exception as e:
             logger.error(f"Error saving image from file: {str(e)}", exc_info=True)
             raise
 
+    def save_image_from_stream(self, chunks: Iterable[bytes]) -> Dict[str, any]:
+        """
+        Save image from an iterable of byte chunks without buffering it
+
+        Chunks go to a temporary file in the backend's staging directory, the
+        SHA-256 hash and size are computed while writing, and the file is
+        atomically renamed into place (uploaded to the object store) once
+        complete, or dropped when a blob with the same hash is already stored.
+
+        Args:
+            chunks (Iterable[bytes]): Image data
+
+        Returns:
+            Dict containing:
+                filename: Filename of saved image
+                content_hash: Hex SHA-256 of the image bytes
+                size: Size in bytes
+        """
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.backend.staging_dir, prefix='.', suffix='.tmp')
+
+            try:
+                hasher = hashlib.sha256()
+                size = 0
+                with os.fdopen(fd, 'wb') as dst:
+                    for chunk in chunks:
+                        dst.write(chunk)
+                        hasher.update(chunk)
+                        size += len(chunk)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.chmod(temp_path, 0o644)
+                filename = self._store_file(temp_path, hasher.hexdigest(), size)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+
+            logger.info(f"Saved image: {filename}")
+            return {
+                'filename': filename,
+                'content_hash': hasher.hexdigest(),
+                'size': size
+            }
+
+        except Exception as e:
+            logger.error(f"Error saving image from stream: {str(e)}", exc_info=True)
+            raise
+
+    async def save_image_from_async_stream(self, chunks: AsyncIterable[bytes]) -> Dict[str, any]:
+        """
+        Async variant of save_image_from_stream
+
+        All file system calls run in worker threads so the event loop keeps
+        serving other generations while the image is downloaded.
+
+        Args:
+            chunks (AsyncIterable[bytes]): Image data
+
+        Returns:
+            Dict: Same as save_image_from_stream
+        """
+        try:
+            fd, temp_path = await asyncio.to_thread(
+                tempfile.mkstemp, dir=self.backend.staging_dir, prefix='.', suffix='.tmp'
+            )
+            dst = os.fdopen(fd, 'wb')
+
+            def finish() -> None:
+                with dst:
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.chmod(temp_path, 0o644)
+
+            def discard() -> None:
+                dst.close()
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+
+            try:
+                hasher = hashlib.sha256()
+                size = 0
+                async for chunk in chunks:
+                    await asyncio.to_thread(dst.write, chunk)
+                    hasher.update(chunk)
+                    size += len(chunk)
+                await asyncio.to_thread(finish)
+                filename = await asyncio.to_thread(self._store_file, temp_path, hasher.hexdigest(), size)
+            except BaseException:
+                await asyncio.to_thread(discard)
+                raise
+
+            logger.info(f"Saved image: {filename}")
+            return {
+                'filename': filename,
+                'content_hash': hasher.hexdigest(),
+                'size': size
+            }
+
+        except Exception as e:
+            logger.error(f"Error saving image from stream: {str(e)}", exc_info=True)
+            raise
+
+    def _locate(self, filename: str) -> Optional[Tuple[StorageBackend, str]]:
+        """Backend and key holding the bytes of an image, None if it does not exist"""
+        if os.path.basename(filename) != filename or filename.startswith('.'):
+            return None
+        if self.refs is not None:
+            image_id, extension = os.path.splitext(filename)
+            content_hash = self.refs.get_hash(image_id)
+            if content_hash is not None:
+                key = self.blobs._resolve_key(f"{content_hash}{extension}")
+                return (self.blobs.backend, key) if key is not None else None
+        key = self._resolve_key(filename)
+        return (self.backend, key) if key is not None else None
+
+    def image_exists(self, filename: str) -> bool:
+        """Whether an image is stored (without downloading it from an object store)"""
+        return self._locate(filename) is not None
+
+    def get_image_path(self, filename: str) -> Optional[str]:
+        """
+        Get a local path of a stored image, None if it does not exist
+
+        Images in an object store are downloaded into the local object cache.
+        """
+        location = self._locate(filename)
+        if location is None:
+            return None
+        backend, key = location
+        return backend.get_path(key)
+
+    def get_image_url(self, filename: str, expires: int) -> Optional[str]:
+        """
+        Get a presigned URL clients can download an image from directly
+
+        Args:
+            filename (str): Image filename
+            expires (int): URL lifetime in seconds
+
+        Returns:
+            Optional[str]: URL, None if the image does not exist or the backend
+                serves files locally
+        """
+        if self.backend.local:
+            return None
+        location = self._locate(filename)
+        if location is None:
+            return None
+        backend, key = location
+        return backend.presigned_url(key, expires, mimetypes.guess_type(filename)[0])
+
+    def _delete_blob(self, content_hash: str, extension: str) -> None:
+        """Remove a blob file (within the reference transaction)"""
+        blob_key = self.blobs._resolve_key(f"{content_hash}{extension}")
+        if blob_key is not None:
+            self.blobs.backend.delete(blob_key)
+
     def delete_image(self, filename: str) -> None:
-        """Delete image file"""
+        """Delete image, removing its blob when no other image refers to it"""
         try:
-            full_path = self._get_full_path(filename)
-            if os.path.exists(full_path):
-                os.remove(full_path)
+            if self.refs is not None:
+                image_id, extension = os.path.splitext(filename)
+                with self.refs.transaction() as conn:
+                    removed = self.refs.remove(conn, image_id)
+                    if removed is not None:
+                        content_hash, remaining = removed
+                        if remaining <= 0:
+                            self._delete_blob(content_hash, extension)
+                        logger.info(f"Deleted image: {filename} ({max(remaining, 0)} references left)")
+                        return
+
+            key = self._resolve_key(filename)
+            if key is not None:
+                self.backend.delete(key)
                 logger.info(f"Deleted image: {filename}")
             else:
                 logger.warning(f"Image not found: {filename}")
@@ -74,12 +833,203 @@ class ImageManager(FileManager):
             logger.error(f"Error deleting image: {str(e)}", exc_info=True)
             raise
 
+    def delete_images(self, filenames: List[str]) -> int:
+        """
+        Delete many images in one step (one reference database transaction)
+
+        Args:
+            filenames (List[str]): Image filenames
+
+        Returns:
+            int: Number of images that existed and were deleted
+        """
+        try:
+            deleted = 0
+            remaining_files = filenames
+            if self.refs is not None:
+                remaining_files = []
+                with self.refs.transaction() as conn:
+                    for filename in filenames:
+                        image_id, extension = os.path.splitext(filename)
+                        removed = self.refs.remove(conn, image_id)
+                        if removed is None:
+                            remaining_files.append(filename)
+                            continue
+                        deleted += 1
+                        content_hash, remaining = removed
+                        if remaining <= 0:
+                            self._delete_blob(content_hash, extension)
+
+            # Images saved before deduplication
+            for filename in remaining_files:
+                key = self._resolve_key(filename)
+                if key is not None:
+                    self.backend.delete(key)
+                    deleted += 1
+
+            logger.info(f"Deleted {deleted} of {len(filenames)} images")
+            return deleted
+
+        except Exception as e:
+            logger.error(f"Error deleting images: {str(e)}", exc_info=True)
+            raise
+
+    def delete_orphan_blob(self, blob_filename: str) -> bool:
+        """
+        Remove a blob file that has no reference record
+
+        Args:
+            blob_filename (str): <sha256>.<extension>
+
+        Returns:
+            bool: Whether it was removed (False if an image refers to it by now)
+        """
+        content_hash, extension = os.path.splitext(blob_filename)
+        with self.refs.transaction() as conn:
+            # Blobs are created inside the reference transaction, so a blob
+            # written just now is either referenced here or not visible yet
+            if self.refs.is_referenced(conn, content_hash):
+                return False
+            self._delete_blob(content_hash, extension)
+        logger.info(f"Deleted orphan blob: {blob_filename}")
+        return True
+
+    def deduplicate(self) -> Dict[str, int]:
+        """
+        Move images saved with their own file into content-addressed blobs
+
+        Safe to run while the app serves traffic: each file is registered and
+        moved (or dropped as a duplicate) in one locked step, and reads fall
+        back to the old files until then.
+
+        Returns:
+            Dict containing:
+                images: Number of converted images
+                freed_bytes: Bytes of duplicate files removed
+        """
+        if self.refs is None:
+            raise ValueError("Image reference database is not configured")
+
+        try:
+            images = 0
+            freed_bytes = 0
+            for extension in self.FILE_EXTENSIONS:
+                for stored in list(self.iter_objects(extension, stat=False)):
+                    if self.refs.get_hash(os.path.splitext(stored.name)[0]) is not None:
+                        continue
+                    path = self.backend.get_path(stored.key)
+                    if path is None:
+                        continue
+                    content_hash, size = self._hash_file(path)
+                    blob_exists = self.blobs._resolve_key(f"{content_hash}.{extension}") is not None
+                    # Consumes the local file (on object stores: the cached copy)
+                    self._store_file(path, content_hash, size, filename=stored.name)
+                    if not self.backend.local:
+                        self.backend.delete(stored.key)
+                    images += 1
+                    if blob_exists:
+                        freed_bytes += size
+            logger.info(f"Deduplicated {images} images in {self.storage_path}, freed {freed_bytes} bytes")
+            return {'images': images, 'freed_bytes': freed_bytes}
+
+        except Exception as e:
+            logger.error(f"Error deduplicating images: {str(e)}", exc_info=True)
+            raise
+
 class MetadataManager(FileManager):
-    """Manager for handling metadata files"""
+    """
+    Manager for handling metadata files
+
+    With an object store shared by several nodes, each node indexes the
+    bucket on its own disk and a metadata feed carries the saves and
+    deletes of all nodes to the others' indexes.
+    """
+
+    FILE_EXTENSIONS = ('json',)
+
+    # Seconds between metadata feed reads of one process
+    SYNC_INTERVAL = 1.0
     
-    def __init__(self, storage_path: str):
-        """Initialize metadata manager"""
-        super().__init__(storage_path)
+    def __init__(self, storage_path: str, index_path: Optional[str] = None, shard_depth: int = 2,
+                 backend: Optional[StorageBackend] = None, feed: Optional[MetadataFeed] = None):
+        """
+        Initialize metadata manager
+
+        Args:
+            storage_path (str): Directory holding the metadata JSON files
+            index_path (Optional[str]): SQLite index file; without it listing scans the directory
+            shard_depth (int): Shard directory levels, see FileManager
+            backend (Optional[StorageBackend]): Where the files are kept, see FileManager
+            feed (Optional[MetadataFeed]): Changes shared with other nodes on the same
+                object store; needs index_path
+        """
+        super().__init__(storage_path, shard_depth, backend)
+        self.index = MetadataIndex(index_path) if index_path else None
+        self.feed = feed if self.index is not None else None
+        self._synced_at = float('-inf')
+
+    def ensure_index(self) -> bool:
+        """
+        Build the index from the stored records unless that was done before
+
+        Meant to run once at startup, and again when the node fell so far
+        behind the metadata feed that it missed changes. An exclusive lock
+        next to the index file makes processes that start together (gunicorn
+        workers without preload) wait for one of them to build it instead of
+        each reading every record.
+
+        Returns:
+            bool: Whether the index was built now
+        """
+        if self.index is None or not self._index_outdated():
+            return False
+        with open(f"{self.index.db_path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if not self._index_outdated():
+                    return False
+                self.rebuild_index()
+                return True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _index_outdated(self) -> bool:
+        """Whether the index was never built or missed changes trimmed from the feed"""
+        if not self.index.is_built():
+            return True
+        return self.feed is not None and self.feed.read(self.index.feed_cursor(), count=1) is None
+
+    def sync_index(self) -> None:
+        """
+        Apply the metadata changes other nodes published to the local index
+
+        Called before reading the index; reads the feed at most once per
+        SYNC_INTERVAL in each process. When Redis cannot be reached the
+        local index still answers, without the latest changes of other nodes.
+        """
+        if self.feed is None:
+            return
+        now = time.monotonic()
+        if now - self._synced_at < self.SYNC_INTERVAL:
+            return
+        self._synced_at = now
+
+        try:
+            while True:
+                after = self.index.feed_cursor()
+                changes = self.feed.read(after)
+                if changes is None:
+                    logger.warning("Metadata index missed changes trimmed from the feed, rebuilding")
+                    self.ensure_index()
+                    return
+                if not changes:
+                    return
+                # Another process may have applied them first; read on from its cursor
+                if self.index.apply_changes(after, changes) and len(changes) < self.feed.READ_COUNT:
+                    return
+
+        except Exception as e:
+            logger.error(f"Error syncing metadata index: {str(e)}", exc_info=True)
 
     def save_metadata(self, image_filename: str, metadata: Dict) -> str:
         """
@@ -95,14 +1045,18 @@ class MetadataManager(FileManager):
         try:
             # Use same UUID as image but with json extension
             filename = f"{os.path.splitext(image_filename)[0]}.json"
-            full_path = self._get_full_path(filename)
+            key = self._resolve_key(filename) or self._get_key(filename)
             
             # Add timestamp to metadata
             metadata['timestamp'] = datetime.utcnow().isoformat()
             metadata['image_filename'] = image_filename
             
-            with open(full_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            self.backend.put_bytes(key, json.dumps(metadata, indent=2).encode('utf-8'))
+
+            if self.index is not None:
+                self.index.upsert(os.path.splitext(filename)[0], metadata)
+            if self.feed is not None:
+                self.feed.publish_upsert(os.path.splitext(filename)[0], metadata)
                 
             logger.info(f"Saved metadata: {filename}")
             return filename
@@ -112,52 +1066,350 @@ class MetadataManager(FileManager):
             raise
 
     def get_metadata(self, filename: str) -> Optional[Dict]:
-        """Get metadata for a file"""
+        """
+        Get metadata for a file, from the index when configured
+
+        A record missing from the index is read from the backend and indexed:
+        with a shared object store it may have been written by another node.
+        """
         try:
-            full_path = self._get_full_path(filename)
-            if not os.path.exists(full_path):
+            image_id = os.path.splitext(filename)[0]
+            if self.index is not None:
+                self.sync_index()
+                metadata = self.index.get(image_id)
+                if metadata is not None:
+                    return metadata
+
+            key = self._resolve_key(filename)
+            data = self.backend.get_bytes(key) if key is not None else None
+            if data is None:
                 return None
                 
-            with open(full_path, 'r') as f:
-                return json.load(f)
+            metadata = self.parse_metadata(data)
+            if metadata is None:
+                # One damaged record must not break listing the gallery; fsck repairs it
+                logger.warning(f"Skipping corrupt metadata: {filename}")
+            elif self.index is not None:
+                self.index.upsert(image_id, metadata)
+            return metadata
                 
         except Exception as e:
             logger.error(f"Error reading metadata: {str(e)}", exc_info=True)
             raise
 
+    @staticmethod
+    def parse_metadata(data: bytes) -> Optional[Dict]:
+        """Decode a metadata file, None if it is not a valid record (truncated, garbage)"""
+        try:
+            metadata = json.loads(data)
+        except ValueError:
+            return None
+        if not isinstance(metadata, dict) or not metadata.get('image_filename'):
+            return None
+        return metadata
+
     def delete_metadata(self, filename: str) -> None:
         """Delete metadata file"""
         try:
-            full_path = self._get_full_path(filename)
-            if os.path.exists(full_path):
-                os.remove(full_path)
+            key = self._resolve_key(filename)
+            if key is not None:
+                self.backend.delete(key)
                 logger.info(f"Deleted metadata: {filename}")
             else:
                 logger.warning(f"Metadata not found: {filename}")
+
+            if self.index is not None:
+                self.index.remove(os.path.splitext(filename)[0])
+            if self.feed is not None:
+                self.feed.publish_remove([os.path.splitext(filename)[0]])
                 
         except Exception as e:
             logger.error(f"Error deleting metadata: {str(e)}", exc_info=True)
             raise
 
-    def list_images(self, page: int = 1, per_page: int = 12) -> Dict[str, any]:
+    def delete_metadata_many(self, filenames: List[str]) -> int:
+        """
+        Delete many metadata files with a single index update
+
+        Args:
+            filenames (List[str]): Metadata filenames
+
+        Returns:
+            int: Number of deleted files
+        """
+        try:
+            deleted = 0
+            for filename in filenames:
+                key = self._resolve_key(filename)
+                if key is not None:
+                    self.backend.delete(key)
+                    deleted += 1
+
+            image_ids = [os.path.splitext(filename)[0] for filename in filenames]
+            if self.index is not None:
+                self.index.remove_many(image_ids)
+            if self.feed is not None and image_ids:
+                self.feed.publish_remove(image_ids)
+
+            logger.info(f"Deleted {deleted} of {len(filenames)} metadata files")
+            return deleted
+
+        except Exception as e:
+            logger.error(f"Error deleting metadata: {str(e)}", exc_info=True)
+            raise
+
+    def find_image_ids(self, model: Optional[str] = None, until: Optional[str] = None) -> List[str]:
+        """
+        Ids of all images matching the filters
+
+        Args:
+            model (Optional[str]): Model key
+            until (Optional[str]): Only images older than this timestamp (ISO format)
+
+        Returns:
+            List[str]: Image ids, newest first
+        """
+        try:
+            if self.index is not None:
+                self.sync_index()
+                return self.index.find_ids(model, until)
+
+            matches = []
+            for stored in self.iter_objects('json'):
+                metadata = self.get_metadata(stored.name)
+                if not metadata:
+                    continue
+                timestamp = metadata.get('timestamp', '')
+                if model in (None, metadata.get('model')) and (until is None or timestamp < until):
+                    matches.append((timestamp, os.path.splitext(stored.name)[0]))
+            return [image_id for _, image_id in sorted(matches, reverse=True)]
+
+        except Exception as e:
+            logger.error(f"Error selecting images: {str(e)}", exc_info=True)
+            raise
+
+    def rebuild_index(self) -> int:
+        """
+        Rebuild the metadata index from the stored JSON files
+
+        Returns:
+            int: Number of indexed records
+        """
+        if self.index is None:
+            raise ValueError("Metadata index is not configured")
+
+        def records() -> Iterator[Tuple[str, Dict]]:
+            for stored in self.iter_objects('json', stat=False):
+                try:
+                    data = self.backend.get_bytes(stored.key)
+                except OSError as e:
+                    logger.warning(f"Skipping unreadable metadata {stored.name}: {str(e)}")
+                    continue
+                if data is None:
+                    # Deleted since it was listed
+                    continue
+                metadata = self.parse_metadata(data)
+                if metadata is None:
+                    logger.warning(f"Skipping corrupt metadata {stored.name}")
+                    continue
+                # Records saved before timestamps existed fall back to mtime
+                if 'timestamp' not in metadata:
+                    stat = self.backend.stat(stored.key)
+                    mtime = stat.mtime if stat is not None else time.time()
+                    metadata['timestamp'] = datetime.utcfromtimestamp(mtime).isoformat()
+                yield os.path.splitext(stored.name)[0], metadata
+
+        try:
+            # Changes published from here on are applied over what the scan reads
+            feed_cursor = self.feed.last_id() if self.feed is not None else None
+            # Read while the index is being rebuilt, so writes meanwhile are not lost
+            count = self.index.rebuild(records(), feed_cursor=feed_cursor)
+            logger.info(f"Rebuilt metadata index: {count} records")
+            return count
+
+        except Exception as e:
+            logger.error(f"Error rebuilding metadata index: {str(e)}", exc_info=True)
+            raise
+
+    def list_batch(self, batch_id: str) -> List[Dict]:
+        """
+        Get metadata of all images generated by one batch request
+
+        Args:
+            batch_id (str): Batch identifier
+
+        Returns:
+            List[Dict]: Metadata records ordered by batch_index
+        """
+        try:
+            if self.index is not None:
+                self.sync_index()
+                return self.index.list_batch(batch_id)
+
+            records = []
+            for stored in self.iter_objects('json', stat=False):
+                metadata = self.get_metadata(stored.name)
+                if metadata and metadata.get('batch_id') == batch_id:
+                    records.append(metadata)
+            return sorted(records, key=lambda metadata: metadata.get('batch_index', 0))
+
+        except Exception as e:
+            logger.error(f"Error listing batch: {str(e)}", exc_info=True)
+            raise
+
+    def find_result(self, model: str, translated_prompt: str, width: int, height: int,
+                    seed: int) -> Optional[Dict]:
+        """
+        Find a stored image generated from exactly these inputs
+
+        Args:
+            model (str): Model key
+            translated_prompt (str): Prompt sent to the model
+            width (int): Image width
+            height (int): Image height
+            seed (int): Generation seed
+
+        Returns:
+            Optional[Dict]: Metadata of the newest matching image, None when there is
+                none or no index is configured (a directory scan would cost more than it saves)
+        """
+        if self.index is None:
+            return None
+
+        try:
+            self.sync_index()
+            return self.index.find_result(
+                self.index.result_key(model, translated_prompt, width, height, seed)
+            )
+
+        except Exception as e:
+            logger.error(f"Error looking up cached result: {str(e)}", exc_info=True)
+            raise
+
+    def search(self, query: str = '', model: Optional[str] = None, aspect_ratio: Optional[str] = None,
+               since: Optional[str] = None, until: Optional[str] = None, order: str = 'rank',
+               page: int = 1, per_page: int = 12) -> Dict[str, any]:
+        """
+        Search images by prompt (original or translated) and model, with filters
+
+        Args:
+            query (str): Words that must all occur (as word prefixes); empty to filter only
+            model (Optional[str]): Model key
+            aspect_ratio (Optional[str]): Aspect ratio
+            since (Optional[str]): Earliest timestamp (inclusive, ISO format)
+            until (Optional[str]): Latest timestamp (exclusive, ISO format)
+            order (str): 'rank' (best match first, needs the index) or 'newest'
+            page (int): Page number (1-based)
+            per_page (int): Number of items per page
+
+        Returns:
+            Dict containing:
+                images: List of image metadata
+                total: Number of matching images
+                total_pages: Total number of pages
+        """
+        if order not in ('rank', 'newest'):
+            raise ValueError(f"Unsupported order: {order}")
+
+        try:
+            if self.index is not None:
+                self.sync_index()
+                images, total = self.index.search(
+                    self.index.match_query(query), model, aspect_ratio, since, until, order,
+                    (page - 1) * per_page, per_page
+                )
+            else:
+                images, total = self._search_files(query, model, aspect_ratio, since, until,
+                                                   (page - 1) * per_page, per_page)
+            return {
+                'images': images,
+                'total': total,
+                'total_pages': (total + per_page - 1) // per_page
+            }
+
+        except Exception as e:
+            logger.error(f"Error searching images: {str(e)}", exc_info=True)
+            raise
+
+    def _search_files(self, query: str, model: Optional[str], aspect_ratio: Optional[str],
+                      since: Optional[str], until: Optional[str], offset: int,
+                      limit: int) -> Tuple[List[Dict], int]:
+        """Search without the index: reads every metadata file, newest first, no ranking"""
+        def words(text: str) -> List[str]:
+            # Lowercase without diacritics, like the full-text index
+            folded = unicodedata.normalize('NFKD', text.lower())
+            return re.findall(r'\w+', ''.join(c for c in folded if not unicodedata.combining(c)))
+
+        query_words = words(query)
+        matches = []
+        for stored in self.iter_objects('json', stat=False):
+            metadata = self.get_metadata(stored.name)
+            if not metadata:
+                continue
+            text_words = words(' '.join(str(metadata.get(field) or '') for field in
+                                        ('original_prompt', 'translated_prompt', 'model')))
+            timestamp = metadata.get('timestamp', '')
+            if (all(any(word.startswith(prefix) for word in text_words) for prefix in query_words)
+                    and model in (None, metadata.get('model'))
+                    and aspect_ratio in (None, metadata.get('aspect_ratio'))
+                    and (since is None or timestamp >= since)
+                    and (until is None or timestamp < until)):
+                matches.append(metadata)
+        matches.sort(key=lambda metadata: metadata.get('timestamp', ''), reverse=True)
+        return matches[offset:offset + limit], len(matches)
+
+    @staticmethod
+    def encode_cursor(timestamp: str, image_id: str) -> str:
+        """Build an opaque pagination cursor from a sort key"""
+        raw = json.dumps([timestamp, image_id], separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[str, str]:
+        """Parse a pagination cursor back into its sort key"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            timestamp, image_id = json.loads(raw)
+            if not isinstance(timestamp, str) or not isinstance(image_id, str):
+                raise ValueError
+            return timestamp, image_id
+        except (ValueError, TypeError):
+            raise ValueError(f"Invalid cursor: {cursor}")
+
+    def list_images(self, page: int = 1, per_page: int = 12, after: Optional[str] = None) -> Dict[str, any]:
         """
         List all images with their metadata, paginated
         
         Args:
             page (int): Page number (1-based)
             per_page (int): Number of items per page
+            after (Optional[str]): Cursor from a previous call; switches to keyset
+                pagination ('' starts from the newest image)
             
         Returns:
             Dict containing:
                 images: List of image metadata
-                total_pages: Total number of pages
+                total_pages: Total number of pages (page mode)
+                next_cursor: Cursor for the next page or None (cursor mode)
         """
+        cursor_key = self.decode_cursor(after) if after else None
+
         try:
+            if after is not None:
+                return self._list_images_after(cursor_key, per_page)
+
+            if self.index is not None:
+                self.sync_index()
+                total_items = self.index.count()
+                return {
+                    'images': self.index.list_page((page - 1) * per_page, per_page),
+                    'total_pages': (total_items + per_page - 1) // per_page
+                }
+
             # Get all metadata files
-            metadata_files = [f for f in os.listdir(self.storage_path) 
-                            if f.endswith('.json')]
-            metadata_files.sort(key=lambda x: os.path.getmtime(self._get_full_path(x)), 
-                              reverse=True)
+            objects = sorted(self.iter_objects('json'),
+                             key=lambda stored: stored.mtime, reverse=True)
+            metadata_files = [stored.name for stored in objects]
             
             # Calculate pagination
             total_items = len(metadata_files)
@@ -181,4 +1433,35 @@ class MetadataManager(FileManager):
             
         except Exception as e:
             logger.error(f"Error listing images: {str(e)}", exc_info=True)
-            raise
\ No newline at end of file
+            raise
+
+    def _list_images_after(self, cursor_key: Optional[Tuple[str, str]], per_page: int) -> Dict[str, any]:
+        """Keyset pagination: the page of images strictly older than cursor_key"""
+        if self.index is not None:
+            self.sync_index()
+            # Fetch one extra row to know whether another page exists
+            rows = self.index.list_after(cursor_key, per_page + 1)
+        else:
+            keys = []
+            for stored in self.iter_objects('json'):
+                mtime = datetime.utcfromtimestamp(stored.mtime).isoformat()
+                keys.append((mtime, os.path.splitext(stored.name)[0]))
+            keys.sort(reverse=True)
+            if cursor_key is not None:
+                keys = [key for key in keys if key < cursor_key]
+            rows = []
+            for timestamp, image_id in keys[:per_page + 1]:
+                metadata = self.get_metadata(f"{image_id}.json")
+                if metadata:
+                    rows.append((timestamp, image_id, metadata))
+
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            timestamp, image_id, _ = rows[-1]
+            next_cursor = self.encode_cursor(timestamp, image_id)
+
+        return {
+            'images': [metadata for _, _, metadata in rows],
+            'next_cursor': next_cursor
+        }
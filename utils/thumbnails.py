@@ -0,0 +1,105 @@
+import os
+import tempfile
+import logging
+from typing import Iterable, Optional
+from PIL import Image
+from utils.disk_lru import DiskLRU
+from utils.storage import ImageManager
+
+logger = logging.getLogger(__name__)
+
+class ThumbnailManager:
+    """Generates resized variants of stored images and caches them on disk"""
+
+    def __init__(self, image_manager: ImageManager, cache_path: str,
+                 widths: Iterable[int] = (256, 512), max_bytes: int = 512 * 1024 * 1024,
+                 quality: int = 80):
+        """
+        Initialize thumbnail manager
+
+        Args:
+            image_manager (ImageManager): Source of the original images
+            cache_path (str): Directory for generated variants
+            widths (Iterable[int]): Allowed variant widths
+            max_bytes (int): Cache size above which least recently used variants are evicted
+            quality (int): WebP quality of the variants
+        """
+        self.image_manager = image_manager
+        self.cache_path = cache_path
+        self.widths = sorted(widths)
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self._lru = DiskLRU(cache_path, max_bytes, 'variants')
+        os.makedirs(cache_path, exist_ok=True)
+
+    def nearest_width(self, width: int) -> int:
+        """Smallest allowed width that is at least `width` (or the largest one)"""
+        for allowed in self.widths:
+            if allowed >= width:
+                return allowed
+        return self.widths[-1]
+
+    def _variant_path(self, filename: str, width: int) -> str:
+        """Cache path of a variant"""
+        return os.path.join(self.cache_path, f"{os.path.splitext(filename)[0]}_w{width}.webp")
+
+    def get_variant(self, filename: str, width: int) -> Optional[str]:
+        """
+        Get the path of an image resized to an allowed width, generating it if needed
+
+        Args:
+            filename (str): Image filename
+            width (int): Requested width, snapped with nearest_width
+
+        Returns:
+            Optional[str]: Path to the variant (the original if it is not wider), None if
+                the image does not exist
+        """
+        width = self.nearest_width(width)
+        variant_path = self._variant_path(filename, width)
+
+        if self._lru.touch(variant_path):
+            return variant_path
+
+        source_path = self.image_manager.get_image_path(filename)
+        if source_path is None:
+            return None
+
+        try:
+            with Image.open(source_path) as image:
+                if image.width <= width:
+                    return source_path
+                height = max(1, round(image.height * width / image.width))
+                resized = image.resize((width, height), Image.LANCZOS)
+
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_path, prefix='.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    resized.save(f, 'WEBP', quality=self.quality)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, variant_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+
+            logger.info(f"Generated {width}px variant of {filename}")
+            self._lru.add(os.path.getsize(variant_path), keep=variant_path)
+            return variant_path
+
+        except Exception as e:
+            logger.error(f"Error generating variant of {filename}: {str(e)}", exc_info=True)
+            raise
+
+    def generate_all(self, filename: str) -> None:
+        """Generate every allowed variant of an image"""
+        for width in self.widths:
+            self.get_variant(filename, width)
+
+    def delete_variants(self, filename: str) -> None:
+        """Remove cached variants of an image"""
+        for width in self.widths:
+            self._lru.remove(self._variant_path(filename, width))
+
+    def cache_size(self) -> int:
+        """Bytes used by cached variants"""
+        return self._lru.size()
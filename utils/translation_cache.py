@@ -0,0 +1,260 @@
+import hashlib
+import logging
+import re
+import time
+from typing import Dict, Optional
+from utils.sqlite import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+# Unambiguous English words; short words shared with Czech ("a", "i", "to",
+# "on", "do", "no", "pro") are left out so Czech prompts are never skipped
+ENGLISH_WORDS = frozenset("""
+    the an and of with in at by for from into onto over under above below
+    is are was were be been being has have had this that these those there
+    its it's his her their our your my who which what where when while
+    very more most some any all each every other than then but or not
+    as like without between behind near across through around inside outside
+    cat dog bird horse man woman girl boy child people person face portrait
+    photo photograph painting illustration drawing sketch render style art
+    artwork digital oil watercolor realistic photorealistic cinematic detailed
+    highly lighting light dark night day sunset sunrise sky clouds sun moon
+    city street house castle mountain mountains forest tree trees river lake
+    sea ocean beach snow rain winter summer autumn spring garden field flowers
+    flower red blue green yellow black white golden colorful beautiful old
+    young small big large tall little happy sad wearing sitting standing
+    walking running flying holding looking background foreground scene view
+    close up shot wide angle lens depth focus sharp soft vibrant epic fantasy
+    futuristic vintage retro modern ancient abstract minimalist surreal
+    beard hair eyes hat dress room window table bridge road boat ship water
+    fire stars space planet dragon wolf bear lion tiger fox snowy glowing
+    shadows reflection dramatic natural warm cold studio quality ultra hd
+    masterpiece bokeh concept anime cartoon hyperrealistic
+""".split())
+
+WORD_PATTERN = re.compile(r"[a-z']+")
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace and case so equivalent prompts share a cache entry"""
+    return ' '.join(prompt.split()).casefold()
+
+def prompt_key(prompt: str) -> str:
+    """Cache key for a prompt"""
+    return hashlib.sha256(normalize_prompt(prompt).encode('utf-8')).hexdigest()
+
+def looks_like_english(text: str, threshold: float = 0.8) -> bool:
+    """
+    Cheap local check whether text is already English
+
+    Any non-ASCII letter (Czech diacritics and the like) rules English out.
+    Otherwise nearly all words must be common English words: a Czech prompt
+    typed without diacritics is often padded with English style tags, and
+    its Czech words must not reach the model untranslated.
+
+    Args:
+        text (str): Text to check
+        threshold (float): Minimum share of known English words
+
+    Returns:
+        bool: True if the text can be used without translation
+
+    Examples:
+        >>> looks_like_english('portrait of an old man with a beard, oil painting')
+        True
+        >>> looks_like_english('pes na louce, 4k, photorealistic, cinematic lighting')
+        False
+        >>> looks_like_english('kocka na strese, highly detailed, cinematic lighting')
+        False
+        >>> looks_like_english('Pes na louce při západu slunce')
+        False
+    """
+    if any(ch.isalpha() and not ch.isascii() for ch in text):
+        return False
+
+    words = WORD_PATTERN.findall(text.lower())
+    if not words:
+        return False
+
+    hits = sum(1 for word in words if word in ENGLISH_WORDS)
+    if len(words) < 3:
+        return hits == len(words)
+    return hits / len(words) >= threshold
+
+class TranslationCache:
+    """
+    Base class for persistent prompt translation caches
+
+    Every backend behaves the same: an entry expires `ttl` seconds after it
+    was stored (reading it does not extend that), and above `max_entries`
+    the least recently read entries are evicted. Read times are recorded at
+    most once per ACCESS_RESOLUTION seconds per entry, which is enough for
+    eviction and keeps cache hits from writing on every read.
+    """
+
+    COUNTERS = ('hits', 'misses', 'english_skips')
+    ACCESS_RESOLUTION = 60
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached translation or None"""
+        raise NotImplementedError
+
+    def set(self, key: str, translation: str) -> None:
+        """Store a translation"""
+        raise NotImplementedError
+
+    def incr(self, counter: str) -> None:
+        """Increment a shared counter"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, any]:
+        """Counters and size of the cache"""
+        raise NotImplementedError
+
+    def _with_hit_rate(self, stats: Dict[str, any]) -> Dict[str, any]:
+        """Add the hit rate to a stats dict"""
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+        return stats
+
+class SQLiteTranslationCache(TranslationCache):
+    """SQLite translation cache shared by the workers of a node"""
+
+    def __init__(self, db_path: str, max_entries: int = 10000, ttl: int = 30 * 86400):
+        """
+        Initialize SQLite cache
+
+        Args:
+            db_path (str): Database file
+            max_entries (int): Entries kept before least recently used ones are evicted
+            ttl (int): Seconds after which an entry expires
+        """
+        self.db = SQLiteDatabase(db_path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        conn = self.db.connect()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS translations (
+                    key TEXT PRIMARY KEY,
+                    translation TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_translations_accessed ON translations (accessed_at)')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached translation or None"""
+        conn = self.db.connect()
+        now = time.time()
+        # A plain read takes no write lock; only a stale access time is updated
+        with conn:
+            row = conn.execute(
+                'SELECT translation, created_at, accessed_at FROM translations WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row['created_at'] < now - self.ttl:
+                conn.execute('DELETE FROM translations WHERE key = ?', (key,))
+                return None
+            if row['accessed_at'] < now - self.ACCESS_RESOLUTION:
+                conn.execute('UPDATE translations SET accessed_at = ? WHERE key = ?', (now, key))
+            return row['translation']
+
+    def set(self, key: str, translation: str) -> None:
+        """Store a translation, evicting least recently used entries over the limit"""
+        conn = self.db.connect()
+        now = time.time()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO translations (key, translation, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?)',
+                (key, translation, now, now)
+            )
+            conn.execute(
+                'DELETE FROM translations WHERE key IN ('
+                'SELECT key FROM translations ORDER BY accessed_at ASC '
+                'LIMIT MAX((SELECT COUNT(*) FROM translations) - ?, 0))',
+                (self.max_entries,)
+            )
+
+    def incr(self, counter: str) -> None:
+        """Increment a shared counter"""
+        conn = self.db.connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO counters (name, value) VALUES (?, 1) '
+                'ON CONFLICT(name) DO UPDATE SET value = value + 1',
+                (counter,)
+            )
+
+    def stats(self) -> Dict[str, any]:
+        """Counters and size of the cache"""
+        conn = self.db.connect()
+        counters = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+        stats = {name: counters.get(name, 0) for name in self.COUNTERS}
+        stats['entries'] = conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+        return self._with_hit_rate(stats)
+
+class RedisTranslationCache(TranslationCache):
+    """Redis translation cache shared by all nodes; read times are kept in a sorted set"""
+
+    KEY_PREFIX = 'translation:'
+    ACCESS_KEY = 'translation-access'
+    STATS_KEY = 'translation-stats'
+
+    def __init__(self, url: str, max_entries: int = 10000, ttl: int = 30 * 86400):
+        """Initialize with a redis:// URL, see SQLiteTranslationCache"""
+        import redis
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached translation or None"""
+        translation = self.redis.get(self.KEY_PREFIX + key)
+        if translation is not None:
+            now = time.time()
+            accessed_at = self.redis.zscore(self.ACCESS_KEY, key)
+            if accessed_at is None or accessed_at < now - self.ACCESS_RESOLUTION:
+                self.redis.zadd(self.ACCESS_KEY, {key: now})
+        return translation
+
+    def set(self, key: str, translation: str) -> None:
+        """Store a translation, evicting least recently used entries over the limit"""
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.set(self.KEY_PREFIX + key, translation, ex=self.ttl)
+        pipe.zadd(self.ACCESS_KEY, {key: now})
+        # Not read for a whole TTL means expired (an entry is read after it is stored)
+        pipe.zremrangebyscore(self.ACCESS_KEY, '-inf', now - self.ttl)
+        pipe.zcard(self.ACCESS_KEY)
+        entries = pipe.execute()[-1]
+        if entries > self.max_entries:
+            evicted = [member for member, _ in self.redis.zpopmin(self.ACCESS_KEY, entries - self.max_entries)]
+            if evicted:
+                self.redis.delete(*(self.KEY_PREFIX + member for member in evicted))
+
+    def incr(self, counter: str) -> None:
+        """Increment a shared counter"""
+        self.redis.hincrby(self.STATS_KEY, counter, 1)
+
+    def stats(self) -> Dict[str, any]:
+        """Counters and size of the cache"""
+        counters = self.redis.hgetall(self.STATS_KEY)
+        stats = {name: int(counters.get(name, 0)) for name in self.COUNTERS}
+        # Upper bound: expired entries leave the sorted set on the next store
+        stats['entries'] = self.redis.zcard(self.ACCESS_KEY)
+        return self._with_hit_rate(stats)
+
+def create_translation_cache(url: str, max_entries: int = 10000,
+                             ttl: int = 30 * 86400) -> Optional[TranslationCache]:
+    """Create a translation cache from a URL (sqlite:///path or redis://), None if empty"""
+    if not url:
+        return None
+    if url.startswith('sqlite:///'):
+        return SQLiteTranslationCache(url[len('sqlite:///'):], max_entries, ttl)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisTranslationCache(url, max_entries, ttl)
+    raise ValueError(f"Unsupported translation cache URL: {url}")